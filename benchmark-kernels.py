@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Micro-benchmarks of the numeric kernels in lib/ that every patch pays for.
+Each kernel is run for several numbers of rows, and time per row (ns/row)
+is reported. "compare" compares two results as benchmark-loaders.py does.
+"""
+
+import lib.algobase
+import lib.benchmark
+import lib.fits
+import lib.libwcs
+import lib.pipe_binary
+import lib.pipe_printf
+import lib.sourcetable
+import lib.synthetic
+from lib.misc import PoppingOrderedDict
+
+from lib.algo.base_PixelFlags import Algo_base_PixelFlags
+from lib.algo.base_PsfFlux import Algo_base_PsfFlux
+from lib.algo.base_SdssCentroid import Algo_base_SdssCentroid
+from lib.algo.base_SdssShape import Algo_base_SdssShape
+
+import numpy
+
+import collections
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Algorithms whose columns the catalog for "from_hdu", etc has
+tableAlgos = [Algo_base_PsfFlux, Algo_base_SdssCentroid, Algo_base_SdssShape, Algo_base_PixelFlags]
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        fromfile_prefix_chars='@',
+        description='Micro-benchmarks of the numeric kernels in lib/.')
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run = subparsers.add_parser("run", help="Run the kernels and write ns/row to a JSON file")
+    run.add_argument("output", help="JSON file to write")
+    run.add_argument("--kernels", nargs="+", choices=list(kernels), default=list(kernels), help="Kernels to run")
+    run.add_argument("--rows", type=float, nargs="+", default=[1e4, 1e5, 1e6, 1e7], help="Numbers of rows")
+    run.add_argument("--repeat", type=int, default=3, help="Number of measurements of which the best is taken")
+    run.add_argument("--min-time", type=float, default=0.05, help="A kernel is run repeatedly for at least this many seconds in each measurement")
+
+    comp = subparsers.add_parser("compare", help="Compare two JSON files")
+    lib.benchmark.add_compare_arguments(comp)
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        rows = [int(n) for n in args.rows]
+        workDir = tempfile.mkdtemp(prefix="benchmark-kernels-")
+        try:
+            metrics = run_kernels(args.kernels, rows, args.repeat, args.min_time, workDir)
+        finally:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+        lib.benchmark.save(args.output, {
+            "environment": lib.benchmark.get_environment(),
+            "parameters" : {"kernels": args.kernels, "rows": rows, "repeat": args.repeat, "minTime": args.min_time},
+            "metrics"    : metrics,
+        })
+    else:
+        lib.benchmark.compare_files(args)
+
+
+def run_kernels(names, rows, repeat, minTime, workDir):
+    """
+    Run kernels and measure them.
+    @return
+        Map from "{kernel}.{rows}.ns_per_row" -> ns/row
+    """
+    metrics = collections.OrderedDict()
+    for nRows in rows:
+        context = _Context(nRows, workDir)
+        for name in names:
+            func = kernels[name](context)
+            nsPerRow = measure(func, repeat, minTime) / nRows * 1e9
+            metric = "{}.{}.ns_per_row".format(name, nRows)
+            metrics[metric] = nsPerRow
+            print("{:50} {:12.2f}".format(metric, nsPerRow))
+            sys.stdout.flush()
+        context.close()
+
+    return metrics
+
+
+def measure(func, repeat, minTime):
+    """
+    Measure the time of func().
+    @return
+        Best time of a call (seconds).
+    """
+    loops = 1
+    while True:
+        elapsed = _time(func, loops)
+        if elapsed >= minTime:
+            break
+        loops = max(loops * 2, int(loops * minTime / max(elapsed, 1e-9)))
+
+    best = elapsed
+    for i in range(repeat - 1):
+        best = min(best, _time(func, loops))
+
+    return best / loops
+
+
+def _time(func, loops):
+    start = time.perf_counter()
+    for i in range(loops):
+        func()
+    return time.perf_counter() - start
+
+
+class _Context(object):
+    """
+    Input data shared by kernels for a number of rows.
+    Data are created on demand.
+    """
+    def __init__(self, nRows, workDir):
+        self.nRows = nRows
+        self.workDir = workDir
+        self.random = numpy.random.RandomState(nRows)
+        self.cache = {}
+
+    def get(self, key, create):
+        if key not in self.cache:
+            self.cache[key] = create()
+        return self.cache[key]
+
+    def wcs(self):
+        return self.get("wcs", lambda: lib.libwcs.Wcs(dict(lib.synthetic.get_tract_wcs_cards(0))))
+
+    def pixels(self):
+        return self.get("pixels", lambda: (
+            self.random.uniform(0, lib.synthetic.patchSize * lib.synthetic.patchesPerTract, self.nRows),
+            self.random.uniform(0, lib.synthetic.patchSize * lib.synthetic.patchesPerTract, self.nRows),
+        ))
+
+    def radec(self):
+        """
+        (ra, dec) in degrees
+        """
+        return self.get("radec", lambda: self.wcs().pixeltosky(*self.pixels()))
+
+    def jacobian(self):
+        return self.get("jacobian", lambda: self.wcs().pixeltosky_get_jacobian(*self.radec()))
+
+    def positives(self, n):
+        """
+        n arrays of positive values (float32) like moments or variances
+        """
+        return [
+            self.get(("positive", i), lambda: numpy.abs(self.random.normal(3.0, 1.0, self.nRows)).astype(numpy.float32))
+            for i in range(n)
+        ]
+
+    def catalog(self):
+        """
+        Path to a catalog of tableAlgos' columns
+        """
+        def create():
+            schema = lib.synthetic.get_schema(tableAlgos)
+            object_id = lib.synthetic.get_object_id(0, 0, self.nRows)
+            coord = lib.synthetic.get_patch_coord(0, 0, self.nRows, self.random)
+            data = lib.synthetic.generate_data(schema, object_id, coord, self.random)
+            path = os.path.join(self.workDir, "catalog-{}.fits".format(self.nRows))
+            lib.synthetic.write_catalog(path, schema, data)
+            return path
+        return self.get("catalog", create)
+
+    def table(self):
+        """
+        SourceTable read from catalog()
+        """
+        prefixes = ["id"] + lib.algobase.get_sourceprefixes(tableAlgos)
+        return self.get("table", lambda: lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open_table(self.catalog()), prefixes))
+
+    def algos(self):
+        """
+        Instances of tableAlgos constructed from table()
+        """
+        def create():
+            table = self.table()
+            table = lib.sourcetable.SourceTable(PoppingOrderedDict(table.fields), table.slots, table.fitsheader)
+            return [algoclass(table) for algoclass in tableAlgos]
+        return self.get("algos", create)
+
+    def fields(self):
+        """
+        List of (printf_format, [column]) to be COPY'ed, as loaders make it
+        """
+        def create():
+            object_id = lib.synthetic.get_object_id(0, 0, self.nRows)
+            fields = [("%ld", [object_id])]
+            for algo in self.algos():
+                transformed = type(algo).__new__(type(algo))
+                transformed.sourceTable = lib.sourcetable.SourceTable(PoppingOrderedDict(algo.sourceTable.fields), None, None)
+                lib.algobase._AlgoTransformer(transformed, None, 0, 0, "", None)._to_singleprecision()
+                fields += [(fmt, cols) for name, fmt, cols in transformed.get_backend_field_data("")]
+            return fields
+        return self.get("fields", create)
+
+    def close(self):
+        self.cache.clear()
+
+
+def _read_all(fin):
+    while fin.read(1 << 20):
+        pass
+
+
+def kernel_pixeltosky(context):
+    wcs = context.wcs()
+    x, y = context.pixels()
+    return lambda: wcs.pixeltosky(x, y)
+
+
+def kernel_get_jacobian(context):
+    wcs = context.wcs()
+    ra, dec = context.radec()
+    return lambda: wcs.pixeltosky_get_jacobian(ra, dec)
+
+
+def kernel_err(context):
+    jacobian = context.jacobian()
+    xx, xy, yy = context.positives(3)
+    return lambda: jacobian.pixeltosky_err(xx, xy, yy)
+
+
+def kernel_err_diag(context):
+    jacobian = context.jacobian()
+    xx, yy = context.positives(2)
+    return lambda: jacobian.pixeltosky_err_diag(xx, yy)
+
+
+def kernel_shape(context):
+    jacobian = context.jacobian()
+    xx, yy, xy = context.positives(3)
+    return lambda: jacobian.pixeltosky_shape(xx, yy, xy)
+
+
+def kernel_shape_err(context):
+    jacobian = context.jacobian()
+    values = context.positives(6)
+    return lambda: jacobian.pixeltosky_shape_err(*values)
+
+
+def kernel_shape_err_diag(context):
+    jacobian = context.jacobian()
+    values = context.positives(3)
+    return lambda: jacobian.pixeltosky_shape_err_diag(*values)
+
+
+def kernel_from_radec(context):
+    ra, dec = context.radec()
+    ra, dec = numpy.radians(ra), numpy.radians(dec)
+    return lambda: lib.sourcetable.Field_earth.from_radec("coord", ra, dec)
+
+
+def kernel_from_hdu(context):
+    path = context.catalog()
+    prefixes = ["id"] + lib.algobase.get_sourceprefixes(tableAlgos)
+    return lambda: lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open_table(path), prefixes)
+
+
+def kernel_cutout_subtable(context):
+    table = context.table()
+    def func():
+        copy = lib.sourcetable.SourceTable(PoppingOrderedDict(table.fields), table.slots, table.fitsheader)
+        copy.cutout_subtable("id")
+        for algoclass in tableAlgos:
+            copy.cutout_subtable(tuple(algoclass.sourceprefixes))
+    return func
+
+
+def kernel_dispatch(context):
+    table = context.table()
+    dispatcher = lib.algobase.PrefixDispatcher(PoppingOrderedDict((algoclass.__name__, algoclass) for algoclass in tableAlgos))
+    def func():
+        copy = lib.sourcetable.SourceTable(PoppingOrderedDict(table.fields), table.slots, table.fitsheader)
+        copy.cutout_subtable("id")
+        dispatcher.dispatch(copy)
+    return func
+
+
+def kernel_to_singleprecision(context):
+    algos = context.algos()
+    originals = [PoppingOrderedDict(algo.sourceTable.fields) for algo in algos]
+    def func():
+        for algo, fields in zip(algos, originals):
+            algo.sourceTable.fields = PoppingOrderedDict(fields)
+            lib.algobase._AlgoTransformer(algo, None, 0, 0, "", None)._to_singleprecision()
+    return func
+
+
+def kernel_pipe_printf(context):
+    fields = context.fields()
+    format = ("\t".join(fmt for fmt, cols in fields) + "\n").encode("utf-8")
+    columns = [col for fmt, cols in fields for col in cols]
+    return lambda: _read_all(lib.pipe_printf.open(format, *columns))
+
+
+def kernel_pipe_printf_forked(context):
+    fields = context.fields()
+    format = ("\t".join(fmt for fmt, cols in fields) + "\n").encode("utf-8")
+    columns = [col for fmt, cols in fields for col in cols]
+    return lambda: _read_all(lib.pipe_printf.open_forked(format, *columns))
+
+
+def kernel_pipe_binary(context):
+    fields = context.fields()
+    return lambda: _read_all(lib.pipe_binary.open(fields))
+
+
+kernels = collections.OrderedDict([
+    ("pixeltosky"            , kernel_pixeltosky),
+    ("pixeltosky_get_jacobian", kernel_get_jacobian),
+    ("jacobian.err"          , kernel_err),
+    ("jacobian.err_diag"     , kernel_err_diag),
+    ("jacobian.shape"        , kernel_shape),
+    ("jacobian.shape_err"    , kernel_shape_err),
+    ("jacobian.shape_err_diag", kernel_shape_err_diag),
+    ("from_radec"            , kernel_from_radec),
+    ("from_hdu"              , kernel_from_hdu),
+    ("cutout_subtable"       , kernel_cutout_subtable),
+    ("dispatch"              , kernel_dispatch),
+    ("to_singleprecision"    , kernel_to_singleprecision),
+    ("pipe_printf"           , kernel_pipe_printf),
+    ("pipe_printf.forked"    , kernel_pipe_printf_forked),
+    ("pipe_binary"           , kernel_pipe_binary),
+])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+End-to-end benchmark of the loaders (create-table-*.py).
+
+"run" loads a (generated) rerun into a throwaway PostgreSQL cluster
+and writes metrics to a JSON file. "compare" compares two JSON files
+and fails if any metric has regressed beyond a threshold.
+"""
+
+import lib.benchmark
+import lib.fits
+
+import glob
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+scriptDir = os.path.dirname(os.path.abspath(__file__))
+
+# Map from loader -> (script, kinds of catalogs that the loader reads)
+loaders = {
+    "forced": ("create-table-forced.py", ["ref", "forced"]),
+    "meas"  : ("create-table-meas.py"  , ["meas"]),
+    "random": ("create-table-random.py", ["ran"]),
+}
+
+# Stages recorded by --stage-times of the loaders
+stages = ["fits_open", "from_hdu", "transform", "encode", "copy", "index"]
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        fromfile_prefix_chars='@',
+        description='End-to-end benchmark of the loaders.')
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run = subparsers.add_parser("run", help="Run the loaders and write metrics to a JSON file")
+    run.add_argument("output", help="JSON file to write")
+    run.add_argument("--loaders", nargs="+", choices=sorted(loaders), default=["forced", "meas", "random"], help="Loaders to benchmark")
+    run.add_argument("--rerun-dir", help="Rerun directory to load. If not given, a synthetic one is generated.")
+    run.add_argument("--tracts", type=int, nargs="+", default=[0], help="Tracts of the synthetic rerun")
+    run.add_argument("--patches", type=int, default=2, help="Patches per side of each tract of the synthetic rerun")
+    run.add_argument("--filters", nargs="+", default=["g", "r", "i", "z", "y"], help="Filters of the synthetic rerun")
+    run.add_argument("--rows", type=int, default=10000, help="Objects per patch of the synthetic rerun")
+    run.add_argument("--pg-bin", default="", help="Directory of initdb and pg_ctl")
+    run.add_argument("--pg-option", metavar="key=value", action="append", default=[], help="Server parameter of the throwaway cluster")
+    run.add_argument("--db-server", metavar="key=value", nargs="+", action="append",
+        help="Use this existing DB instead of a throwaway cluster. A schema is created in it and dropped at the end.")
+    run.add_argument("--loader-args", default="", help="Extra arguments passed to the loaders (e.g. '--copy-format text')")
+    run.add_argument("--repeat", type=int, default=1, help="Run each loader this many times and keep the best")
+
+    comp = subparsers.add_parser("compare", help="Compare two JSON files")
+    lib.benchmark.add_compare_arguments(comp)
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        dbServer = None
+        if args.db_server:
+            dbServer = dict(keyvalue.split('=', 1) for keyvalue in itertools.chain.from_iterable(args.db_server))
+        results = run_benchmark(args.loaders, args.rerun_dir, args.tracts, args.patches, args.filters, args.rows,
+            args.pg_bin, args.pg_option, dbServer, args.loader_args.split(), args.repeat)
+        lib.benchmark.save(args.output, results)
+        lib.benchmark.print_comparison([(name, None, value, None, "") for name, value in sorted(results["metrics"].items())])
+    else:
+        lib.benchmark.compare_files(args)
+
+
+def run_benchmark(loaderNames, rerunDir, tracts, patches, filters, nRows, pgBin, pgOptions, dbServer, loaderArgs, repeat):
+    """
+    Run the loaders and measure them.
+    @return
+        {"environment": {...}, "parameters": {...}, "metrics": {name: value}}
+    """
+    workDir = tempfile.mkdtemp(prefix="benchmark-loaders-")
+    try:
+        if rerunDir:
+            skymapWcs = None
+        else:
+            rerunDir = os.path.join(workDir, "rerun")
+            skymapWcs = os.path.join(workDir, "skymap_wcs")
+            catalogs = sorted(set(itertools.chain.from_iterable(loaders[name][1] for name in loaderNames)))
+            subprocess.run([sys.executable, os.path.join(scriptDir, "generate-synthetic-rerun.py"), rerunDir,
+                "--tracts"] + [str(tract) for tract in tracts] + [
+                "--patches", str(patches), "--rows", str(nRows), "--skymap-wcs", skymapWcs,
+                "--filters"] + filters + ["--catalogs"] + catalogs,
+                check=True, stdout=subprocess.DEVNULL)
+
+        metrics = {}
+        for name in loaderNames:
+            best = None
+            for i in range(repeat):
+                if dbServer is None:
+                    with lib.benchmark.TempCluster(pgBin, pgOptions) as cluster:
+                        cluster.execute_file(os.path.join(scriptDir, "preparation.sql"))
+                        result = run_loader(name, rerunDir, skymapWcs, cluster.dbServer, "benchmark", loaderArgs, workDir)
+                else:
+                    schemaName = "benchmark_{}".format(os.getpid())
+                    try:
+                        result = run_loader(name, rerunDir, skymapWcs, dbServer, schemaName, loaderArgs, workDir)
+                    finally:
+                        drop_schema(dbServer, schemaName)
+
+                if best is None or result[name + ".seconds"] < best[name + ".seconds"]:
+                    best = result
+            metrics.update(best)
+
+        return {
+            "environment": lib.benchmark.get_environment(),
+            "parameters" : {
+                "loaders": loaderNames, "rerunDir": rerunDir if skymapWcs is None else None,
+                "tracts": tracts, "patches": patches, "filters": filters, "rows": nRows,
+                "loaderArgs": loaderArgs, "pgOptions": pgOptions, "repeat": repeat,
+            },
+            "metrics": metrics,
+        }
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+
+def run_loader(name, rerunDir, skymapWcs, dbServer, schemaName, loaderArgs, workDir):
+    """
+    Load a rerun with a loader, then create indexes, and measure them.
+    @return
+        dict of metrics "{name}.{metric}".
+    """
+    script, catalogs = loaders[name]
+    command = [sys.executable, os.path.join(scriptDir, script), rerunDir, schemaName] + loaderArgs
+    if skymapWcs:
+        command += ["--with-skymap-wcs", skymapWcs]
+    command += ["--db-server"] + ["{}={}".format(key, value) for key, value in dbServer.items()]
+
+    loadSeconds, loadRss = lib.benchmark.run_timed(
+        command + ["--stage-times", os.path.join(workDir, "load.json")], cwd=scriptDir)
+    indexSeconds, indexRss = lib.benchmark.run_timed(
+        command + ["--create-index", "--stage-times", os.path.join(workDir, "index.json")], cwd=scriptDir)
+
+    seconds = {}
+    copyBytes = 0
+    for path in ["load.json", "index.json"]:
+        with open(os.path.join(workDir, path)) as fin:
+            stageTimes = json.load(fin)
+        for stage, value in stageTimes["seconds"].items():
+            seconds[stage] = seconds.get(stage, 0.0) + value
+        copyBytes += stageTimes["bytes"].get("encode", 0)
+
+    # Rows are encoded while they are being copied.
+    # "copy" is reported without the time to encode them.
+    if "copy" in seconds:
+        seconds["copy"] -= seconds.get("encode", 0.0)
+
+    nRows, nBytes = get_input_size(rerunDir, catalogs)
+
+    metrics = {
+        name + ".seconds"         : loadSeconds + indexSeconds,
+        name + ".load_seconds"    : loadSeconds,
+        name + ".index_seconds"   : indexSeconds,
+        name + ".rows"            : nRows,
+        name + ".input_mb"        : nBytes / float(1 << 20),
+        name + ".rows_per_sec"    : nRows / loadSeconds,
+        name + ".mb_per_sec"      : nBytes / float(1 << 20) / loadSeconds,
+        name + ".copy_mb"         : copyBytes / float(1 << 20),
+        name + ".peak_rss_mb"     : max(loadRss, indexRss),
+    }
+    for stage in stages:
+        metrics[name + ".stage." + stage] = seconds.get(stage, 0.0)
+
+    return metrics
+
+
+def get_input_size(rerunDir, catalogs):
+    """
+    Get the number of objects and the number of bytes of the catalogs.
+    @param catalogs (list of str)
+        Kinds of catalogs: "ref", "forced", "meas", "ran".
+    @return (nRows, nBytes)
+        The number of objects is counted in the first kind of catalogs:
+        objects in a patch are counted only once however many filters there are.
+    """
+    patterns = {
+        "ref"   : "{rerunDir}/deepCoadd-results/merged/*/*,*/ref-*.fits*",
+        "forced": "{rerunDir}/deepCoadd-results/*/*/*,*/forced_src-*.fits*",
+        "meas"  : "{rerunDir}/deepCoadd-results/*/*/*,*/meas-*.fits*",
+        "ran"   : "{rerunDir}/deepCoadd-results/*/*/*,*/ran-*.fits*",
+    }
+
+    nBytes = 0
+    patchRows = {}
+    for i, catalog in enumerate(catalogs):
+        for path in glob.iglob(patterns[catalog].format(**locals())):
+            nBytes += os.path.getsize(path)
+            if i == 0:
+                patch = tuple(os.path.normpath(path).split(os.sep)[-3:-1])
+                header = lib.fits.fits_open_table(path[:-3] if path.endswith(".gz") else path).header
+                patchRows[patch] = max(patchRows.get(patch, 0), header["NAXIS2"])
+
+    return sum(patchRows.values()), nBytes
+
+
+def drop_schema(dbServer, schemaName):
+    import psycopg2
+    db = psycopg2.connect(**dbServer)
+    db.autocommit = True
+    with db.cursor() as cursor:
+        cursor.execute('DROP SCHEMA IF EXISTS "{}" CASCADE'.format(schemaName))
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
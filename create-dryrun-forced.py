@@ -22,17 +22,17 @@ import sys
 import lib.fits
 import lib.misc
 import lib.forced_algos
+import lib.algobase
 import lib.dbtable
 import lib.sourcetable
 import lib.common
 import lib.config
 from lib.misc import PoppingOrderedDict
-from lib.dpdd import DpddView
+from lib.dpdd import DpddView, DpddTable
 
 if lib.config.MULTICORE:
     from lib import pipe_printf
 
-import glob
 import io
 import itertools
 import os
@@ -81,6 +81,13 @@ def main():
                         help="Ingest data for specified tracts only if present. Else ingest all")
     parser.add_argument('--imageRerunDir', default=None, 
                         help="Root dir for finding images; defaults to rerunDir")
+    parser.add_argument('--materialize-dpdd', action='store_true',
+                        help="""Create dpdd as a table of primary objects, filled while
+                        patches are inserted, instead of a view. This option must be
+                        given every time the tables are created, inserted into or indexed.""")
+    parser.add_argument('--refresh-dpdd', metavar="TRACT", type=int, nargs='+',
+                        help="""Compute again the rows of the dpdd table in the given tracts
+                        from the loaded tables (only; don't insert data)""")
     args = parser.parse_args()
 
     if args.tracts is not None:
@@ -93,9 +100,12 @@ def main():
     lib.config.tableSpace = args.table_space
     lib.config.indexSpace = args.index_space
     lib.config.withSkymapWcs = args.with_skymap_wcs
+    lib.config.materializeDpdd = args.materialize_dpdd or bool(args.refresh_dpdd)
 
     filters = lib.common.get_existing_filters(args.rerunDir, hsc=False)
-    if args.create_index:
+    if args.refresh_dpdd:
+        refresh_dpdd(args.rerunDir, args.schemaName, args.refresh_dpdd)
+    elif args.create_index:
         create_index_on_mastertable(args.rerunDir, args.schemaName, filters)
     else:
         print("Invoking create_mastertable_if_not_exists")
@@ -161,7 +171,8 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName,
                 dm_schema = create_mastertable(cursor, rerunDir, schemaName, 
                                                masterTableName, filters,
                                                imageRerunDir)
-                create_view(cursor, schemaName, dm_schema)
+                create_view(cursor, rerunDir, schemaName, filters, dm_schema,
+                            imageRerunDir)
             db.commit()
         else:
             if bNeedView:
@@ -174,7 +185,8 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName,
                     return
 
                 with db.cursor() as cursor:
-                    create_view(cursor, schemaName, dm_schema)
+                    create_view(cursor, rerunDir, schemaName, filters,
+                                dm_schema, imageRerunDir)
                 db.commit()
             else:
                 db.close()
@@ -187,7 +199,8 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName,
             dm_schema = create_mastertable(cursor, rerunDir, schemaName, 
                                            masterTableName, filters, 
                                            imageRerunDir)
-            create_view(cursor, schemaName, dm_schema)
+            create_view(cursor, rerunDir, schemaName, filters, dm_schema,
+                        imageRerunDir)
         else:
             print("Master table already exists")
             print("pretend create anyway:")
@@ -196,7 +209,8 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName,
             dm_schema = create_mastertable(cursor, rerunDir, schemaName, 
                                            masterTableName, filters, 
                                            imageRerunDir)
-            create_view(cursor, schemaName, dm_schema)
+            create_view(cursor, rerunDir, schemaName, filters, dm_schema,
+                        imageRerunDir)
 def create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters,
                        imageRerunDir):
     """
@@ -243,25 +257,80 @@ def create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters,
     #  OMIT old view code,including table comment. We have no old-style views
 
 
-def create_view(cursor, schemaName, dm_schema):
+def get_dpdd_builder(schemaName, dm_schema):
     """
-    Creates dpdd view.
+    Get the object that makes the SQL (and the rows) of dpdd.
+    @param schemaName
+       Name of schema in which to locate dpdd
+    @param dm_schema
+       dm table schema version used to produce the data (None: 1)
+    @return
+       DpddTable if lib.config.materializeDpdd else DpddView
+    """
+    yaml_path = os.path.join(os.getenv('DPDD_YAML'),'native_to_dpdd.yaml')
+    yaml_override = os.path.join(os.getenv('DPDD_YAML'),
+                                 'postgres_override.yaml')
+    builder_class = DpddTable if lib.config.materializeDpdd else DpddView
+    return builder_class(schemaName, yaml_path=yaml_path,
+                         yaml_override=yaml_override,
+                         dm_schema_version=int(dm_schema or 1))
+
+
+def get_dpdd_input_tables(rerunDir, schemaName, filters, imageRerunDir=None):
+    """
+    Read a patch, and get the tables of native quantities from which
+    dpdd is computed, transformed as they are when inserted.
+    @return
+       List of (table: DBTable, filter: str).
+       filter is "" for band-independent tables.
+    """
+    if imageRerunDir == None: imageRerunDir = rerunDir
+    tract, patch, filter = get_an_existing_catalog_id(rerunDir, schemaName)
+    refPath = get_ref_path(rerunDir, tract, patch)
+    universals,object_id,coord,dm_schema = get_ref_schema_from_file(refPath)
+
+    tables = []
+    for table in universals.values():
+        table.transform(imageRerunDir, tract, patch, "", coord)
+        tables.append((table, ""))
+
+    for filter in filters:
+        catPath = get_catalog_path(rerunDir, tract, patch, filter, hsc=False,
+                                   schemaName=schemaName)
+        if not lib.common.path_exists(catPath):
+            continue
+        for table in get_catalog_schema_from_file(catPath, object_id).values():
+            table.transform(imageRerunDir, tract, patch, filter, coord)
+            tables.append((table, filter))
+
+    return tables
+
+
+def create_view(cursor, rerunDir, schemaName, filters, dm_schema,
+                imageRerunDir=None):
+    """
+    Creates dpdd view, or dpdd table if lib.config.materializeDpdd.
     @param cursor
        cursor for writing to db.  If None, just print
+    @param rerunDir
+       Path to the rerun directory, from a patch in which the types
+       of the columns of dpdd table are taken
     @param schemaName
        Name of schema in which to locate the view
+    @param filters
+       List of filter names
     @param dm_schema
        dm table schema version used to produce the data.  Naming conventions
        for native quantities vary somewhat depending on this version
 
     """
-    yaml_path = os.path.join(os.getenv('DPDD_YAML'),'native_to_dpdd.yaml')
-    yaml_override = os.path.join(os.getenv('DPDD_YAML'),
-                                 'postgres_override.yaml')
-    view_builder = DpddView(schemaName, yaml_path=yaml_path,
-                            yaml_override=yaml_override,
-                            dm_schema_version=int(dm_schema))
-    vs = view_builder.view_string()
+    view_builder = get_dpdd_builder(schemaName, dm_schema)
+    if lib.config.materializeDpdd:
+        tables = get_dpdd_input_tables(rerunDir, schemaName, filters,
+                                       imageRerunDir)
+        vs = view_builder.create_string(tables, lib.config.get_table_space())
+    else:
+        vs = view_builder.view_string()
     if cursor:
         cursor.execute(vs)
     else:
@@ -269,6 +338,34 @@ def create_view(cursor, schemaName, dm_schema):
         print(vs)
 
 
+def refresh_dpdd(rerunDir, schemaName, tracts):
+    """
+    Compute again the rows of dpdd table in the given tracts
+    from the tables of native quantities in the DB.
+    It is used e.g. after patches of the tracts have been inserted
+    without --materialize-dpdd.
+    @param rerunDir
+        Path to the rerun directory, from which dm schema version is read
+    @param schemaName
+        Name of the schema in which dpdd table is
+    @param tracts
+        List of tract numbers
+    """
+    tract, patch, filter = get_an_existing_catalog_id(rerunDir, schemaName)
+    refPath = get_ref_path(rerunDir, tract, patch)
+    universals,object_id,coord,dm_schema = get_ref_schema_from_file(refPath, headerOnly=True)
+    dpdd = get_dpdd_builder(schemaName, dm_schema)
+
+    db = lib.common.new_db_connection()
+    for tract in tracts:
+        with db.cursor() as cursor:
+            for statement in dpdd.refresh_strings(tract):
+                cursor.execute(statement)
+        db.commit()
+        print("Refreshed dpdd of tract {}".format(tract))
+    db.close()
+
+
 def insert_into_mastertable(rerunDir, schemaName, masterTableName, filters,
                             dryrun, tracts):
     """
@@ -358,6 +455,14 @@ def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters
             insert_patch_into_multibandtable(use_cursor, schemaName, tables, 
                                              object_id)
 
+        if lib.config.materializeDpdd:
+            dpdd = get_dpdd_builder(schemaName, dm_schema)
+            tables = [(table, "") for table in universals.values()]
+            for tablelist in multibands.values():
+                tables += tablelist
+            copy_into_table(use_cursor, schemaName, dpdd.tableName,
+                            dpdd.get_field_data(tables, object_id))
+
     if not dryrun:
         db.commit()
 
@@ -391,29 +496,46 @@ def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id):
     @param object_id
         numpy.array of object ID. This is used as the primary key.
     """
-    columns = [ object_id ]
-    fieldNames = [ "object_id" ]
-    format = "%ld"
-
+    members = [ ("object_id", "%ld", [object_id]) ]
     for table, filter in tables:
-        for name, fmt, cols in table.get_backend_field_data(filter):
-            columns.extend(cols)
-            fieldNames.append(name)
-            format += "\t" + fmt
+        members += table.get_backend_field_data(filter)
+
+    copy_into_table(cursor, schemaName, table.name, members)
+
+def copy_into_table(cursor, schemaName, tableName, members):
+    """
+    Copy rows into a table.
+    @param cursor
+        DB connection's cursor object. If None just pretend.
+    @param schemaName
+        Name of the schema in which the table is
+    @param tableName
+        Name of the table
+    @param members
+        List of (fieldname, printf_format, [column]).
+    """
+    columns = []
+    fieldNames = []
+    formats = []
 
-    format += "\n"
+    for name, fmt, cols in members:
+        columns.extend(cols)
+        fieldNames.append(name)
+        formats.append(fmt)
+
+    format = "\t".join(formats) + "\n"
     format = format.encode("utf-8")
 
     if lib.config.MULTICORE:
         fin = pipe_printf.open(format, *columns)
         if cursor is not None:
-            cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), 
+            cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, tableName), 
                              sep='\t', columns=fieldNames)
     else:
         tsv = b''.join(format % tpl for tpl in zip(*columns))
         fin = io.BytesIO(tsv)
         if cursor is not None:
-            cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), 
+            cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, tableName), 
                              sep='\t', size=-1, columns=fieldNames)
 
 
@@ -433,8 +555,8 @@ def create_index_on_mastertable(rerunDir, schemaName, filters):
                                schemaName=schemaName)
     refPath = get_ref_path    (rerunDir, tract, patch)
 
-    universals, object_id, coord, dm_schema = get_ref_schema_from_file(refPath)
-    multibands = get_catalog_schema_from_file(catPath, object_id)
+    universals, object_id, coord, dm_schema = get_ref_schema_from_file(refPath, headerOnly=True)
+    multibands = get_catalog_schema_from_file(catPath, object_id, headerOnly=True)
 
     for table in itertools.chain(universals.values(), multibands.values()):
         table.set_filters(filters)
@@ -449,6 +571,12 @@ def create_index_on_mastertable(rerunDir, schemaName, filters):
             else:
                 table.create_index(cursor, schemaName)
                 db.commit()
+
+        if lib.config.materializeDpdd:
+            dpdd = get_dpdd_builder(schemaName, dm_schema)
+            for statement in dpdd.index_strings(lib.config.get_index_space()):
+                cursor.execute(statement)
+                db.commit()
     #db.commit()
 
 
@@ -468,8 +596,8 @@ def drop_index_from_mastertable(rerunDir, schemaName, filters):
                                schemaName=schemaName)
     refPath = get_ref_path   (rerunDir, tract, patch)
 
-    universals, object_id, coord, dm_schema = get_ref_schema_from_file(refPath)
-    multibands = get_catalog_schema_from_file(catPath, object_id)
+    universals, object_id, coord, dm_schema = get_ref_schema_from_file(refPath, headerOnly=True)
+    multibands = get_catalog_schema_from_file(catPath, object_id, headerOnly=True)
 
     for table in itertools.chain(universals.values(), multibands.values()):
         table.set_filters(filters)
@@ -478,13 +606,21 @@ def drop_index_from_mastertable(rerunDir, schemaName, filters):
     with db.cursor() as cursor:
         for table in itertools.chain(universals.values(), multibands.values()):
             table.drop_index(cursor, schemaName)
+
+        if lib.config.materializeDpdd:
+            dpdd = get_dpdd_builder(schemaName, dm_schema)
+            for statement in dpdd.drop_index_strings():
+                cursor.execute(statement)
     db.commit()
 
-def get_ref_schema_from_file(path):
+def get_ref_schema_from_file(path, headerOnly=False):
     """
     Get fields in a "ref-*.fits" file.
     @param path
         Path to a "ref-*.fits" file
+    @param headerOnly
+        Read the header only. The tables are empty, which suffices
+        to know their names and columns (e.g. to create indexes).
     @return (dbtables, object_id, coord)
         * "dbtables" is PoppingOrderedDict mapping name: str -> table: DBTable,
         * "object_id" is a numpy.array of object_id,
@@ -492,7 +628,9 @@ def get_ref_schema_from_file(path):
             in which angles are in degrees.
         * "dm_schema_version" Value of 'AFW_TABLE_VERSION' keyword
     """
-    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open(path)[1])
+    # Read only the fields that the algorithms take
+    prefixes = ["id"] + lib.algobase.get_sourceprefixes(lib.forced_algos.ref_algos.values())
+    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open_table(path, headerOnly=headerOnly), prefixes)
 
     dm_schema_version = table.dm_schema_version()
 
@@ -501,21 +639,15 @@ def get_ref_schema_from_file(path):
     # named 'object_id'
     object_id = table.cutout_subtable("id").fields["id"].data
 
+    subtables = lib.forced_algos.ref_dispatcher.dispatch(table)
+
     algos = PoppingOrderedDict(
-        (name, algoclass(table))
+        (name, algoclass(subtables[name]))
         for name, algoclass in lib.forced_algos.ref_algos.items()
     )
 
     coord = algos["ref_coord"].coord
 
-    # To suppress warnings "Ignored field: ...",
-    # ignore the fields explicitly.
-    def ignore(prefix):
-        table.cutout_subtable(prefix)
-
-    for name in lib.forced_algos.ref_algos_ignored:
-        ignore(name)
-
     for field in table.fields:
         lib.misc.warning('Ignored field: ', field, 'in', path)
 
@@ -695,37 +827,36 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
         """.format(**locals())
         )
 
-def get_catalog_schema_from_file(path, object_id):
+def get_catalog_schema_from_file(path, object_id, headerOnly=False):
     """
     Get fields in a "forced_src-*.fits" file.
     @param path
         Path to a "forced-*.fits" file
     @param object_id
         numpy.array of object ID from the corresponding "ref-*.fits" file.
+    @param headerOnly
+        Read the header only. The tables are empty, which suffices
+        to know their names and columns (e.g. to create indexes).
     @return
         PoppingOrderedDict mapping name: str -> table: DBTable.
     """
 
-    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open(path)[1])
+    # Read only the fields that the algorithms take
+    prefixes = ["id"] + lib.algobase.get_sourceprefixes(lib.forced_algos.forced_algos.values())
+    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open_table(path, headerOnly=headerOnly), prefixes)
 
     these_object_id = table.cutout_subtable("id").fields["id"].data
 
     if not numpy.all(these_object_id == object_id):
         raise RuntimeError("object_id in forced_src doesn't agree with ref " + path)
 
+    subtables = lib.forced_algos.forced_dispatcher.dispatch(table)
+
     algos = PoppingOrderedDict(
-        (name, algoclass(table))
+        (name, algoclass(subtables[name]))
         for name, algoclass in lib.forced_algos.forced_algos.items()
     )
 
-    # To suppress warnings "Ignored field: ...",
-    # ignore the fields explicitly.
-    def ignore(prefix):
-        table.cutout_subtable(prefix)
-
-    for name in lib.forced_algos.forced_algos_ignored:
-        ignore(name)
-
     for field in table.fields:
         lib.misc.warning('Ignored field: ', field, 'in', path)
 
@@ -789,15 +920,7 @@ def get_existing_patches(rerunDir, tract):
     @return
         List of tract numbers, sorted.
     """
-    patches = set(
-        os.path.basename(os.path.dirname(path))
-        for path in glob.iglob("{rerunDir}/deepCoadd-results/merged/{tract}/*,*/ref-*".format(**locals()))
-        if path.endswith('.fits') or path.endswith('.fits.gz')
-    )
-
-    return sorted(set(
-        lib.common.patch_to_number(patch) for patch in patches if re.match(r'^[0-9]+,[0-9]+$', patch)
-    ))
+    return lib.common.get_existing_patches(rerunDir, tract, "merged", "ref")
 
 def get_ref_path(rerunDir, tract, patch):
     """
@@ -835,7 +958,7 @@ def get_an_existing_catalog_id(rerunDir, schemaName):
     pattern = get_catalog_path(rerunDir, "*", "*", "*", False, schemaName)
     #print('pattern from get_catalog_path is {pattern}'.format(**locals()))
 
-    for catPath in itertools.chain(glob.iglob(pattern), glob.iglob(pattern + ".gz")):
+    for catPath in lib.common.iglob_compressed(pattern):
         tract, patch, filter = lib.common.path_decompose(catPath)
 
         refPath = get_ref_path(rerunDir, tract, patch)
@@ -21,6 +21,7 @@ import psycopg2
 import lib.fits
 import lib.misc
 import lib.meas_algos
+import lib.algobase
 import lib.dbtable
 import lib.sourcetable
 import lib.common
@@ -30,11 +31,9 @@ from lib.misc import PoppingOrderedDict
 if lib.config.MULTICORE:
     from lib import pipe_printf
 
-import glob
 import io
 import itertools
 import os
-import re
 import sys
 import textwrap
 
@@ -473,7 +472,7 @@ def create_index_on_mastertable(rerunDir, schemaName, filters):
     tract, patch, filter = get_an_exisiting_catalog_id(rerunDir)
     catPath = get_catalog_path(rerunDir, tract, patch, filter)
 
-    tablePosition, multibands = get_catalog_schema_from_file(catPath, None)
+    tablePosition, multibands = get_catalog_schema_from_file(catPath, None, headerOnly=True)
 
     for table in itertools.chain([tablePosition], multibands.values()):
         table.set_filters(filters)
@@ -499,7 +498,7 @@ def drop_index_from_mastertable(rerunDir, schemaName, filters):
     tract, patch, filter = get_an_exisiting_catalog_id(rerunDir)
     catPath = get_catalog_path(rerunDir, tract, patch, filter)
 
-    tablePosition, multibands = get_catalog_schema_from_file(catPath, None)
+    tablePosition, multibands = get_catalog_schema_from_file(catPath, None, headerOnly=True)
 
     for table in itertools.chain([tablePosition], multibands.values()):
         table.set_filters(filters)
@@ -511,13 +510,16 @@ def drop_index_from_mastertable(rerunDir, schemaName, filters):
     db.commit()
 
 
-def get_catalog_schema_from_file(path, tablePosition):
+def get_catalog_schema_from_file(path, tablePosition, headerOnly=False):
     """
     Get fields in a "meas-*.fits" file.
     @param path
         Path to a "ref-*.fits" file
     @param tablePosition
         DBTable_Position object (optional).
+    @param headerOnly
+        Read the header only. The tables are empty, which suffices
+        to know their names and columns (e.g. to create indexes).
     @return (tablePosition, dbtables)
         * tablePosition: DBTable_Position object.
             It is the same object (though modified)
@@ -526,7 +528,9 @@ def get_catalog_schema_from_file(path, tablePosition):
         * dbtables: PoppingOrderedDict mapping name: str -> table: DBTable.
     """
 
-    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open(path)[1])
+    # Read only the fields that the algorithms take
+    prefixes = ["id"] + lib.algobase.get_sourceprefixes(lib.meas_algos.meas_algos.values())
+    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open_table(path, headerOnly=headerOnly), prefixes)
 
     these_object_id = table.cutout_subtable("id").fields["id"].data
 
@@ -536,20 +540,15 @@ def get_catalog_schema_from_file(path, tablePosition):
     if (object_id is not None) and (not numpy.all(these_object_id == object_id)):
         raise RuntimeError("object_id in meas doesn't agree with other of different filter: " + path)
 
+    subtables = lib.meas_algos.meas_dispatcher.dispatch(table)
+
     algos = PoppingOrderedDict(
-        (name, algoclass(table))
+        (name, algoclass(subtables[name]))
         for name, algoclass in lib.meas_algos.meas_algos.items()
     )
 
-    coordfields = table.fields.pop_many(["coord_ra", "coord_dec"])
-
-    # To suppress warnings "Ignored field: ...",
-    # ignore the fields explicitly.
-    def ignore(prefix):
-        table.cutout_subtable(prefix)
-
-    for name in lib.meas_algos.meas_algos_ignored:
-        ignore(name)
+    # meas_coord leaves "coord_ra" and "coord_dec" for add_coord()
+    coordfields = subtables["meas_coord"].fields.pop_many(["coord_ra", "coord_dec"])
 
     for field in table.fields:
         lib.misc.warning('Ignored field: ', field, 'in', path)
@@ -638,7 +637,7 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
         indexSpace = lib.config.get_index_space()
 
         cursor.execute("""
-        CREATE INDEX
+        CREATE INDEX IF NOT EXISTS
             "{self.name}_parent_id_idx"
         ON
             "{schemaName}"."{self.name}"
@@ -648,7 +647,7 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
         """.format(**locals())
         )
         cursor.execute("""
-        CREATE INDEX
+        CREATE INDEX IF NOT EXISTS
             "{self.name}_skymap_id_idx"
         ON
             "{schemaName}"."{self.name}"
@@ -660,7 +659,7 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
         for filter in self.filters:
             filt = lib.common.filterToShortName[filter] + "_"
             cursor.execute("""
-            CREATE INDEX
+            CREATE INDEX IF NOT EXISTS
                 "{self.name}_{filt}coord_idx"
             ON
                 "{schemaName}"."{self.name}"
@@ -705,15 +704,7 @@ def get_existing_patches(rerunDir, tract):
     @return
         List of tract numbers, sorted.
     """
-    patches = set(
-        os.path.basename(os.path.dirname(path))
-        for path in glob.iglob("{rerunDir}/deepCoadd-results/*/{tract}/*,*/meas-*".format(**locals()))
-        if path.endswith('.fits') or path.endswith('.fits.gz')
-    )
-
-    return sorted(set(
-        lib.common.patch_to_number(patch) for patch in patches if re.match(r'^[0-9]+,[0-9]+$', patch)
-    ))
+    return lib.common.get_existing_patches(rerunDir, tract, "*", "meas")
 
 
 def get_catalog_path(rerunDir, tract, patch, filter):
@@ -733,7 +724,7 @@ def get_an_exisiting_catalog_id(rerunDir):
     """
     pattern = get_catalog_path(rerunDir, "*", "*", "*")
 
-    for imagePath in itertools.chain(glob.iglob(pattern), glob.iglob(pattern + ".gz")):
+    for imagePath in lib.common.iglob_compressed(pattern):
         tract, patch, filter = lib.common.path_decompose(imagePath)
         return tract, patch, filter
 
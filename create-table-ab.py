@@ -21,20 +21,26 @@ import psycopg2
 import lib.fits
 import lib.misc
 import lib.ab_algos
+import lib.algobase
 import lib.dbtable
 import lib.sourcetable
 import lib.common
 import lib.config
+import lib.patchpool
+import lib.indexbuilder
+import lib.filesync
+import lib.layout
+import lib.workqueue
 from lib.misc import PoppingOrderedDict
 
+from lib import pipe_binary
 if lib.config.MULTICORE:
     from lib import pipe_printf
 
-import glob
+import functools
 import io
 import itertools
 import os
-import re
 import sys
 import warnings
 import textwrap
@@ -54,6 +60,11 @@ def main():
     parser.add_argument("--index-space", default="", help="DB table space for indexes")
     parser.add_argument("--db-server", metavar="key=value", nargs="+", action="append", help="DB to connect to. This option must come later than non-optional arguments.")
 
+    parser.add_argument("--manifest", metavar="FILE", default="",
+        help="""Find catalogs in the manifest (an SQLite file) of the rerun directory instead of searching the directory.
+            The manifest is created if it does not exist, and it is updated for directories modified since the last run.
+        """
+    )
     parser.add_argument("--with-skymap-wcs", action="store",
         help="""Use skymap_wcs at the specified path instead of calexp-*.fits.
             To generate skymap_wcs, run 'generate-skymap_wcs.py skyMap.pickle'
@@ -62,6 +73,42 @@ def main():
 
     parser.add_argument('--create-index',  action='store_true',
        help="Create index (only; don't insert data)")
+    parser.add_argument('--index-jobs', type=int, default=1,
+       help="Number of DB connections with which to create indexes in parallel")
+    parser.add_argument('--maintenance-work-mem', default="",
+       help="maintenance_work_mem (e.g. 4GB) of each connection that creates indexes")
+    parser.add_argument('--max-parallel-maintenance-workers', type=int, default=None,
+       help="max_parallel_maintenance_workers of each connection that creates indexes")
+    parser.add_argument('--jobs', type=int, default=1,
+       help="Number of worker processes that insert patches in parallel")
+    parser.add_argument('--copy-format', choices=["binary", "text"], default="binary",
+       help="Data format with which to COPY rows into the DB")
+    parser.add_argument('--sync', action='store_true',
+       help="""Reload patches whose files have been changed (in size, mtime and contents) or added
+            since they were loaded. Their rows are deleted before they are loaded again.""")
+    parser.add_argument('--pack-flags', action='store_true',
+       help="""Store the flags of each algorithm in Bigint bitmasks instead of Boolean columns.
+            The views show the flags as before. This option must be given every time the tables are created or inserted into.""")
+    parser.add_argument('--dedupe-aliases', action='store_true',
+       help="""Store fields aliased in the catalogs (ALIAS in the header) only once in a table.
+            The views show the aliases as before. This option must be given every time the tables are created or inserted into.""")
+    parser.add_argument('--layout', metavar="FILE",
+       help="""Physical layout of the tables planned by 'plan-capacity.py --optimize-layout FILE'.
+            This option must be given every time the tables are created or inserted into.
+            The file is rewritten if the catalogs have values that the layout cannot hold.""")
+    parser.add_argument('--queue', action='store_true',
+       help="""Take patches from a queue in the DB, which loaders on other hosts share.
+            Every loader adds the patches it finds to the queue, and they are inserted only once (See show-queue.py).""")
+    parser.add_argument('--queue-stale', type=float, default=600, metavar="SECONDS",
+       help="Take over patches whose loaders have not sent heartbeats for this many seconds")
+    parser.add_argument('--bulk-mode', action='store_true',
+       help="""Create tables UNLOGGED, insert data with synchronous_commit off,
+            and freeze the tables and set them LOGGED at the end.
+            Data being loaded is lost if the DB server crashes.""")
+
+    parser.add_argument('--stage-times', metavar="FILE",
+       help="""Write the time spent in each stage of loading (reading FITS, transforming, encoding, COPY, indexing)
+            to FILE in JSON. Only the time spent in this process is counted: use it without --jobs.""")
 
     args = parser.parse_args()
 
@@ -71,18 +118,37 @@ def main():
     lib.config.tableSpace = args.table_space
     lib.config.indexSpace = args.index_space
     lib.config.withSkymapWcs = args.with_skymap_wcs
+    lib.config.manifest = args.manifest
+    lib.config.indexJobs = args.index_jobs
+    lib.config.maintenanceWorkMem = args.maintenance_work_mem
+    lib.config.maxParallelMaintenanceWorkers = args.max_parallel_maintenance_workers
+    lib.config.copyFormat = args.copy_format
+    lib.config.bulkMode = args.bulk_mode
+    lib.config.hashFiles = args.sync
+    lib.config.packFlags = args.pack_flags
+    lib.config.dedupeAliases = args.dedupe_aliases
+    lib.config.layout = lib.layout.load(args.layout) if args.layout else {}
+    lib.config.layoutPath = args.layout or ""
+    lib.config.queueStaleSeconds = args.queue_stale
 
     filters = lib.common.get_existing_filters(args.rerunDir)
     if args.create_index:
         create_index_on_mastertable(args.rerunDir, args.schemaName, filters)
     else:
-        create_mastertable_if_not_exists(args.rerunDir, args.schemaName, args.table_name, filters)
-        insert_into_mastertable(args.rerunDir, args.schemaName, args.table_name, filters)
+        with lib.workqueue.exclusive(args.schemaName, "ab", args.queue):
+            create_mastertable_if_not_exists(args.rerunDir, args.schemaName, args.table_name, filters, args.jobs)
+        insert_into_mastertable(args.rerunDir, args.schemaName, args.table_name, filters, args.jobs, args.sync, args.queue)
+        if lib.config.bulkMode and (not args.queue or lib.workqueue.is_drained(args.schemaName, "ab")):
+            set_mastertable_logged(args.rerunDir, args.schemaName)
 
+    if args.stage_times:
+        lib.misc.dump_stage_times(args.stage_times)
 
-def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName, filters):
+
+def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName, filters, jobs=1):
     """
     Create the master table if it does not exist.
+    The layout (lib.config.layout) is fitted to all the patches before the master table is created.
     @param rerunDir
         Path to the rerun directory from which to generate the master table
     @param schemaName
@@ -91,6 +157,8 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName, filt
         Name of the master table
     @param filters
         List of filter names
+    @param jobs
+        Number of worker processes that read the patches to fit the layout to.
     """
     bNeedCreating = False
 
@@ -103,12 +171,21 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName, filt
             db.rollback()
 
     if bNeedCreating:
+        if lib.config.layout:
+            lib.layout.fit(functools.partial(read_patch_tables, rerunDir, filters), [
+                (tract, patch)
+                for tract in lib.common.get_existing_tracts(rerunDir)
+                for patch in get_existing_patches(rerunDir, tract)
+            ], jobs)
         with db.cursor() as cursor:
             cursor.execute('CREATE SCHEMA IF NOT EXISTS "{schemaName}"'.format(**locals()))
             create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters)
         db.commit()
     else:
         db.close()
+        # The layout may have been fitted by the loader that created the master table.
+        if lib.config.layoutPath:
+            lib.config.layout = lib.layout.load(lib.config.layoutPath)
         drop_index_from_mastertable(rerunDir, schemaName, filters)
 
 
@@ -242,7 +319,7 @@ def create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters):
         """.format(**locals()), dict(comment = commentOnTable)
         )
 
-def insert_into_mastertable(rerunDir, schemaName, masterTableName, filters):
+def insert_into_mastertable(rerunDir, schemaName, masterTableName, filters, jobs=1, sync=False, queue=False):
     """
     Insert data into the master table.
     The data will actually flow not into the master table but into its children.
@@ -254,10 +331,90 @@ def insert_into_mastertable(rerunDir, schemaName, masterTableName, filters):
         Name of the master table
     @param filters
         List of filter names
+    @param jobs
+        Number of worker processes that insert patches in parallel
+    @param sync
+        Reload patches whose files have been changed since they were loaded.
+    @param queue
+        Take patches from the queue shared with loaders on other hosts (See lib.workqueue).
+        "jobs" worker processes are started in this host.
+    """
+    # Loaders on other hosts may be doing the same at the same time.
+    with lib.workqueue.exclusive(schemaName, "ab", queue):
+        # The registry of inserted patches must exist before workers start
+        # lest they should race to create it.
+        db = lib.common.new_db_connection()
+        with db.cursor() as cursor:
+            create_patch_registry_if_not_exists(cursor, schemaName)
+            lib.filesync.create_file_registry_if_not_exists(cursor, schemaName, "ab")
+        db.commit()
+        db.close()
+
+        patches = [
+            (tract, patch)
+            for tract in lib.common.get_existing_tracts(rerunDir)
+            for patch in get_existing_patches(rerunDir, tract)
+        ]
+
+        changed = []
+        if sync:
+            changed = sync_patches(rerunDir, schemaName, filters, patches, jobs)
+
+        if queue:
+            lib.workqueue.enqueue(schemaName, "ab", patches, changed)
+
+    if queue:
+        lib.workqueue.insert_patches(
+            functools.partial(insert_patch_into_mastertable, rerunDir, schemaName, masterTableName, filters),
+            schemaName, "ab", jobs
+        )
+        return
+
+    lib.patchpool.insert_patches(
+        functools.partial(insert_patch_into_mastertable, rerunDir, schemaName, masterTableName, filters),
+        patches, jobs
+    )
+
+
+def sync_patches(rerunDir, schemaName, filters, patches, jobs=1):
+    """
+    Delete patches whose files have been changed since they were loaded
+    so that they will be loaded again (See lib.filesync.sync_patches()).
+    @param rerunDir
+        Path to the rerun directory from which to generate the master table
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param filters
+        List of filter names
+    @param patches
+        List of (tract, patch)
+    @param jobs
+        Number of threads with which to hash files.
+    @return
+        List of (tract, patch) deleted.
     """
-    for tract in lib.common.get_existing_tracts(rerunDir):
-        for patch in get_existing_patches(rerunDir, tract):
-            insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters, tract, patch)
+    tract, patch, filter = get_an_exisiting_catalog_id(rerunDir)
+    catPath = get_catalog_path(rerunDir, tract, patch, filter)
+
+    multibands, object_id, coord = get_catalog_schema_from_file(catPath, None, headerOnly=True)
+    tables = list(multibands.values())
+
+    patchFiles = {}
+    for tract, patch in patches:
+        catPaths = {}
+        for filter in filters:
+            catPath = get_catalog_path(rerunDir, tract, patch, filter)
+            if lib.common.path_exists(catPath):
+                catPaths[filter] = catPath
+        if catPaths:
+            patchFiles[tract, patch] = lib.filesync.get_file_ids(tract, patch, catPaths)
+
+    db = lib.common.new_db_connection()
+    changed = lib.filesync.sync_patches(db, schemaName, "ab", patchFiles,
+        lambda tract: [table.get_load_table_name(tract) for table in tables], jobs)
+    db.close()
+
+    return changed
 
 
 def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters, tract, patch):
@@ -277,42 +434,70 @@ def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters
     @param patch
         Patch number (x*100 + y)
     """
-    catPaths = {}
-    for filter in filters:
-        catPath = get_catalog_path(rerunDir, tract, patch, filter)
-        if lib.common.path_exists(catPath):
-            catPaths[filter] = catPath
-
+    catPaths = get_catalog_paths(rerunDir, tract, patch, filters)
     if not catPaths:
         return
 
-    db = lib.common.new_db_connection()
+    db = lib.patchpool.get_db_connection()
     with db.cursor() as cursor:
         if is_patch_already_inserted(cursor, schemaName, tract, patch, catPaths.keys()):
             lib.misc.warning("Skip because already inserted: (tract,patch) = ({tract}, {patch})".format(**locals()))
+            db.rollback()
             return
 
-        object_id = None
-        multibands = {}
-        for filter, catPath in catPaths.items():
-            if object_id is None:
-                mult, object_id, coord = get_catalog_schema_from_file(catPath, None)
-            else:
-                mult, dummy, dummy2 = get_catalog_schema_from_file(catPath, object_id)
-
-            for table in mult.values():
-                table.transform(rerunDir, tract, patch, filter, coord)
-
-                if table.name not in multibands:
-                    multibands[table.name] = []
-                multibands[table.name].append((table, filter))
+        lib.filesync.register_files(cursor, schemaName, "ab", lib.filesync.get_file_records(
+            lib.filesync.get_file_ids(tract, patch, catPaths)))
 
+        multibands, object_id = read_patch(rerunDir, tract, patch, catPaths)
         for tables in multibands.values():
             insert_patch_into_multibandtable(cursor, schemaName, tables, object_id)
 
     db.commit()
 
 
+def read_patch(rerunDir, tract, patch, catPaths):
+    """
+    Read and transform the catalogs of a patch.
+    @param rerunDir
+        Path to the rerun directory from which to generate the master table
+    @param tract
+        Tract number.
+    @param patch
+        Patch number (x*100 + y)
+    @param catPaths
+        Dictionary mapping filter name -> path to "forced_src_undeblendedConvolved-*.fits"
+    @return (multibands, object_id)
+        * "multibands" is a dictionary mapping table name -> list of (table: DBTable, filter: str)
+        * "object_id" is the numpy.array of object ID.
+    """
+    object_id = None
+    multibands = {}
+    for filter, catPath in catPaths.items():
+        if object_id is None:
+            mult, object_id, coord = get_catalog_schema_from_file(catPath, None)
+        else:
+            mult, dummy, dummy2 = get_catalog_schema_from_file(catPath, object_id)
+
+        for table in mult.values():
+            table.transform(rerunDir, tract, patch, filter, coord)
+
+            if table.name not in multibands:
+                multibands[table.name] = []
+            multibands[table.name].append((table, filter))
+
+    return multibands, object_id
+
+
+def read_patch_tables(rerunDir, filters, tract, patch):
+    """
+    Read and transform the tables of a patch (See lib.layout.fit()).
+    @return
+        List of (table: DBTable, filter: str)
+    """
+    multibands, object_id = read_patch(rerunDir, tract, patch, get_catalog_paths(rerunDir, tract, patch, filters))
+    return list(itertools.chain.from_iterable(multibands.values()))
+
+
 def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id):
     """
     Insert a patch into a multiband table.
@@ -330,23 +515,30 @@ def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id):
     columns = [ object_id ]
     fieldNames = [ "object_id" ]
     format = "%ld"
+    fields = [ ("%ld", [ object_id ]) ]
 
     for table, filter in tables:
         for name, fmt, cols in table.get_backend_field_data(filter):
             columns.extend(cols)
             fieldNames.append(name)
             format += "\t" + fmt
+            fields.append((fmt, cols))
 
     format += "\n"
     format = format.encode("utf-8")
 
-    if lib.config.MULTICORE:
-        fin = pipe_printf.open(format, *columns)
-        cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), sep='\t', columns=fieldNames)
-    else:
-        tsv = b''.join(format % tpl for tpl in zip(*columns))
-        fin = io.BytesIO(tsv)
-        cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), sep='\t', size=-1, columns=fieldNames)
+    with lib.misc.stage_time("copy"):
+        if lib.config.copyFormat == "binary" and pipe_binary.is_supported(cursor.connection, fields):
+            fin = lib.misc.TimedReader("encode", pipe_binary.open(fields))
+            cursor.copy_expert(pipe_binary.copy_command('"{}"."{}"'.format(schemaName, table.name), fieldNames), fin, size=1<<20)
+        elif lib.config.MULTICORE:
+            fin = lib.misc.TimedReader("encode", pipe_printf.open(format, *columns))
+            cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), sep='\t', columns=fieldNames)
+        else:
+            with lib.misc.stage_time("encode"):
+                tsv = b''.join(format % tpl for tpl in zip(*columns))
+            fin = io.BytesIO(tsv)
+            cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), sep='\t', size=-1, columns=fieldNames)
 
 
 def create_index_on_mastertable(rerunDir, schemaName, filters):
@@ -363,16 +555,40 @@ def create_index_on_mastertable(rerunDir, schemaName, filters):
     tract, patch, filter = get_an_exisiting_catalog_id(rerunDir)
     catPath = get_catalog_path(rerunDir, tract, patch, filter)
 
-    multibands, object_id, coord = get_catalog_schema_from_file(catPath, None)
+    multibands, object_id, coord = get_catalog_schema_from_file(catPath, None, headerOnly=True)
 
     for table in multibands.values():
         table.set_filters(filters)
 
+    builder = lib.indexbuilder.IndexBuilder()
+    for table in multibands.values():
+        table.create_index(builder.cursor(), schemaName)
+    builder.run()
+
+
+def set_mastertable_logged(rerunDir, schemaName):
+    """
+    Freeze the master table's children, which were created UNLOGGED
+    in bulk mode, and set them LOGGED.
+    @param rerunDir
+        Path to the rerun directory from which to generate the master table
+    @param schemaName
+        Name of the schema in which to locate the master table
+    """
+    tract, patch, filter = get_an_exisiting_catalog_id(rerunDir)
+    catPath = get_catalog_path(rerunDir, tract, patch, filter)
+
+    multibands, object_id, coord = get_catalog_schema_from_file(catPath, None, headerOnly=True)
+
     db = lib.common.new_db_connection()
+    # VACUUM cannot run inside a transaction block.
+    db.set_session(autocommit=True)
     with db.cursor() as cursor:
         for table in multibands.values():
-            table.create_index(cursor, schemaName)
-    db.commit()
+            table.set_logged(cursor, schemaName)
+        lib.dbtable.set_logged(cursor, schemaName, "_temp:ab_patch")
+        lib.dbtable.set_logged(cursor, schemaName, "_temp:ab_file")
+    db.close()
 
 
 def drop_index_from_mastertable(rerunDir, schemaName, filters):
@@ -389,7 +605,7 @@ def drop_index_from_mastertable(rerunDir, schemaName, filters):
     tract, patch, filter = get_an_exisiting_catalog_id(rerunDir)
     catPath = get_catalog_path(rerunDir, tract, patch, filter)
 
-    multibands, object_id, coord = get_catalog_schema_from_file(catPath, None)
+    multibands, object_id, coord = get_catalog_schema_from_file(catPath, None, headerOnly=True)
 
     for table in multibands.values():
         table.set_filters(filters)
@@ -401,44 +617,44 @@ def drop_index_from_mastertable(rerunDir, schemaName, filters):
     db.commit()
 
 
-def get_catalog_schema_from_file(path, object_id):
+def get_catalog_schema_from_file(path, object_id, headerOnly=False):
     """
     Get fields in a "forced_src_undeblendedConvolved-*.fits" file.
     @param path
         Path to a "forced_src_undeblendedConvolved-*.fits" file
     @param object_id
         numpy.array of object_id. Optional.
+    @param headerOnly
+        Read the header only. The tables are empty, which suffices
+        to know their names and columns (e.g. to create indexes).
     @return (multibands, object_id, coord)
         * multibands: PoppingOrderedDict mapping name: str -> table: DBTable
         * object_id: numpy.array of object_id.
         * coord: {"ra": numpy.array, "dec": numpy.array},
             in which angles are in degrees.
     """
-    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open(path)[1])
+    # Read only the fields that the algorithms take
+    prefixes = ["id"] + lib.algobase.get_sourceprefixes(lib.ab_algos.ab_algos.values())
+    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open_table(path, headerOnly=headerOnly), prefixes)
 
     these_object_id = table.cutout_subtable("id").fields["id"].data
 
     if (object_id is not None) and (not numpy.all(these_object_id == object_id)):
         raise RuntimeError("object_id in forced_src_undeblendedConvolved-*.fits doesn't agree with another filter" + path)
 
-    algos = PoppingOrderedDict(
-        (name, algoclass(table))
-        for name, algoclass in lib.ab_algos.ab_algos.items()
-    )
-
+    # Cut out before "coord_" is ignored by the dispatcher
     coord_table = table.cutout_subtable("coord_")
     coord = {
         "ra" : coord_table.fields["coord_ra" ].data * (180/numpy.pi),
         "dec": coord_table.fields["coord_dec"].data * (180/numpy.pi),
     }
 
-    # To suppress warnings "Ignored field: ...",
-    # ignore the fields explicitly.
-    def ignore(prefix):
-        table.cutout_subtable(prefix)
+    subtables = lib.ab_algos.ab_dispatcher.dispatch(table)
 
-    for name in lib.ab_algos.ab_algos_ignored:
-        ignore(name)
+    algos = PoppingOrderedDict(
+        (name, algoclass(subtables[name]))
+        for name, algoclass in lib.ab_algos.ab_algos.items()
+    )
 
     for field in table.fields:
         lib.misc.warning('Ignored field: ', field, 'in', path)
@@ -460,16 +676,7 @@ def get_existing_patches(rerunDir, tract):
     @return
         List of tract numbers, sorted.
     """
-
-    patches = set(
-        os.path.basename(os.path.dirname(path))
-        for path in glob.iglob("{rerunDir}/deepCoadd-results/*/{tract}/*,*/forced_src_undeblendedConvolved-*.fits*".format(**locals()))
-        if path.endswith('.fits') or path.endswith('.fits.gz')
-    )
-
-    return sorted(set(
-        lib.common.patch_to_number(patch) for patch in patches if re.match(r'^[0-9]+,[0-9]+$', patch)
-    ))
+    return lib.common.get_existing_patches(rerunDir, tract, "*", "forced_src_undeblendedConvolved")
 
 
 def get_catalog_path(rerunDir, tract, patch, filter):
@@ -483,13 +690,26 @@ def get_catalog_path(rerunDir, tract, patch, filter):
         x, y = patch // 100, patch % 100
     return "{rerunDir}/deepCoadd-results/{filter}/{tract}/{x},{y}/forced_src_undeblendedConvolved-{filter}-{tract}-{x},{y}.fits".format(**locals())
 
+def get_catalog_paths(rerunDir, tract, patch, filters):
+    """
+    Get the paths to the "forced_src_undeblendedConvolved-*.fits" catalogs that exist in the patch.
+    @return
+        Dictionary mapping filter name -> path
+    """
+    catPaths = {}
+    for filter in filters:
+        catPath = get_catalog_path(rerunDir, tract, patch, filter)
+        if lib.common.path_exists(catPath):
+            catPaths[filter] = catPath
+    return catPaths
+
 def get_an_exisiting_catalog_id(rerunDir):
     """
     Get any one triple (tract, patch, filter) for which catalog files exist
     """
     pattern = get_catalog_path(rerunDir, "*", "*", "*")
 
-    for imagePath in itertools.chain(glob.iglob(pattern), glob.iglob(pattern + ".gz")):
+    for imagePath in lib.common.iglob_compressed(pattern):
         tract, patch, filter = lib.common.path_decompose(imagePath)
         return tract, patch, filter
 
@@ -528,12 +748,7 @@ def is_patch_already_inserted(cursor, schemaName, tract, patch, filters):
     # Filter ID 0 is reserved and actual filter IDs start with 1, hence "filterOrder[f]+1"
     fileId = sorted(patchId*100 + lib.common.filterOrder[f]+1 for f in filters)
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS "{schemaName}"."_temp:ab_patch" (
-        file_id   Bigint   PRIMARY KEY
-    )
-    """.format(**locals())
-    )
+    create_patch_registry_if_not_exists(cursor, schemaName)
 
     cursor.execute("""
     SELECT file_id FROM "{schemaName}"."_temp:ab_patch" WHERE
@@ -574,5 +789,26 @@ def is_patch_already_inserted(cursor, schemaName, tract, patch, filters):
     return False
 
 
+def create_patch_registry_if_not_exists(cursor, schemaName):
+    """
+    Create the temporary table that records inserted patches
+    (See is_patch_already_inserted()).
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    """
+    # In bulk mode, the registry must be lost together with the data
+    # if the DB server crashes.
+    persistence = lib.config.get_persistence()
+
+    cursor.execute("""
+    CREATE {persistence} TABLE IF NOT EXISTS "{schemaName}"."_temp:ab_patch" (
+        file_id   Bigint   PRIMARY KEY
+    )
+    """.format(**locals())
+    )
+
+
 if __name__ == "__main__":
     main()
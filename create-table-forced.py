@@ -21,20 +21,28 @@ import psycopg2
 import lib.fits
 import lib.misc
 import lib.forced_algos
+import lib.algobase
 import lib.dbtable
 import lib.sourcetable
 import lib.common
 import lib.config
+import lib.patchpool
+import lib.indexbuilder
+import lib.pipeline
+import lib.filesync
+import lib.layout
+import lib.partitioner
+import lib.workqueue
 from lib.misc import PoppingOrderedDict
 
+from lib import pipe_binary
 if lib.config.MULTICORE:
     from lib import pipe_printf
 
-import glob
+import functools
 import io
 import itertools
 import os
-import re
 import sys
 import textwrap
 
@@ -53,6 +61,11 @@ def main():
     parser.add_argument("--index-space", default="", help="DB table space for indexes")
     parser.add_argument("--db-server", metavar="key=value", nargs="+", action="append", help="DB to connect to. This option must come later than non-optional arguments.")
 
+    parser.add_argument("--manifest", metavar="FILE", default="",
+        help="""Find catalogs in the manifest (an SQLite file) of the rerun directory instead of searching the directory.
+            The manifest is created if it does not exist, and it is updated for directories modified since the last run.
+        """
+    )
     parser.add_argument("--with-skymap-wcs", action="store",
         help="""Use skymap_wcs at the specified path instead of calexp-*.fits.
             To generate skymap_wcs, run 'generate-skymap_wcs.py skyMap.pickle'
@@ -61,6 +74,65 @@ def main():
 
     parser.add_argument('--create-index',  action='store_true',
        help="Create index (only; don't insert data)")
+    parser.add_argument('--index-jobs', type=int, default=1,
+       help="Number of DB connections with which to create indexes in parallel")
+    parser.add_argument('--maintenance-work-mem', default="",
+       help="maintenance_work_mem (e.g. 4GB) of each connection that creates indexes")
+    parser.add_argument('--max-parallel-maintenance-workers', type=int, default=None,
+       help="max_parallel_maintenance_workers of each connection that creates indexes")
+    parser.add_argument('--jobs', type=int, default=1,
+       help="Number of worker processes that insert patches in parallel")
+    parser.add_argument('--pipeline-depth', type=int, default=1,
+       help="""Number of patches that may wait between the stages (read, transform, COPY)
+            of the pipeline in which patches are inserted. 0 disables the pipeline.
+            The pipeline is not used if --jobs > 1.""")
+    parser.add_argument('--copy-format', choices=["binary", "text"], default="binary",
+       help="Data format with which to COPY rows into the DB")
+    parser.add_argument('--bulk-mode', action='store_true',
+       help="""Create tables UNLOGGED, insert data with synchronous_commit off,
+            and freeze the tables and set them LOGGED at the end.
+            Data being loaded is lost if the DB server crashes.""")
+    parser.add_argument('--append-band', metavar="FILTER",
+       help="""Add a filter that has arrived late to the patches already loaded with the other filters.
+            Only the catalogs of this filter are read, and the other filters are never reloaded.""")
+    parser.add_argument('--sync', action='store_true',
+       help="""Reload patches whose files have been changed (in size, mtime and contents) or added
+            since they were loaded. Their rows are deleted before they are loaded again.""")
+    parser.add_argument('--pack-flags', action='store_true',
+       help="""Store the flags of each algorithm in Bigint bitmasks instead of Boolean columns.
+            The views show the flags as before. This option must be given every time the tables are created or inserted into.""")
+    parser.add_argument('--dedupe-aliases', action='store_true',
+       help="""Store fields aliased in the catalogs (ALIAS in the header) only once in a table.
+            The views show the aliases as before. This option must be given every time the tables are created or inserted into.""")
+    parser.add_argument('--auto-partition', action='store_true',
+       help="""Pack the algorithms into part tables automatically, keeping co-access groups together,
+            instead of by the lists in this script. This option and --part-* must be given every time
+            the tables are created or inserted into.""")
+    parser.add_argument('--part-max-columns', type=int, default=1400, metavar="N",
+       help="Maximum number of columns of a part table and of its view (with --auto-partition)")
+    parser.add_argument('--part-max-row-width', type=int, default=8000, metavar="BYTES",
+       help="Maximum size of a row of a part table (with --auto-partition)")
+    parser.add_argument('--part-filters', type=int, default=6, metavar="N",
+       help="""Minimum number of filters for which the part tables are sized (with --auto-partition).
+            They are sized for all the filters in the rerun directory if there are more.
+            Give the number of filters that the tables will have in the end (e.g. with --append-band).""")
+    parser.add_argument('--layout', metavar="FILE",
+       help="""Physical layout of the tables planned by 'plan-capacity.py --optimize-layout FILE'.
+            This option must be given every time the tables are created or inserted into.
+            The file is rewritten if the catalogs have values that the layout cannot hold.""")
+    parser.add_argument('--queue', action='store_true',
+       help="""Take patches from a queue in the DB, which loaders on other hosts share.
+            Every loader adds the patches it finds to the queue, and they are inserted only once (See show-queue.py).""")
+    parser.add_argument('--queue-stale', type=float, default=600, metavar="SECONDS",
+       help="Take over patches whose loaders have not sent heartbeats for this many seconds")
+    parser.add_argument('--partition-by-tract', action='store_true',
+       help="""Partition tables by tract. Data of a tract is inserted into the tract's own partition,
+            which is indexed and attached to the table by --create-index.
+            This option must be given every time the tables are created, inserted into, or indexed.""")
+
+    parser.add_argument('--stage-times', metavar="FILE",
+       help="""Write the time spent in each stage of loading (reading FITS, transforming, encoding, COPY, indexing)
+            to FILE in JSON. Only the time spent in this process is counted: use it without --jobs.""")
 
     args = parser.parse_args()
 
@@ -70,18 +142,46 @@ def main():
     lib.config.tableSpace = args.table_space
     lib.config.indexSpace = args.index_space
     lib.config.withSkymapWcs = args.with_skymap_wcs
+    lib.config.manifest = args.manifest
+    lib.config.indexJobs = args.index_jobs
+    lib.config.maintenanceWorkMem = args.maintenance_work_mem
+    lib.config.maxParallelMaintenanceWorkers = args.max_parallel_maintenance_workers
+    lib.config.copyFormat = args.copy_format
+    lib.config.bulkMode = args.bulk_mode
+    lib.config.hashFiles = args.sync
+    lib.config.packFlags = args.pack_flags
+    lib.config.dedupeAliases = args.dedupe_aliases
+    lib.config.autoPartition = args.auto_partition
+    lib.config.partMaxColumns = args.part_max_columns
+    lib.config.partMaxRowWidth = args.part_max_row_width
+    lib.config.partFilters = args.part_filters
+    lib.config.layout = lib.layout.load(args.layout) if args.layout else {}
+    lib.config.layoutPath = args.layout or ""
+    lib.config.queueStaleSeconds = args.queue_stale
+    lib.config.partitionByTract = args.partition_by_tract
 
     filters = lib.common.get_existing_filters(args.rerunDir)
+    # Part tables are sized for all the filters in the rerun directory.
+    lib.config.partFilters = max(args.part_filters, len(filters))
     if args.create_index:
         create_index_on_mastertable(args.rerunDir, args.schemaName, filters)
+    elif args.append_band:
+        append_band(args.rerunDir, args.schemaName, args.table_name, filters, args.append_band)
     else:
-        create_mastertable_if_not_exists(args.rerunDir, args.schemaName, args.table_name, filters)
-        insert_into_mastertable(args.rerunDir, args.schemaName, args.table_name, filters)
+        with lib.workqueue.exclusive(args.schemaName, "forced", args.queue):
+            create_mastertable_if_not_exists(args.rerunDir, args.schemaName, args.table_name, filters, args.jobs)
+        insert_into_mastertable(args.rerunDir, args.schemaName, args.table_name, filters, args.jobs, args.pipeline_depth, args.sync, args.queue)
+        if lib.config.bulkMode and (not args.queue or lib.workqueue.is_drained(args.schemaName, "forced")):
+            set_mastertable_logged(args.rerunDir, args.schemaName)
+
+    if args.stage_times:
+        lib.misc.dump_stage_times(args.stage_times)
 
 
-def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName, filters):
+def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName, filters, jobs=1):
     """
     Create the master table if it does not exist.
+    The layout (lib.config.layout) is fitted to all the patches before the master table is created.
     @param rerunDir
         Path to the rerun directory from which to generate the master table
     @param schemaName
@@ -90,6 +190,8 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName, filt
         Name of the master table
     @param filters
         List of filter names
+    @param jobs
+        Number of worker processes that read the patches to fit the layout to.
     """
     bNeedCreating = False
 
@@ -102,13 +204,25 @@ def create_mastertable_if_not_exists(rerunDir, schemaName, masterTableName, filt
             db.rollback()
 
     if bNeedCreating:
+        if lib.config.layout:
+            lib.layout.fit(functools.partial(read_patch_tables, rerunDir, filters), [
+                (tract, patch)
+                for tract in lib.common.get_existing_tracts(rerunDir)
+                for patch in get_existing_patches(rerunDir, tract)
+            ], jobs)
         with db.cursor() as cursor:
             cursor.execute('CREATE SCHEMA IF NOT EXISTS "{schemaName}"'.format(**locals()))
             create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters)
         db.commit()
     else:
         db.close()
-        drop_index_from_mastertable(rerunDir, schemaName, filters)
+        # The layout may have been fitted by the loader that created the master table.
+        if lib.config.layoutPath:
+            lib.config.layout = lib.layout.load(lib.config.layoutPath)
+        # Indexes on partitions are left as they are
+        # because new tracts go into new partitions.
+        if not lib.config.partitionByTract:
+            drop_index_from_mastertable(rerunDir, schemaName, filters)
 
 
 def create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters):
@@ -148,6 +262,29 @@ def create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters):
         table.create(cursor, schemaName)
 
     # Create master table
+    create_masterviews(cursor, schemaName, masterTableName, universals, multibands, filters)
+
+
+def create_masterviews(cursor, schemaName, masterTableName, universals, multibands, filters, replace=False):
+    """
+    Create the master table, which is actually views ("forced", "forced2", ...)
+    that JOIN the child tables.
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param masterTableName
+        Name of the master table
+    @param universals
+        PoppingOrderedDict of band-independent DBTables (transformed).
+    @param multibands
+        PoppingOrderedDict of multiband DBTables (transformed).
+        Tables are popped from it.
+    @param filters
+        List of filter names
+    @param replace
+        Drop the views before creating them, e.g. to add columns of a new filter.
+    """
     commentOnTable = textwrap.dedent("""
     The summary table of forced photometry on coadd images.
     </p><p>Fluxes are in CGS units, and positions are in sky coordinates.
@@ -191,16 +328,10 @@ def create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters):
     # we divide the master table into "forced", "forced2", "forced3", ...
 
     listUniversals = [universals]
+    # "_forced:part1" remains in "multibands"; "_forced:part2", ... are popped.
     listMultibands = [multibands]
-    listMultibands.append(multibands.pop_many([
-        '_forced:part2',
-    ]))
-    listMultibands.append(multibands.pop_many([
-        '_forced:part3',
-    ]))
-    listMultibands.append(multibands.pop_many([
-        '_forced:part4',
-    ]))
+    for name in list(multibands.keys())[1:]:
+        listMultibands.append(multibands.pop_many([name]))
 
     for iPart, (universals, multibands) in enumerate(
         itertools.zip_longest(listUniversals, listMultibands, fillvalue=PoppingOrderedDict()),
@@ -236,6 +367,12 @@ def create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters):
 
         tableName = "{masterTableName}{iPart}".format(**locals()) if iPart > 1 else masterTableName
 
+        if replace:
+            cursor.execute("""
+            DROP VIEW IF EXISTS "{schemaName}"."{tableName}"
+            """.format(**locals())
+            )
+
         cursor.execute("""
         CREATE VIEW "{schemaName}"."{tableName}" AS (
             SELECT
@@ -258,7 +395,7 @@ def create_mastertable(cursor, rerunDir, schemaName, masterTableName, filters):
         )
 
 
-def insert_into_mastertable(rerunDir, schemaName, masterTableName, filters):
+def insert_into_mastertable(rerunDir, schemaName, masterTableName, filters, jobs=1, pipelineDepth=1, sync=False, queue=False):
     """
     Insert data into the master table.
     The data will actually flow not into the master table but into its children.
@@ -270,10 +407,171 @@ def insert_into_mastertable(rerunDir, schemaName, masterTableName, filters):
         Name of the master table
     @param filters
         List of filter names
+    @param jobs
+        Number of worker processes that insert patches in parallel
+    @param pipelineDepth
+        Number of patches that may wait between stages of the pipeline
+        (See insert_patches_pipelined()).
+        If it is 0, jobs > 1 or queue is True, the pipeline is not used.
+    @param sync
+        Reload patches whose files have been changed since they were loaded.
+    @param queue
+        Take patches from the queue shared with loaders on other hosts (See lib.workqueue).
+        "jobs" worker processes are started in this host.
     """
-    for tract in lib.common.get_existing_tracts(rerunDir):
-        for patch in get_existing_patches(rerunDir, tract):
-            insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters, tract, patch)
+    # Loaders on other hosts may be doing the same at the same time.
+    with lib.workqueue.exclusive(schemaName, "forced", queue):
+        # The registry of inserted patches must exist before workers start
+        # lest they should race to create it.
+        db = lib.common.new_db_connection()
+        with db.cursor() as cursor:
+            create_patch_registry_if_not_exists(cursor, schemaName)
+            lib.filesync.create_file_registry_if_not_exists(cursor, schemaName, "forced")
+        db.commit()
+        db.close()
+
+        tracts = lib.common.get_existing_tracts(rerunDir)
+        if lib.config.partitionByTract:
+            create_partitions_if_not_exist(rerunDir, schemaName, tracts)
+
+        patches = [
+            (tract, patch)
+            for tract in tracts
+            for patch in get_existing_patches(rerunDir, tract)
+        ]
+
+        changed = []
+        if sync:
+            changed = sync_patches(rerunDir, schemaName, filters, patches, jobs)
+
+        if queue:
+            lib.workqueue.enqueue(schemaName, "forced", patches, changed)
+
+    if queue:
+        lib.workqueue.insert_patches(
+            functools.partial(insert_patch_into_mastertable, rerunDir, schemaName, masterTableName, filters),
+            schemaName, "forced", jobs
+        )
+        return
+
+    if jobs <= 1 and pipelineDepth > 0:
+        insert_patches_pipelined(rerunDir, schemaName, filters, patches, pipelineDepth)
+        return
+
+    lib.patchpool.insert_patches(
+        functools.partial(insert_patch_into_mastertable, rerunDir, schemaName, masterTableName, filters),
+        patches, jobs
+    )
+
+
+def sync_patches(rerunDir, schemaName, filters, patches, jobs=1):
+    """
+    Delete patches whose files have been changed since they were loaded
+    so that they will be loaded again (See lib.filesync.sync_patches()).
+    @param rerunDir
+        Path to the rerun directory from which to generate the master table
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param filters
+        List of filter names
+    @param patches
+        List of (tract, patch)
+    @param jobs
+        Number of threads with which to hash files.
+    @return
+        List of (tract, patch) deleted.
+    """
+    tract, patch, filter = get_an_exisiting_catalog_id(rerunDir)
+    catPath = get_catalog_path(rerunDir, tract, patch, filter)
+    refPath = get_ref_path    (rerunDir, tract, patch)
+
+    universals, object_id, coord = get_ref_schema_from_file(refPath, headerOnly=True)
+    multibands = get_catalog_schema_from_file(catPath, object_id, headerOnly=True)
+    tables = list(itertools.chain(universals.values(), multibands.values()))
+
+    patchFiles = dict(
+        ((tract, patch), lib.filesync.get_file_ids(
+            tract, patch, get_catalog_paths(rerunDir, tract, patch, filters), get_ref_path(rerunDir, tract, patch)))
+        for tract, patch in patches
+    )
+
+    db = lib.common.new_db_connection()
+    changed = lib.filesync.sync_patches(db, schemaName, "forced", patchFiles,
+        lambda tract: [table.get_load_table_name(tract) for table in tables], jobs)
+    db.close()
+
+    return changed
+
+
+def insert_patches_pipelined(rerunDir, schemaName, filters, patches, pipelineDepth):
+    """
+    Insert patches into the master table through a pipeline of three stages:
+    "read" (reading ref and forced_src files), "transform" (DBTable.transform),
+    and "copy" (COPY into the DB). While a patch is being copied,
+    the next patches are being read and transformed.
+    @param rerunDir
+        Path to the rerun directory from which to generate the master table
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param filters
+        List of filter names
+    @param patches
+        List of (tract, patch)
+    @param pipelineDepth
+        Number of patches that may wait between two stages.
+        At most (3 + 2*pipelineDepth) patches are in memory at a time.
+    """
+    db = lib.common.new_db_connection()
+
+    # Patches that have been inserted are skipped before they are read.
+    # is_patch_already_inserted() is called again in the "copy" stage
+    # to register patches in the same transaction as their data.
+    with db.cursor() as cursor:
+        cursor.execute("""
+        SELECT file_id FROM "{schemaName}"."_temp:forced_patch"
+        """.format(**locals())
+        )
+        insertedFileIds = set(id for id, in cursor)
+    db.rollback()
+
+    def read(tract_patch):
+        tract, patch = tract_patch
+        catPaths = get_catalog_paths(rerunDir, tract, patch, filters)
+        if insertedFileIds.issuperset(get_patch_file_ids(tract, patch, catPaths.keys())):
+            lib.misc.warning("Skip because already inserted: (tract,patch) = ({tract}, {patch})".format(**locals()))
+            return None
+        fileRecords = lib.filesync.get_file_records(
+            lib.filesync.get_file_ids(tract, patch, catPaths, get_ref_path(rerunDir, tract, patch)))
+        return (tract, patch, catPaths, fileRecords) + read_patch(rerunDir, tract, patch, catPaths)
+
+    def transform(data):
+        tract, patch, catPaths, fileRecords, universals, object_id, coord, catalogs = data
+        multibands = transform_patch(rerunDir, tract, patch, universals, coord, catalogs)
+        return tract, patch, catPaths, fileRecords, universals, object_id, multibands
+
+    def copy(data):
+        tract, patch, catPaths, fileRecords, universals, object_id, multibands = data
+        with db.cursor() as cursor:
+            if is_patch_already_inserted(cursor, schemaName, tract, patch, catPaths.keys()):
+                lib.misc.warning("Skip because already inserted: (tract,patch) = ({tract}, {patch})".format(**locals()))
+                db.rollback()
+                return None
+            lib.filesync.register_files(cursor, schemaName, "forced", fileRecords)
+            copy_patch(cursor, schemaName, tract, universals, object_id, multibands)
+        db.commit()
+        return None
+
+    if lib.config.MULTICORE:
+        # The encoders are forked before the threads of the pipeline start.
+        pipe_printf.start()
+
+    lib.pipeline.run_pipeline(patches, [
+        lib.pipeline.Stage("read", read),
+        lib.pipeline.Stage("transform", transform),
+        lib.pipeline.Stage("copy", copy),
+    ], queueSize=pipelineDepth)
+
+    db.close()
 
 
 def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters, tract, patch):
@@ -293,42 +591,100 @@ def insert_patch_into_mastertable(rerunDir, schemaName, masterTableName, filters
     @param patch
         Patch number (x*100 + y)
     """
-    catPaths = {}
-    for filter in filters:
-        catPath = get_catalog_path(rerunDir, tract, patch, filter)
-        if lib.common.path_exists(catPath):
-            catPaths[filter] = catPath
+    catPaths = get_catalog_paths(rerunDir, tract, patch, filters)
 
-    db = lib.common.new_db_connection()
+    db = lib.patchpool.get_db_connection()
     with db.cursor() as cursor:
         if is_patch_already_inserted(cursor, schemaName, tract, patch, catPaths.keys()):
             lib.misc.warning("Skip because already inserted: (tract,patch) = ({tract}, {patch})".format(**locals()))
+            db.rollback()
             return
 
-        refPath = get_ref_path(rerunDir, tract, patch)
-        universals, object_id, coord = get_ref_schema_from_file(refPath)
+        lib.filesync.register_files(cursor, schemaName, "forced", lib.filesync.get_file_records(
+            lib.filesync.get_file_ids(tract, patch, catPaths, get_ref_path(rerunDir, tract, patch))))
+        universals, object_id, coord, catalogs = read_patch(rerunDir, tract, patch, catPaths)
+        multibands = transform_patch(rerunDir, tract, patch, universals, coord, catalogs)
+        copy_patch(cursor, schemaName, tract, universals, object_id, multibands)
 
-        for table in itertools.chain(universals.values()):
-            table.transform(rerunDir, tract, patch, "", coord)
+    db.commit()
+
+
+def read_patch(rerunDir, tract, patch, catPaths):
+    """
+    Read the catalogs of a patch.
+    @param rerunDir
+        Path to the rerun directory from which to generate the master table
+    @param tract
+        Tract number.
+    @param patch
+        Patch number (x*100 + y)
+    @param catPaths
+        Dictionary mapping filter name -> path to "forced_src-*.fits"
+    @return (universals, object_id, coord, catalogs)
+        * "universals", "object_id", "coord" are those returned by get_ref_schema_from_file().
+        * "catalogs" is a list of (filter, dbtables),
+            where "dbtables" is returned by get_catalog_schema_from_file().
+    """
+    refPath = get_ref_path(rerunDir, tract, patch)
+    universals, object_id, coord = get_ref_schema_from_file(refPath)
 
-        multibands = {}
-        for filter, catPath in catPaths.items():
-            for table in get_catalog_schema_from_file(catPath, object_id).values():
-                table.transform(rerunDir, tract, patch, filter, coord)
+    catalogs = [
+        (filter, get_catalog_schema_from_file(catPath, object_id))
+        for filter, catPath in catPaths.items()
+    ]
 
-                if table.name not in multibands:
-                    multibands[table.name] = []
-                multibands[table.name].append((table, filter))
+    return universals, object_id, coord, catalogs
 
-        for table in universals.values():
-            insert_patch_into_universaltable(cursor, schemaName, table, object_id)
-        for tables in multibands.values():
-            insert_patch_into_multibandtable(cursor, schemaName, tables, object_id)
 
-    db.commit()
+def transform_patch(rerunDir, tract, patch, universals, coord, catalogs):
+    """
+    Transform the tables returned by read_patch().
+    @return
+        Dictionary mapping table name -> list of (table: DBTable, filter: str)
+    """
+    for table in itertools.chain(universals.values()):
+        table.transform(rerunDir, tract, patch, "", coord)
+
+    multibands = {}
+    for filter, dbtables in catalogs:
+        for table in dbtables.values():
+            table.transform(rerunDir, tract, patch, filter, coord)
+
+            if table.name not in multibands:
+                multibands[table.name] = []
+            multibands[table.name].append((table, filter))
+
+    return multibands
+
+
+def read_patch_tables(rerunDir, filters, tract, patch):
+    """
+    Read and transform the tables of a patch (See lib.layout.fit()).
+    @return
+        List of (table: DBTable, filter: str)
+    """
+    universals, object_id, coord, catalogs = read_patch(rerunDir, tract, patch, get_catalog_paths(rerunDir, tract, patch, filters))
+    multibands = transform_patch(rerunDir, tract, patch, universals, coord, catalogs)
+    return [(table, "") for table in universals.values()] + list(itertools.chain.from_iterable(multibands.values()))
 
 
-def insert_patch_into_universaltable(cursor, schemaName, table, object_id):
+def copy_patch(cursor, schemaName, tract, universals, object_id, multibands):
+    """
+    COPY the tables returned by transform_patch() into the DB.
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param tract
+        Tract number.
+    """
+    for table in universals.values():
+        insert_patch_into_universaltable(cursor, schemaName, table, object_id, tract)
+    for tables in multibands.values():
+        insert_patch_into_multibandtable(cursor, schemaName, tables, object_id, tract)
+
+
+def insert_patch_into_universaltable(cursor, schemaName, table, object_id, tract):
     """
     Insert a patch into a universal table.
     'Universal' means 'Its contents are universal to all bands.'
@@ -340,10 +696,12 @@ def insert_patch_into_universaltable(cursor, schemaName, table, object_id):
         DBTable_BandIndependent object
     @param object_id
         numpy.array of object ID. This is used as the primary key.
+    @param tract
+        Tract number.
     """
-    return insert_patch_into_multibandtable(cursor, schemaName, [(table, "")], object_id)
+    return insert_patch_into_multibandtable(cursor, schemaName, [(table, "")], object_id, tract)
 
-def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id):
+def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id, tract, tableName=None):
     """
     Insert a patch into a multiband table.
     @param cursor
@@ -356,27 +714,144 @@ def insert_patch_into_multibandtable(cursor, schemaName, tables, object_id):
         with different colors.
     @param object_id
         numpy.array of object ID. This is used as the primary key.
+    @param tract
+        Tract number.
+    @param tableName
+        Quoted name of the table into which to COPY the patch.
+        (Default: the table (or partition) of the tract)
     """
     columns = [ object_id ]
     fieldNames = [ "object_id" ]
     format = "%ld"
+    fields = [ ("%ld", [ object_id ]) ]
 
     for table, filter in tables:
         for name, fmt, cols in table.get_backend_field_data(filter):
             columns.extend(cols)
             fieldNames.append(name)
             format += "\t" + fmt
+            fields.append((fmt, cols))
 
     format += "\n"
     format = format.encode("utf-8")
 
-    if lib.config.MULTICORE:
-        fin = pipe_printf.open(format, *columns)
-        cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), sep='\t', columns=fieldNames)
-    else:
-        tsv = b''.join(format % tpl for tpl in zip(*columns))
-        fin = io.BytesIO(tsv)
-        cursor.copy_from(fin, '"{}"."{}"'.format(schemaName, table.name), sep='\t', size=-1, columns=fieldNames)
+    if tableName is None:
+        tableName = '"{}"."{}"'.format(schemaName, table.get_load_table_name(tract))
+
+    with lib.misc.stage_time("copy"):
+        if lib.config.copyFormat == "binary" and pipe_binary.is_supported(cursor.connection, fields):
+            fin = lib.misc.TimedReader("encode", pipe_binary.open(fields))
+            cursor.copy_expert(pipe_binary.copy_command(tableName, fieldNames), fin, size=1<<20)
+        elif lib.config.MULTICORE:
+            fin = lib.misc.TimedReader("encode", pipe_printf.open(format, *columns))
+            cursor.copy_from(fin, tableName, sep='\t', columns=fieldNames)
+        else:
+            with lib.misc.stage_time("encode"):
+                tsv = b''.join(format % tpl for tpl in zip(*columns))
+            fin = io.BytesIO(tsv)
+            cursor.copy_from(fin, tableName, sep='\t', size=-1, columns=fieldNames)
+
+
+def append_band(rerunDir, schemaName, masterTableName, filters, newFilter):
+    """
+    Add a filter to the patches that have been inserted without it.
+    The columns of the filter are added to the multiband tables,
+    the catalogs of the filter are COPY'd into temporary tables tract by tract,
+    and they are merged into the multiband tables by one UPDATE per table.
+    The master table (views) is then recreated with the new columns,
+    for the filters that are in the multiband tables (not all filters in filters).
+    @param rerunDir
+        Path to the rerun directory from which to generate the master table
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param masterTableName
+        Name of the master table
+    @param filters
+        List of filter names found in the rerun directory, including newFilter
+    @param newFilter
+        Filter to add.
+    """
+    if newFilter not in filters:
+        raise RuntimeError("No catalogs exist for filter: " + newFilter)
+
+    tract, patch, filter = get_an_exisiting_catalog_id(rerunDir)
+    catPath = get_catalog_path(rerunDir, tract, patch, filter)
+    refPath = get_ref_path    (rerunDir, tract, patch)
+
+    universals, object_id, coord = get_ref_schema_from_file(refPath, headerOnly=True)
+    multibands = get_catalog_schema_from_file(catPath, object_id, headerOnly=True)
+
+    for table in itertools.chain(universals.values(), multibands.values()):
+        table.set_filters(filters)
+    for table in itertools.chain(universals.values(), multibands.values()):
+        table.transform(rerunDir, tract, patch, filter, coord)
+
+    db = lib.common.new_db_connection()
+    with db.cursor() as cursor:
+        create_patch_registry_if_not_exists(cursor, schemaName)
+        lib.filesync.create_file_registry_if_not_exists(cursor, schemaName, "forced")
+        # The rerun directory may have filters that have not been loaded.
+        # The views are made of the filters in all the multiband tables, and the new filter.
+        loadedFilters = set(filters)
+        for table in multibands.values():
+            loadedFilters.intersection_update(table.get_loaded_filters(cursor, schemaName, filters))
+        viewFilters = [f for f in filters if f in loadedFilters or f == newFilter]
+
+        for table in itertools.chain(universals.values(), multibands.values()):
+            table.set_filters(viewFilters)
+        for table in multibands.values():
+            table.add_band(cursor, schemaName, newFilter)
+        create_masterviews(cursor, schemaName, masterTableName, universals, PoppingOrderedDict(multibands), viewFilters, replace=True)
+
+        cursor.execute("""
+        SELECT file_id FROM "{schemaName}"."_temp:forced_patch"
+        """.format(**locals())
+        )
+        insertedFileIds = set(id for id, in cursor)
+    db.commit()
+
+    # Patches that have been inserted with other filters but not with the new one
+    newFileIds = {}
+    for tract in lib.common.get_existing_tracts(rerunDir):
+        for patch in get_existing_patches(rerunDir, tract):
+            catPath = get_catalog_path(rerunDir, tract, patch, newFilter)
+            fileIds = lib.filesync.get_file_ids(tract, patch, {newFilter: catPath})
+            refFileId = (tract*10000 + patch)*100
+            if refFileId in insertedFileIds \
+                    and not insertedFileIds.issuperset(fileIds) and lib.common.path_exists(catPath):
+                newFileIds.setdefault(tract, {}).update(fileIds)
+
+    for tract, fileIds in sorted(newFileIds.items()):
+        with db.cursor() as cursor:
+            stageNames = dict(
+                (table.name, table.create_band_stage(cursor, newFilter)) for table in multibands.values()
+            )
+
+            nRows = 0
+            for fileId, catPath in sorted(fileIds.items()):
+                patch = fileId // 100 % 10000
+                universals, object_id, coord, catalogs = read_patch(rerunDir, tract, patch, {newFilter: catPath})
+                for name, tables in transform_patch(rerunDir, tract, patch, universals, coord, catalogs).items():
+                    insert_patch_into_multibandtable(cursor, schemaName, tables, object_id, tract,
+                        tableName=stageNames[name])
+                nRows += len(object_id)
+
+            for table in multibands.values():
+                with lib.misc.stage_time("copy"):
+                    nUpdated = table.merge_band_stage(cursor, schemaName, tract, newFilter)
+                if nUpdated != nRows:
+                    raise RuntimeError('{} rows of tract {} in "{}" were updated, though {} rows were read.'.format(
+                        nUpdated, tract, table.name, nRows))
+
+            cursor.execute("""
+            INSERT INTO "{schemaName}"."_temp:forced_patch" VALUES {values}
+            """.format(values = ",".join("({})".format(id) for id in sorted(fileIds)), **locals())
+            )
+            lib.filesync.register_files(cursor, schemaName, "forced", lib.filesync.get_file_records(fileIds))
+        db.commit()
+        print("Appended {newFilter} to tract {tract}: {n} patches".format(n = len(fileIds), **locals()))
+
+    db.close()
 
 
 def create_index_on_mastertable(rerunDir, schemaName, filters):
@@ -394,17 +869,79 @@ def create_index_on_mastertable(rerunDir, schemaName, filters):
     catPath = get_catalog_path(rerunDir, tract, patch, filter)
     refPath = get_ref_path    (rerunDir, tract, patch)
 
-    universals, object_id, coord = get_ref_schema_from_file(refPath)
-    multibands = get_catalog_schema_from_file(catPath, object_id)
+    universals, object_id, coord = get_ref_schema_from_file(refPath, headerOnly=True)
+    multibands = get_catalog_schema_from_file(catPath, object_id, headerOnly=True)
 
     for table in itertools.chain(universals.values(), multibands.values()):
         table.set_filters(filters)
 
+    builder = lib.indexbuilder.IndexBuilder()
+
     db = lib.common.new_db_connection()
     with db.cursor() as cursor:
         for table in itertools.chain(universals.values(), multibands.values()):
-            table.create_index(cursor, schemaName)
+            if lib.config.partitionByTract:
+                for tract in table.get_detached_partitions(cursor, schemaName):
+                    table.attach_partition(builder.cursor(), schemaName, tract)
+            else:
+                table.create_index(builder.cursor(), schemaName)
+    db.close()
+
+    builder.run()
+
+
+def create_partitions_if_not_exist(rerunDir, schemaName, tracts):
+    """
+    Create the partitions of the master table's children
+    that will hold the given tracts, unless they exist.
+    @param rerunDir
+        Path to the rerun directory from which to generate the master table
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param tracts
+        List of tract numbers
+    """
+    tract, patch, filter = get_an_exisiting_catalog_id(rerunDir)
+    catPath = get_catalog_path(rerunDir, tract, patch, filter)
+    refPath = get_ref_path    (rerunDir, tract, patch)
+
+    universals, object_id, coord = get_ref_schema_from_file(refPath, headerOnly=True)
+    multibands = get_catalog_schema_from_file(catPath, object_id, headerOnly=True)
+
+    db = lib.common.new_db_connection()
+    with db.cursor() as cursor:
+        for table in itertools.chain(universals.values(), multibands.values()):
+            for tract in tracts:
+                table.create_partition_if_not_exists(cursor, schemaName, tract)
     db.commit()
+    db.close()
+
+
+def set_mastertable_logged(rerunDir, schemaName):
+    """
+    Freeze the master table's children, which were created UNLOGGED
+    in bulk mode, and set them LOGGED.
+    @param rerunDir
+        Path to the rerun directory from which to generate the master table
+    @param schemaName
+        Name of the schema in which to locate the master table
+    """
+    tract, patch, filter = get_an_exisiting_catalog_id(rerunDir)
+    catPath = get_catalog_path(rerunDir, tract, patch, filter)
+    refPath = get_ref_path    (rerunDir, tract, patch)
+
+    universals, object_id, coord = get_ref_schema_from_file(refPath, headerOnly=True)
+    multibands = get_catalog_schema_from_file(catPath, object_id, headerOnly=True)
+
+    db = lib.common.new_db_connection()
+    # VACUUM cannot run inside a transaction block.
+    db.set_session(autocommit=True)
+    with db.cursor() as cursor:
+        for table in itertools.chain(universals.values(), multibands.values()):
+            table.set_logged(cursor, schemaName)
+        lib.dbtable.set_logged(cursor, schemaName, "_temp:forced_patch")
+        lib.dbtable.set_logged(cursor, schemaName, "_temp:forced_file")
+    db.close()
 
 
 def drop_index_from_mastertable(rerunDir, schemaName, filters):
@@ -422,8 +959,8 @@ def drop_index_from_mastertable(rerunDir, schemaName, filters):
     catPath = get_catalog_path(rerunDir, tract, patch, filter)
     refPath = get_ref_path   (rerunDir, tract, patch)
 
-    universals, object_id, coord = get_ref_schema_from_file(refPath)
-    multibands = get_catalog_schema_from_file(catPath, object_id)
+    universals, object_id, coord = get_ref_schema_from_file(refPath, headerOnly=True)
+    multibands = get_catalog_schema_from_file(catPath, object_id, headerOnly=True)
 
     for table in itertools.chain(universals.values(), multibands.values()):
         table.set_filters(filters)
@@ -435,36 +972,35 @@ def drop_index_from_mastertable(rerunDir, schemaName, filters):
     db.commit()
 
 
-def get_ref_schema_from_file(path):
+def get_ref_schema_from_file(path, headerOnly=False):
     """
     Get fields in a "ref-*.fits" file.
     @param path
         Path to a "ref-*.fits" file
+    @param headerOnly
+        Read the header only. The tables are empty, which suffices
+        to know their names and columns (e.g. to create indexes).
     @return (dbtables, object_id, coord)
         * "dbtables" is PoppingOrderedDict mapping name: str -> table: DBTable,
         * "object_id" is a numpy.array of object_id,
         * "coord" is {"ra": numpy.array, "dec": numpy.array},
             in which angles are in degrees.
     """
-    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open(path)[1])
+    # Read only the fields that the algorithms take
+    prefixes = ["id"] + lib.algobase.get_sourceprefixes(lib.forced_algos.ref_algos.values())
+    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open_table(path, headerOnly=headerOnly), prefixes)
 
     object_id = table.cutout_subtable("id").fields["id"].data
 
+    subtables = lib.forced_algos.ref_dispatcher.dispatch(table)
+
     algos = PoppingOrderedDict(
-        (name, algoclass(table))
+        (name, algoclass(subtables[name]))
         for name, algoclass in lib.forced_algos.ref_algos.items()
     )
 
     coord = algos["ref_coord"].coord
 
-    # To suppress warnings "Ignored field: ...",
-    # ignore the fields explicitly.
-    def ignore(prefix):
-        table.cutout_subtable(prefix)
-
-    for name in lib.forced_algos.ref_algos_ignored:
-        ignore(name)
-
     for field in table.fields:
         lib.misc.warning('Ignored field: ', field, 'in', path)
 
@@ -483,36 +1019,39 @@ def get_ref_schema_from_file(path):
 
 
 class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
-    def create_index(self, cursor, schemaName):
-        lib.dbtable.DBTable_BandIndependent.create_index(self, cursor, schemaName)
+    def create_index(self, cursor, schemaName, tableName=None):
+        lib.dbtable.DBTable_BandIndependent.create_index(self, cursor, schemaName, tableName)
+
+        if tableName is None:
+            tableName = self.name
 
         indexSpace = lib.config.get_index_space()
 
         cursor.execute("""
-        CREATE INDEX
-            "{self.name}_parent_id_idx"
+        CREATE INDEX IF NOT EXISTS
+            "{tableName}_parent_id_idx"
         ON
-            "{schemaName}"."{self.name}"
+            "{schemaName}"."{tableName}"
             ( parent_id
             )
         {indexSpace}
         """.format(**locals())
         )
         cursor.execute("""
-        CREATE INDEX
-            "{self.name}_skymap_id_idx"
+        CREATE INDEX IF NOT EXISTS
+            "{tableName}_skymap_id_idx"
         ON
-            "{schemaName}"."{self.name}"
+            "{schemaName}"."{tableName}"
             ( public.skymap_from_object_id(object_id)
             )
         {indexSpace}
         """.format(**locals())
         )
         cursor.execute("""
-        CREATE INDEX
-            "{self.name}_coord_idx"
+        CREATE INDEX IF NOT EXISTS
+            "{tableName}_coord_idx"
         ON
-            "{schemaName}"."{self.name}"
+            "{schemaName}"."{tableName}"
         USING GiST
             ( coord
             )
@@ -525,10 +1064,10 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
         # indices WHERE isprimary = True
 
         cursor.execute("""
-        CREATE UNIQUE INDEX
-            "{self.name}_object_id_primary_idx"
+        CREATE UNIQUE INDEX IF NOT EXISTS
+            "{tableName}_object_id_primary_idx"
         ON
-            "{schemaName}"."{self.name}"
+            "{schemaName}"."{tableName}"
             ( object_id
             )
         {indexSpace}
@@ -537,10 +1076,10 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
         """.format(**locals())
         )
         cursor.execute("""
-        CREATE INDEX
-            "{self.name}_skymap_id_primary_idx"
+        CREATE INDEX IF NOT EXISTS
+            "{tableName}_skymap_id_primary_idx"
         ON
-            "{schemaName}"."{self.name}"
+            "{schemaName}"."{tableName}"
             ( public.skymap_from_object_id(object_id)
             )
         {indexSpace}
@@ -549,10 +1088,10 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
         """.format(**locals())
         )
         cursor.execute("""
-        CREATE INDEX
-            "{self.name}_coord_primary_idx"
+        CREATE INDEX IF NOT EXISTS
+            "{tableName}_coord_primary_idx"
         ON
-            "{schemaName}"."{self.name}"
+            "{schemaName}"."{tableName}"
         USING GiST
             ( coord
             )
@@ -600,37 +1139,36 @@ class DBTable_Position(lib.dbtable.DBTable_BandIndependent):
         """.format(**locals())
         )
 
-def get_catalog_schema_from_file(path, object_id):
+def get_catalog_schema_from_file(path, object_id, headerOnly=False):
     """
     Get fields in a "forced_src-*.fits" file.
     @param path
         Path to a "forced-*.fits" file
     @param object_id
         numpy.array of object ID from the corresponding "forced-*.fits" file.
+    @param headerOnly
+        Read the header only. The tables are empty, which suffices
+        to know their names and columns (e.g. to create indexes).
     @return
         PoppingOrderedDict mapping name: str -> table: DBTable.
     """
 
-    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open(path)[1])
+    # Read only the fields that the algorithms take
+    prefixes = ["id"] + lib.algobase.get_sourceprefixes(lib.forced_algos.forced_algos.values())
+    table = lib.sourcetable.SourceTable.from_hdu(lib.fits.fits_open_table(path, headerOnly=headerOnly), prefixes)
 
     these_object_id = table.cutout_subtable("id").fields["id"].data
 
     if not numpy.all(these_object_id == object_id):
         raise RuntimeError("object_id in forced_src doesn't agree with ref " + path)
 
+    subtables = lib.forced_algos.forced_dispatcher.dispatch(table)
+
     algos = PoppingOrderedDict(
-        (name, algoclass(table))
+        (name, algoclass(subtables[name]))
         for name, algoclass in lib.forced_algos.forced_algos.items()
     )
 
-    # To suppress warnings "Ignored field: ...",
-    # ignore the fields explicitly.
-    def ignore(prefix):
-        table.cutout_subtable(prefix)
-
-    for name in lib.forced_algos.forced_algos_ignored:
-        ignore(name)
-
     for field in table.fields:
         lib.misc.warning('Ignored field: ', field, 'in', path)
 
@@ -638,6 +1176,12 @@ def get_catalog_schema_from_file(path, object_id):
     def add(name, sourcenames, dbtable_class=lib.dbtable.DBTable):
         dbtables[name] = dbtable_class(name, algos.pop_many(sourcenames))
 
+    if lib.config.autoPartition:
+        parts = lib.partitioner.partition(algos, lib.forced_algos.forced_coaccess_groups)
+        for iPart, sourcenames in enumerate(parts, start=1):
+            add("_forced:part{}".format(iPart), sourcenames)
+        return dbtables
+
     add("_forced:part1", [
         "base_PixelFlags",
         "base_InputCount",
@@ -682,15 +1226,7 @@ def get_existing_patches(rerunDir, tract):
     @return
         List of tract numbers, sorted.
     """
-    patches = set(
-        os.path.basename(os.path.dirname(path))
-        for path in glob.iglob("{rerunDir}/deepCoadd-results/merged/{tract}/*,*/ref-*".format(**locals()))
-        if path.endswith('.fits') or path.endswith('.fits.gz')
-    )
-
-    return sorted(set(
-        lib.common.patch_to_number(patch) for patch in patches if re.match(r'^[0-9]+,[0-9]+$', patch)
-    ))
+    return lib.common.get_existing_patches(rerunDir, tract, "merged", "ref")
 
 def get_ref_path(rerunDir, tract, patch):
     """
@@ -714,13 +1250,26 @@ def get_catalog_path(rerunDir, tract, patch, filter):
         x, y = patch // 100, patch % 100
     return "{rerunDir}/deepCoadd-results/{filter}/{tract}/{x},{y}/forced_src-{filter}-{tract}-{x},{y}.fits".format(**locals())
 
+def get_catalog_paths(rerunDir, tract, patch, filters):
+    """
+    Get the paths to the "forced_src-*.fits" catalogs that exist in the patch.
+    @return
+        Dictionary mapping filter name -> path
+    """
+    catPaths = {}
+    for filter in filters:
+        catPath = get_catalog_path(rerunDir, tract, patch, filter)
+        if lib.common.path_exists(catPath):
+            catPaths[filter] = catPath
+    return catPaths
+
 def get_an_exisiting_catalog_id(rerunDir):
     """
     Get any one triple (tract, patch, filter) for which catalog files exist
     """
     pattern = get_catalog_path(rerunDir, "*", "*", "*")
 
-    for catPath in itertools.chain(glob.iglob(pattern), glob.iglob(pattern + ".gz")):
+    for catPath in lib.common.iglob_compressed(pattern):
         tract, patch, filter = lib.common.path_decompose(catPath)
         refPath = get_ref_path(rerunDir, tract, patch)
         if lib.common.path_exists(refPath):
@@ -753,22 +1302,13 @@ def is_patch_already_inserted(cursor, schemaName, tract, patch, filters):
         List of filter names for which multiband catalogs actually exist
     """
 
-    # file_id = (tract*10000 + patch)*100 + filter
     patchId = tract*10000 + patch
     minFileId =  patchId   *100
     maxFileId = (patchId+1)*100 - 1
 
-    # The files that need registering include a "ref" file as well as multiband files.
-    # We address this problem by giving filter ID 0  (or file_id minFileId) to the "ref" file,
-    # and letting actual filter IDs start with 1.
-    fileId = [minFileId] + sorted(patchId*100 + lib.common.filterOrder[f]+1 for f in filters)
+    fileId = get_patch_file_ids(tract, patch, filters)
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS "{schemaName}"."_temp:forced_patch" (
-        file_id   Bigint   PRIMARY KEY
-    )
-    """.format(**locals())
-    )
+    create_patch_registry_if_not_exists(cursor, schemaName)
 
     cursor.execute("""
     SELECT file_id FROM "{schemaName}"."_temp:forced_patch" WHERE
@@ -809,5 +1349,46 @@ def is_patch_already_inserted(cursor, schemaName, tract, patch, filters):
     return False
 
 
+def get_patch_file_ids(tract, patch, filters):
+    """
+    Get the IDs, sorted, with which the files of (tract, patch, filters)
+    are recorded in the registry of inserted patches.
+    @param tract
+        Tract number
+    @param patch
+        Patch number (x*100 + y)
+    @param filters
+        List of filter names for which multiband catalogs actually exist
+    """
+    # file_id = (tract*10000 + patch)*100 + filter
+    patchId = tract*10000 + patch
+
+    # The files that need registering include a "ref" file as well as multiband files.
+    # We address this problem by giving filter ID 0  (or file_id patchId*100) to the "ref" file,
+    # and letting actual filter IDs start with 1.
+    return [patchId*100] + sorted(patchId*100 + lib.common.filterOrder[f]+1 for f in filters)
+
+
+def create_patch_registry_if_not_exists(cursor, schemaName):
+    """
+    Create the temporary table that records inserted patches
+    (See is_patch_already_inserted()).
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    """
+    # In bulk mode, the registry must be lost together with the data
+    # if the DB server crashes.
+    persistence = lib.config.get_persistence()
+
+    cursor.execute("""
+    CREATE {persistence} TABLE IF NOT EXISTS "{schemaName}"."_temp:forced_patch" (
+        file_id   Bigint   PRIMARY KEY
+    )
+    """.format(**locals())
+    )
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Generate a synthetic rerun directory for benchmarking the loaders.
+Catalogs have the columns that the registered algorithms take,
+and are laid out as create-table-*.py expect.
+"""
+
+import lib.synthetic
+
+import numpy
+
+import os
+import sys
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        fromfile_prefix_chars='@',
+        description='Generate a synthetic rerun directory for benchmarking the loaders.')
+
+    parser.add_argument('rerunDir', help="Rerun directory to create")
+
+    parser.add_argument("--tracts", type=int, nargs="+", default=[0], help="Tract numbers")
+    parser.add_argument("--patches", type=int, default=2, help="Number of patches per side of each tract (up to {})".format(lib.synthetic.patchesPerTract))
+    parser.add_argument("--filters", nargs="+", default=["g", "r", "i", "z", "y"], help="Filter names")
+    parser.add_argument("--rows", type=int, default=10000, help="Number of objects per patch")
+    parser.add_argument("--catalogs", nargs="+", choices=["ref", "forced", "meas", "ran", "ab"], default=["ref", "forced", "meas", "ran", "ab"], help="Kinds of catalogs to generate")
+    parser.add_argument("--gzip", action="store_true", help="Compress catalogs with gzip")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of random numbers")
+    parser.add_argument("--skymap-wcs", metavar="DIR", help="Directory in which to write skymap_wcs-*.fits (Default: {rerunDir}/skymap_wcs)")
+
+    args = parser.parse_args()
+
+    if not (1 <= args.patches <= lib.synthetic.patchesPerTract):
+        raise RuntimeError("--patches must be in [1, {}]".format(lib.synthetic.patchesPerTract))
+
+    skymapWcs = args.skymap_wcs or os.path.join(args.rerunDir, "skymap_wcs")
+
+    generate_rerun(args.rerunDir, args.tracts, args.patches, args.filters, args.rows, args.catalogs, skymapWcs, compress=args.gzip, seed=args.seed)
+
+    print("Load the catalogs with --with-skymap-wcs={}".format(skymapWcs))
+
+
+def generate_rerun(rerunDir, tracts, patches, filters, nRows, catalogs, skymapWcs, compress=False, seed=0):
+    """
+    Generate a synthetic rerun directory.
+    @param rerunDir
+        Path to the rerun directory to create
+    @param tracts (list of int)
+        Tract numbers
+    @param patches (int)
+        Number of patches per side of each tract
+    @param filters (list of str)
+        Filter names
+    @param nRows (int)
+        Number of objects per patch
+    @param catalogs (list of str)
+        Kinds of catalogs: "ref", "forced", "meas", "ran", "ab"
+    @param skymapWcs
+        Directory in which to write skymap_wcs-*.fits
+    """
+    schemas = get_schemas(catalogs, filters)
+
+    for tract in tracts:
+        path = os.path.join(skymapWcs, "skymap_wcs-{tract}.fits".format(**locals()))
+        lib.synthetic.write_wcs(path, tract)
+        print(path)
+
+        for x in range(patches):
+            for y in range(patches):
+                patch = x*100 + y
+                # Different, but reproducible, values for each patch
+                random = numpy.random.RandomState([seed, tract, patch])
+
+                object_id = lib.synthetic.get_object_id(tract, patch, nRows)
+                coord = lib.synthetic.get_patch_coord(tract, patch, nRows, random)
+
+                for catalog, schema in schemas.items():
+                    if catalog == "ref":
+                        path = get_catalog_path(rerunDir, catalog, tract, x, y)
+                        write_catalog(path, schema, object_id, coord, random, compress)
+                    else:
+                        for filter in filters:
+                            path = get_catalog_path(rerunDir, catalog, tract, x, y, filter)
+                            write_catalog(path, schema, object_id, coord, random, compress)
+
+
+def get_schemas(catalogs, filters):
+    """
+    Get the schema of each kind of catalog.
+    @return
+        dict mapping catalog: str -> schema: lib.synthetic.Schema
+    """
+    schemas = {}
+    for catalog in catalogs:
+        if catalog == "ref":
+            import lib.forced_algos
+            algos, ignored = lib.forced_algos.ref_algos, lib.forced_algos.ref_algos_ignored
+        elif catalog == "forced":
+            import lib.forced_algos
+            algos, ignored = lib.forced_algos.forced_algos, lib.forced_algos.forced_algos_ignored
+        elif catalog == "meas":
+            import lib.meas_algos
+            algos, ignored = lib.meas_algos.meas_algos, lib.meas_algos.meas_algos_ignored
+        elif catalog == "ran":
+            import lib.random_algos
+            algos, ignored = lib.random_algos.random_algos, lib.random_algos.random_algos_ignored
+        elif catalog == "ab":
+            import lib.ab_algos
+            algos, ignored = lib.ab_algos.ab_algos, lib.ab_algos.ab_algos_ignored
+        else:
+            raise RuntimeError("Unknown catalog: " + catalog)
+
+        schemas[catalog] = lib.synthetic.get_schema(algos.values(), ignored, filters)
+
+    return schemas
+
+
+def write_catalog(path, schema, object_id, coord, random, compress):
+    data = lib.synthetic.generate_data(schema, object_id, coord, random)
+    lib.synthetic.write_catalog(path, schema, data, compress=compress)
+    print(path + (".gz" if compress else ""))
+
+
+def get_catalog_path(rerunDir, catalog, tract, x, y, filter=None):
+    """
+    Get the path to a catalog, at which create-table-*.py will find it.
+    """
+    if catalog == "ref":
+        return "{rerunDir}/deepCoadd-results/merged/{tract}/{x},{y}/ref-{tract}-{x},{y}.fits".format(**locals())
+
+    prefix = {
+        "forced": "forced_src",
+        "meas"  : "meas",
+        "ran"   : "ran",
+        "ab"    : "forced_src_undeblendedConvolved",
+    }[catalog]
+    return "{rerunDir}/deepCoadd-results/{filter}/{tract}/{x},{y}/{prefix}-{filter}-{tract}-{x},{y}.fits".format(**locals())
+
+
+if __name__ == "__main__":
+    main()
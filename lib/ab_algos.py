@@ -15,6 +15,7 @@
 
 import importlib
 
+from .algobase import PrefixDispatcher
 from .misc import PoppingOrderedDict
 
 def _import_algo(name):
@@ -41,3 +42,5 @@ ab_algos_ignored = [
     "base_",
     "parent",
 ]
+
+ab_dispatcher = PrefixDispatcher(ab_algos, ab_algos_ignored)
@@ -50,5 +50,4 @@ class Algo_base_Blendedness(algobase.Algo):
         (r'base_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_Blendedness_")
+    sourceprefixes = ["base_Blendedness_"]
@@ -46,5 +46,4 @@ class Algo_base_CircularApertureFlux(algobase.Algo):
         (r'base_Circular', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_CircularApertureFlux_")
+    sourceprefixes = ["base_CircularApertureFlux_"]
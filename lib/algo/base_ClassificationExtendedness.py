@@ -21,5 +21,4 @@ class Algo_base_ClassificationExtendedness(algobase.Algo):
         (r'base_Classification', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_ClassificationExtendedness_")
+    sourceprefixes = ["base_ClassificationExtendedness_"]
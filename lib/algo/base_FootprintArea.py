@@ -21,5 +21,4 @@ class Algo_base_FootprintArea(algobase.Algo):
         (r'base_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_FootprintArea_")
+    sourceprefixes = ["base_FootprintArea_"]
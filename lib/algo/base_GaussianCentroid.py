@@ -30,5 +30,4 @@ class Algo_base_GaussianCentroid(algobase.Algo):
         (r'base_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_GaussianCentroid_")
+    sourceprefixes = ["base_GaussianCentroid_"]
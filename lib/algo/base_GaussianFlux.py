@@ -33,5 +33,4 @@ class Algo_base_GaussianFlux(algobase.Algo):
         (r'base_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_GaussianFlux_")
+    sourceprefixes = ["base_GaussianFlux_"]
@@ -21,5 +21,4 @@ class Algo_base_InputCount(algobase.Algo):
         (r'base_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_InputCount_")
+    sourceprefixes = ["base_InputCount_"]
@@ -33,5 +33,4 @@ class Algo_base_LocalBackground(algobase.Algo):
         (r'base_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_LocalBackground_")
+    sourceprefixes = ["base_LocalBackground_"]
@@ -30,5 +30,4 @@ class Algo_base_NaiveCentroid(algobase.Algo):
         (r'base_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_NaiveCentroid_")
+    sourceprefixes = ["base_NaiveCentroid_"]
@@ -21,5 +21,4 @@ class Algo_base_PixelFlags(algobase.Algo):
         (r'base_PixelFlags_flag', 'PixelFlags'),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_PixelFlags_")
+    sourceprefixes = ["base_PixelFlags_"]
@@ -33,5 +33,4 @@ class Algo_base_PsfFlux(algobase.Algo):
         (r'base_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_PsfFlux_")
+    sourceprefixes = ["base_PsfFlux_"]
@@ -41,5 +41,4 @@ class Algo_base_SdssCentroid(algobase.Algo):
         (r'base_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_SdssCentroid_")
+    sourceprefixes = ["base_SdssCentroid_"]
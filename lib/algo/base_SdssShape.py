@@ -80,5 +80,4 @@ class Algo_base_SdssShape(algobase.Algo):
         (r'base_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_SdssShape_")
+    sourceprefixes = ["base_SdssShape_"]
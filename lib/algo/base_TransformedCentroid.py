@@ -21,5 +21,4 @@ class Algo_base_TransformedCentroid(algobase.Algo):
         (r'base_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_TransformedCentroid_")
+    sourceprefixes = ["base_TransformedCentroid_"]
@@ -21,5 +21,4 @@ class Algo_base_TransformedShape(algobase.Algo):
         (r'base_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_TransformedShape_")
+    sourceprefixes = ["base_TransformedShape_"]
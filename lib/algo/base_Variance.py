@@ -21,5 +21,4 @@ class Algo_base_Variance(algobase.Algo):
         (r'base_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_Variance_")
+    sourceprefixes = ["base_Variance_"]
@@ -17,5 +17,4 @@ from .. import algobase
 
 
 class Algo_calib(algobase.Algo):
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("calib_")
+    sourceprefixes = ["calib_"]
@@ -33,5 +33,4 @@ class Algo_deblend(algobase.Algo):
         },
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("deblend_")
+    sourceprefixes = ["deblend_"]
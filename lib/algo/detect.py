@@ -17,5 +17,4 @@ from .. import algobase
 
 
 class Algo_detect(algobase.Algo):
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("detect_")
+    sourceprefixes = ["detect_"]
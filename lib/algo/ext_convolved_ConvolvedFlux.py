@@ -63,5 +63,4 @@ class Algo_ext_convolved_ConvolvedFlux(algobase.Algo):
         (r'ext_convolved_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("ext_convolved_ConvolvedFlux_")
+    sourceprefixes = ["ext_convolved_ConvolvedFlux_"]
@@ -52,5 +52,4 @@ class Algo_ext_photometryKron_KronFlux(algobase.Algo):
         (r'ext_photometryKron_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("ext_photometryKron_KronFlux_")
+    sourceprefixes = ["ext_photometryKron_KronFlux_"]
@@ -65,5 +65,4 @@ class Algo_ext_shapeHSM(algobase.Algo):
         (r'ext_shapeHSM_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("ext_shapeHSM_")
+    sourceprefixes = ["ext_shapeHSM_"]
@@ -20,5 +20,4 @@ class Algo_footprint(algobase.Algo):
     renamerules = [
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("footprint")
+    sourceprefixes = ["footprint"]
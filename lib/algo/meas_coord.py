@@ -28,6 +28,14 @@ class Algo_meas_coord(algobase.Algo):
         (r'parent', 'parent_id'),
     ]
 
+    # "coord_ra" and "coord_dec" are passed in to add_coord()
+    sourceprefixes = [
+        "parent",
+        "deblend_nChild",
+        "coord_ra",
+        "coord_dec",
+    ]
+
     def __init__(self, sourceTable):
         fields = sourceTable.fields.pop_many([
             "parent"          ,
@@ -55,5 +55,4 @@ class Algo_meas_modelfit_CModel(algobase.Algo):
         (r'modelfit_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("modelfit_CModel_")
+    sourceprefixes = ["modelfit_CModel_"]
@@ -17,5 +17,4 @@ from .. import algobase
 
 
 class Algo_merge(algobase.Algo):
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("merge_")
+    sourceprefixes = ["merge_"]
@@ -41,5 +41,4 @@ class Algo_modelfit_CModel(algobase.Algo):
         (r'modelfit_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("modelfit_CModel_")
+    sourceprefixes = ["modelfit_CModel_"]
@@ -45,5 +45,4 @@ class Algo_modelfit_DoubleShapeletPsfApprox(algobase.Algo):
         (r'modelfit_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("modelfit_DoubleShapeletPsfApprox_")
+    sourceprefixes = ["modelfit_DoubleShapeletPsfApprox_"]
@@ -30,6 +30,13 @@ class Algo_multi_coord(algobase.Algo):
         #(r'parent', 'parent_id'),
     ]
 
+    sourceprefixes = [
+        "parent",
+        "deblend_nChild",
+        "coord_ra",
+        "coord_dec",
+    ]
+
     def __init__(self, sourceTable):
         #ra  = sourceTable.fields.pop("coord_ra").data
         #dec = sourceTable.fields.pop("coord_dec").data
@@ -17,5 +17,4 @@ from .. import algobase
 
 
 class Algo_pix(algobase.Algo):
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("pix_")
+    sourceprefixes = ["pix_"]
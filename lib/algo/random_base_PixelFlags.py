@@ -21,8 +21,10 @@ class Algo_random_base_PixelFlags(algobase.Algo):
         (r'base_PixelFlags_flag', 'PixelFlags'),
     ]
 
+    sourceprefixes = ["base_PixelFlags_"]
+
     def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("base_PixelFlags_")
+        algobase.Algo.__init__(self, sourceTable)
 
         suffix = "Center"
         noncenter_flags = [
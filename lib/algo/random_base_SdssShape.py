@@ -35,6 +35,8 @@ class Algo_random_base_SdssShape(algobase.Algo):
         (r'base_', ''),
     ]
 
+    sourceprefixes = ["base_SdssShape_psf_"]
+
     def __init__(self, sourceTable):
         sdssshape = sourceTable.cutout_subtable("base_SdssShape_")
         # throw away non-psf fields
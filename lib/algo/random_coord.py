@@ -26,6 +26,16 @@ class Algo_random_coord(algobase.Algo):
         (r'detect_isPrimary', 'isPrimary'),
     ]
 
+    sourceprefixes = [
+        "coord_ra",
+        "coord_dec",
+        "parent",
+        "detect_isPrimary",
+        "adjust_density",
+        "detect_isPatchInner",
+        "detect_isTractInner",
+    ]
+
     def __init__(self, sourceTable):
         ra  = sourceTable.fields.pop("coord_ra").data
         dec = sourceTable.fields.pop("coord_dec").data
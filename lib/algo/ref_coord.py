@@ -30,6 +30,14 @@ class Algo_ref_coord(algobase.Algo):
         (r'parent', 'parent_id'),
     ]
 
+    sourceprefixes = [
+        "coord_ra",
+        "coord_dec",
+        "parent",
+        "deblend_nChild",
+        "detect_isPrimary",
+    ]
+
     def __init__(self, sourceTable):
         ra  = sourceTable.fields.pop("coord_ra").data
         dec = sourceTable.fields.pop("coord_dec").data
@@ -141,6 +149,10 @@ def get_extinction(ra, dec):
         numpy.array
     """
 
+    # The dust map need not be loaded for an empty table (e.g. read header-only)
+    if len(ra) == 0:
+        return numpy.zeros(0, dtype=float)
+
     global _extinction
     if _extinction is None:
         _extinction = Extinction()
@@ -17,5 +17,4 @@ from .. import algobase
 
 
 class Algo_sky(algobase.Algo):
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("sky_")
+    sourceprefixes = ["sky_"]
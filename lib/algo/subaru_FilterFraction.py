@@ -21,5 +21,4 @@ class Algo_subaru_FilterFraction(algobase.Algo):
         (r'subaru_', ''),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("subaru_FilterFraction_")
+    sourceprefixes = ["subaru_FilterFraction_"]
@@ -46,5 +46,4 @@ class Algo_undeblended_base_CircularApertureFlux(algobase.Algo):
         (r'undeblended_base_Circular', 'undeblended_'),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("undeblended_base_CircularApertureFlux_")
+    sourceprefixes = ["undeblended_base_CircularApertureFlux_"]
@@ -33,5 +33,4 @@ class Algo_undeblended_base_PsfFlux(algobase.Algo):
         (r'undeblended_base', 'undeblended'),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("undeblended_base_PsfFlux_")
+    sourceprefixes = ["undeblended_base_PsfFlux_"]
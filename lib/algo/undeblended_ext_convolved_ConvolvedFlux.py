@@ -63,5 +63,4 @@ class Algo_undeblended_ext_convolved_ConvolvedFlux(algobase.Algo):
         (r'undeblended_ext_convolved_', 'undeblended_'),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("undeblended_ext_convolved_ConvolvedFlux_")
+    sourceprefixes = ["undeblended_ext_convolved_ConvolvedFlux_"]
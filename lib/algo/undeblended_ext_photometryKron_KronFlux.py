@@ -52,5 +52,4 @@ class Algo_undeblended_ext_photometryKron_KronFlux(algobase.Algo):
         (r'undeblended_ext_photometryKron', 'undeblended'),
     ]
 
-    def __init__(self, sourceTable):
-        self.sourceTable = sourceTable.cutout_subtable("undeblended_ext_photometryKron_KronFlux_")
+    sourceprefixes = ["undeblended_ext_photometryKron_KronFlux_"]
@@ -15,7 +15,8 @@
 
 from . import libwcs
 from . import common
-from .misc import PoppingOrderedDict
+from . import config
+from .misc import PoppingOrderedDict, stage_time, warning
 from . import sourcetable
 
 import numpy
@@ -187,11 +188,17 @@ class Algo(object):
             in "positions", "positionerrs", ... must be their
             original, long, full name.
 
-    Subclasses must override the constructor, and set
-    "self.sourceTable" member, thus:
-
-        def __init__(self, sourceTable):
-            self.sourceTable = sourceTable.cutout_subtable("base_MyFlux_")
+        * sourceprefixes:
+            list of prefixes of field names.
+            Fields whose names start with any of these prefixes
+            are those that this algorithm takes from the source table.
+            The constructor of this class cuts them out of the source table
+            and sets them to "self.sourceTable" member.
+            Loaders do not even read fields that no algorithm lists here.
+
+    Subclasses that need to do more than cutting out fields
+    may override the constructor, which must set "self.sourceTable" member.
+    Still, they must list the fields they take in "sourceprefixes".
     """
 
     __slots__ = ["filters"]
@@ -209,6 +216,18 @@ class Algo(object):
     ellipticityerrs = []
     doubleprecisions = []
     renamerules = []
+    sourceprefixes = []
+
+    # Map from alias: str -> (algo: Algo, referend: str),
+    # set by link_aliases() to the aliases not to be stored.
+    aliasReferends = {}
+
+    def __init__(self, sourceTable):
+        """
+        @param sourceTable (SourceTable):
+            Fields listed in "sourceprefixes" are cut out of it.
+        """
+        self.sourceTable = sourceTable.cutout_subtable(tuple(self.sourceprefixes))
 
     def set_filters(self, filters):
         """
@@ -220,6 +239,7 @@ class Algo(object):
         """
         self.filters = list(filters)
 
+    @stage_time("transform")
     def transform(self, rerunDir, tract, patch, filter, coord):
         """
         Transform coordinates, and convert field names.
@@ -254,9 +274,8 @@ class Algo(object):
             The sqltype is "big integer", "double precision", etc, for example.
         """
         ret = []
-        for field in self.sourceTable.fields.values():
-            for f in field.explode():
-                ret.append((prefix + f.name, f.get_sqltype()))
+        for f in self._get_stored_fields():
+            ret.append((prefix + f.name, f.get_sqltype()))
 
         return ret
 
@@ -272,12 +291,99 @@ class Algo(object):
             in which x and y are numpy.array.
         """
         ret = []
-        for field in self.sourceTable.fields.values():
-            for f in field.explode():
-                ret.append((prefix + f.name, f.get_print_format(), f.get_columns()))
+        for f in self._get_stored_fields():
+            ret.append((prefix + f.name, f.get_print_format(), f.get_columns()))
 
         return ret
 
+    def _get_stored_fields(self):
+        """
+        Get the fields to be stored in the backend table, exploded into scalars.
+        If config.packFlags is True and this algorithm has more than
+        _maxUnpackedFlags boolean fields, they are packed into Bigint bitmasks
+        (See get_flag_bits()), which are placed after the other fields.
+        Aliases linked to their referends (See link_aliases()) are not stored.
+        @return list of sourcetable.Field.
+        """
+        links = self._get_alias_links()
+        fields = [
+            f for key, field in self.sourceTable.fields.items() if key not in links
+            for f in field.explode()
+        ]
+
+        bits = self.get_flag_bits()
+        if not bits:
+            return fields
+
+        flags = [f for f in fields if f.name in bits]
+        fields = [f for f in fields if f.name not in bits]
+
+        for i in range(0, len(flags), 64):
+            name, bit = bits[flags[i].name]
+            fields.append(sourcetable.Field(name, "Scalar", "", pack_flags([f.data for f in flags[i:i+64]]), ""))
+
+        return fields
+
+    def get_flag_bits(self):
+        """
+        Get the places of boolean fields in packed bitmasks.
+        @return (dict)
+            Map from field name -> (name of the bitmask, bit number).
+            Empty unless config.packFlags is True and this algorithm
+            has more than _maxUnpackedFlags boolean fields.
+        """
+        if not config.packFlags:
+            return {}
+
+        links = self._get_alias_links()
+        flags = [
+            f.name for key, field in self.sourceTable.fields.items() if key not in links
+            for f in field.explode()
+            if f.data.dtype.name == "bool"
+        ]
+        if len(flags) <= _maxUnpackedFlags:
+            return {}
+
+        family = type(self).__name__
+        if family.startswith("Algo_"):
+            family = family[len("Algo_"):]
+
+        return dict(
+            (name, ("{}_flagbits{}".format(family, i // 64), i % 64))
+            for i, name in enumerate(flags)
+        )
+
+    def _get_alias_links(self):
+        """
+        Get the aliases in this algorithm that are not to be stored.
+        @return (dict)
+            Map from alias: str -> (algo: Algo, referend: str).
+            The referend is a key of algo.sourceTable.fields.
+        """
+        return dict(
+            (key, (algo, referend)) for key, (algo, referend) in self.aliasReferends.items()
+            if referend in algo.sourceTable.fields
+        )
+
+    def _get_stored_phrase(self, key, prefix):
+        """
+        Get SQL phrases with which to read the members of a stored field.
+        @param key (str)
+            Key of the field in self.sourceTable.fields.
+        @param prefix (str)
+            This prefix will be prefixed to field names.
+        @return list of str, one for each of field.explode().
+        """
+        bits = self.get_flag_bits()
+        phrases = []
+        for f in self.sourceTable.fields[key].explode():
+            if f.name in bits:
+                bitmask, bit = bits[f.name]
+                phrases.append(get_exporting_phrase_Flag(prefix + bitmask, bit))
+            else:
+                phrases.append(prefix + f.name)
+        return phrases
+
     def get_frontend_fields(self, prefix):
         """
         Get field data for the frontend view.
@@ -292,6 +398,7 @@ class Algo(object):
 
         fluxes = {desc["flux"]: desc for desc in self.fluxes}
         fluxerrs = {desc["fluxerr"]: desc for desc in self.fluxerrs}
+        bits = self.get_flag_bits()
 
         for key, field in self.sourceTable.fields.items():
             if key in fluxes:
@@ -316,7 +423,24 @@ class Algo(object):
             else:
                 for f in field.explode():
                     member = prefix + f.name
-                    members.append((member, member, f.unit, f.doc))
+                    if f.name in bits:
+                        bitmask, bit = bits[f.name]
+                        members.append((member, get_exporting_phrase_Flag(prefix + bitmask, bit), f.unit, f.doc))
+                    else:
+                        members.append((member, member, f.unit, f.doc))
+
+        # Aliases not stored are read from their referends.
+        links = self._get_alias_links()
+        if links:
+            referends = {}
+            for key, (algo, referend) in links.items():
+                for f, phrase in zip(self.sourceTable.fields[key].explode(), algo._get_stored_phrase(referend, prefix)):
+                    referends[prefix + f.name] = phrase
+            pattern = re.compile(r'\b(?:{})\b'.format("|".join(re.escape(name) for name in referends)))
+            members = [
+                (member, pattern.sub(lambda m: referends[m.group(0)], definition), unit, doc)
+                for member, definition, unit, doc in members
+            ]
 
         return members
 
@@ -580,6 +704,184 @@ class _AlgoTransformer(object):
         return ra, dec
 
 
+def get_sourceprefixes(algoclasses):
+    """
+    Get prefixes of the fields that the given algorithms take.
+    @param algoclasses (iterable of class):
+        Subclasses of Algo.
+    @return (list of str)
+    """
+    prefixes = set()
+    for algoclass in algoclasses:
+        prefixes.update(algoclass.sourceprefixes)
+    return sorted(prefixes)
+
+
+class PrefixDispatcher(object):
+    """
+    Partitioner of a source table's fields into the subtables
+    of the algorithms in a registry.
+
+    It is equivalent to calling sourceTable.cutout_subtable(prefixes)
+    for each algorithm in order, and then for each ignored prefix,
+    but the fields are looked up in a trie of all the prefixes
+    and the table is scanned only once.
+
+    Fields in the file that were not read (SourceTable.unread) and that
+    no ignored prefix matches are reported once for each fingerprint of headers.
+    """
+    __slots__ = ["names", "nIgnored", "trie", "owners", "reported"]
+
+    def __init__(self, algos, ignored=[]):
+        """
+        @param algos (PoppingOrderedDict)
+            Map from name: str -> algoclass: class (e.g. forced_algos.forced_algos).
+            A field goes to the first algorithm one of whose "sourceprefixes" it starts with.
+        @param ignored (list of str)
+            Prefixes of fields that no algorithm takes but that are silently discarded.
+        """
+        self.names = list(algos.keys())
+        self.nIgnored = len(ignored)
+
+        # Each node of the trie is a dict mapping a character to a child node.
+        # The key None maps to the index of the owner of the prefix ending there.
+        self.trie = {}
+        owners = [algoclass.sourceprefixes for algoclass in algos.values()] + [[prefix] for prefix in ignored]
+        for index, prefixes in enumerate(owners):
+            for prefix in prefixes:
+                node = self.trie
+                for c in prefix:
+                    node = node.setdefault(c, {})
+                node[None] = min(node.get(None, index), index)
+
+        # Cache of field name -> index of owner (None if no owner),
+        # because files of a registry have the same fields.
+        self.owners = {}
+
+        # Fingerprints of the headers whose unread fields have been reported
+        self.reported = set()
+
+    def dispatch(self, sourceTable):
+        """
+        Cut out the subtables of the algorithms from a source table.
+        Fields taken by algorithms, and fields ignored, are removed from the table:
+        those that remain in it are the fields that nobody takes.
+        @param sourceTable (SourceTable)
+        @return (PoppingOrderedDict)
+            Map from algorithm's name: str -> subtable: SourceTable,
+            in which the algorithm is to be constructed.
+        """
+        subfields = [PoppingOrderedDict() for i in range(len(self.names) + self.nIgnored)]
+        remaining = PoppingOrderedDict()
+
+        for key, field in sourceTable.fields.items():
+            owner = self._get_owner(key)
+            if owner is None:
+                remaining[key] = field
+            else:
+                subfields[owner][key] = field
+
+        sourceTable.fields = remaining
+
+        fingerprint = getattr(sourceTable.fitsheader, "fingerprint", None)
+        if sourceTable.unread and (fingerprint is None or fingerprint not in self.reported):
+            if fingerprint is not None:
+                self.reported.add(fingerprint)
+            unmatched = [key for key in sourceTable.unread if self._get_owner(key) is None]
+            if unmatched:
+                warning("Ignored fields (no algorithm takes them):", ", ".join(unmatched))
+
+        return PoppingOrderedDict(
+            (name, sourcetable.SourceTable(fields, sourceTable.slots, sourceTable.fitsheader))
+            for name, fields in zip(self.names, subfields)
+        )
+
+    def _get_owner(self, key):
+        """
+        Get the index of the owner of a field, with the cache.
+        @return
+            Index of the owner, or None if there is not.
+        """
+        owner = self.owners.get(key, _undefined)
+        if owner is _undefined:
+            owner = self.owners[key] = self._find_owner(key)
+        return owner
+
+    def _find_owner(self, key):
+        """
+        Find the first owner of the prefixes that the key starts with.
+        @return
+            Index of the owner, or None if there is not.
+        """
+        owner = None
+        node = self.trie
+        for c in key:
+            index = node.get(None)
+            if index is not None and (owner is None or index < owner):
+                owner = index
+            node = node.get(c)
+            if node is None:
+                return owner
+
+        index = node.get(None)
+        if index is not None and (owner is None or index < owner):
+            owner = index
+        return owner
+
+_undefined = object()
+
+# Boolean fields of an algorithm are packed into bitmasks
+# only if there are more than this many of them,
+# because fewer Booleans take no more room than a Bigint.
+_maxUnpackedFlags = 8
+
+
+def link_aliases(algos):
+    """
+    Let aliases (ALIAS in fits headers) in a table be stored only once.
+    An alias whose referend is also in one of the algorithms is not stored,
+    and the views read the referend instead (See Algo.get_frontend_fields()).
+    Aliases of aliases, and aliases whose members differ in number
+    from those of their referends, are stored as they are.
+    @param algos (list of Algo)
+        Algorithms of a table.
+    """
+    owners = {}
+    aliases = {}
+    for algo in algos:
+        aliases.update(algo.sourceTable.get_aliases())
+        for key in algo.sourceTable.fields:
+            owners[key] = algo
+
+    for algo in algos:
+        links = {}
+        for key, field in algo.sourceTable.fields.items():
+            referend = aliases.get(key)
+            if referend is None or referend in aliases or referend not in owners:
+                continue
+            if len(field.explode()) != len(owners[referend].sourceTable.fields[referend].explode()):
+                continue
+            links[key] = (owners[referend], referend)
+        algo.aliasReferends = links
+
+
+def pack_flags(columns):
+    """
+    Pack boolean columns into a bitmask.
+    @param columns (list of numpy.array)
+        At most 64 boolean columns of the same length.
+        columns[i] goes to bit i (the least significant bit is bit 0).
+    @return (numpy.array)
+        Bitmasks in int64.
+    """
+    if len(columns) > 64:
+        raise RuntimeError("Too many flags to pack into a Bigint: {}".format(len(columns)))
+
+    bits = numpy.zeros(shape=(len(columns[0]), 64), dtype=bool)
+    bits[:, :len(columns)] = numpy.column_stack(columns)
+    return numpy.packbits(bits, axis=1, bitorder="little").view("<i8").reshape(-1)
+
+
 def to_safe_ident(name):
     """
     Convert an identifier to a safe one: [a-z_][a-z0-9_]*
@@ -606,6 +908,15 @@ def get_exporting_phrase_Flux_err(fluxErrName):
     public."_forced:export_fluxerr"({fluxErrName})
     """.format(**locals())
 
+def get_exporting_phrase_Flag(bitmaskName, bit):
+    """
+    Get SQL phrase that extracts a flag packed in a bitmask
+    stored in the child table (See Algo.get_flag_bits()).
+    """
+    return """
+    ((({bitmaskName} >> {bit}) & 1) <> 0)
+    """.format(**locals())
+
 def get_exporting_phrase_Mag(fluxName):
     """
     Get SQL phrase that transforms a magnitude stored in the child table
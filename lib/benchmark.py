@@ -0,0 +1,294 @@
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import psycopg2
+
+
+class TempCluster(object):
+    """
+    Throwaway PostgreSQL cluster created by initdb in a temporary directory.
+    It listens only on a Unix-domain socket in the directory.
+    Usage:
+        with TempCluster() as cluster:
+            connect with cluster.dbServer
+    """
+    __slots__ = ["pgBin", "options", "directory", "port", "dbServer"]
+
+    def __init__(self, pgBin="", options=[]):
+        """
+        @param pgBin (str)
+            Directory of initdb and pg_ctl. If empty, they are searched in $PATH.
+        @param options (list of str)
+            Server parameters like "shared_buffers=1GB".
+        """
+        self.pgBin = pgBin
+        self.options = list(options)
+        self.directory = None
+        self.port = None
+        self.dbServer = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self, dbname="benchmark"):
+        """
+        Create and start the cluster, and create a database in it.
+        """
+        self.directory = tempfile.mkdtemp(prefix="pgbench-")
+        self.port = _get_free_port()
+        dataDir = os.path.join(self.directory, "data")
+
+        self._run("initdb", "-D", dataDir, "-U", "postgres", "-A", "trust", "-E", "UTF8", "--no-sync")
+
+        options = ["-k", self.directory, "-p", str(self.port), "-c", "listen_addresses="]
+        for option in self.options:
+            options += ["-c", option]
+        self._run("pg_ctl", "-D", dataDir, "-l", os.path.join(self.directory, "server.log"),
+            "-w", "-o", " ".join(_quote_option(opt) for opt in options), "start")
+
+        self.dbServer = {"host": self.directory, "port": str(self.port), "user": "postgres", "dbname": "postgres"}
+        db = psycopg2.connect(**self.dbServer)
+        db.autocommit = True
+        with db.cursor() as cursor:
+            cursor.execute('CREATE DATABASE "{}"'.format(dbname))
+        db.close()
+        self.dbServer["dbname"] = dbname
+
+    def execute_file(self, path):
+        """
+        Execute an SQL file (e.g. preparation.sql) in the database.
+        """
+        with open(path) as fin:
+            sql = fin.read()
+        db = psycopg2.connect(**self.dbServer)
+        db.autocommit = True
+        with db.cursor() as cursor:
+            cursor.execute(sql)
+        db.close()
+
+    def stop(self):
+        """
+        Stop the cluster and remove its directory.
+        """
+        if self.directory is None:
+            return
+        try:
+            self._run("pg_ctl", "-D", os.path.join(self.directory, "data"), "-m", "fast", "-w", "stop")
+        finally:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def _run(self, command, *args):
+        if self.pgBin:
+            command = os.path.join(self.pgBin, command)
+        subprocess.run([command] + list(args), check=True, stdout=subprocess.DEVNULL)
+
+
+def _get_free_port():
+    """
+    Get a port number not used by now.
+    The port is used only as the suffix of the socket's name.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _quote_option(option):
+    if not option or any(c in option for c in " '\"\\"):
+        return "'{}'".format(option.replace("\\", "\\\\").replace("'", "\\'"))
+    return option
+
+
+def run_timed(args, **kwargs):
+    """
+    Run a command and measure it.
+    @param args (list of str)
+        Command line.
+    @param kwargs
+        Passed to subprocess.Popen.
+    @return (seconds, peakRssMB)
+        Wall-clock time and the peak resident set size of the process
+        (or of its largest descendant that it has waited for).
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(args, **kwargs)
+    pid, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+    if process.returncode != 0:
+        raise RuntimeError("Command failed ({}): {}".format(process.returncode, " ".join(args)))
+
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    peakRss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return seconds, peakRss / float(1 << 20)
+
+
+def get_environment():
+    """
+    Get a description of the environment in which benchmarks run.
+    """
+    return {
+        "date"    : datetime.datetime.now().isoformat(timespec="seconds"),
+        "host"    : platform.node(),
+        "platform": platform.platform(),
+        "python"  : platform.python_version(),
+        "cpus"    : os.cpu_count(),
+    }
+
+
+def save(path, results):
+    """
+    Save results of benchmarks in JSON.
+    @param results (dict)
+        {"environment": {...}, "metrics": {name: value}, ...}
+    """
+    with open(path, "w") as fout:
+        json.dump(results, fout, indent=2, sort_keys=True)
+        fout.write("\n")
+
+
+def load(path):
+    with open(path) as fin:
+        return json.load(fin)
+
+
+def is_higher_better(name):
+    """
+    Whether a larger value of a metric is better.
+    Throughputs ("*_per_sec") are; times, sizes and ns/row are not.
+    """
+    return name.endswith("_per_sec")
+
+
+def compare(baseline, current, threshold=0.1, thresholds={}, minimum=0.0):
+    """
+    Compare metrics of two results of benchmarks.
+    @param baseline (dict)
+        Result loaded by load().
+    @param current (dict)
+        Result loaded by load().
+    @param threshold (float)
+        Relative change beyond which a metric is judged to have regressed.
+        0.1 means 10%.
+    @param thresholds (dict)
+        Map from metric name (or its prefix ending with ".") to a threshold
+        that takes precedence over "threshold".
+    @param minimum (float)
+        Metrics whose baseline values (in absolute) are smaller than this
+        are reported but never judged to have regressed: they are mostly noise.
+    @return (rows, regressions)
+        * rows: list of (name, baseline, current, relative change, verdict),
+        * regressions: list of names of metrics that have regressed.
+    """
+    rows = []
+    regressions = []
+
+    old = baseline["metrics"]
+    new = current["metrics"]
+
+    for name in sorted(set(old) | set(new)):
+        if name not in old or name not in new:
+            rows.append((name, old.get(name), new.get(name), None, "missing"))
+            continue
+
+        before, after = old[name], new[name]
+        if before == 0:
+            rows.append((name, before, after, None, ""))
+            continue
+
+        change = (after - before) / abs(before)
+        worse = -change if is_higher_better(name) else change
+
+        limit = threshold
+        for key, value in thresholds.items():
+            if name == key or (key.endswith(".") and name.startswith(key)):
+                limit = value
+
+        if worse > limit and abs(before) >= minimum:
+            verdict = "REGRESSED"
+            regressions.append(name)
+        elif worse < -limit:
+            verdict = "improved"
+        else:
+            verdict = ""
+
+        rows.append((name, before, after, change, verdict))
+
+    return rows, regressions
+
+
+def add_compare_arguments(parser):
+    """
+    Add the arguments of "compare" subcommands to an argparse parser.
+    """
+    parser.add_argument("baseline", help="JSON file of the baseline")
+    parser.add_argument("current", help="JSON file to be compared with the baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change (0.1 = 10%%) beyond which a metric is judged to have regressed")
+    parser.add_argument("--metric-threshold", metavar="name=value", action="append", default=[],
+        help="Threshold for a metric, or for metrics beginning with a prefix ending with '.' (e.g. 'meas.stage.=0.3')")
+    parser.add_argument("--min-value", type=float, default=0.1, help="Metrics whose baseline values are below this are never judged to have regressed")
+
+
+def compare_files(args):
+    """
+    Compare the files given by the arguments added by add_compare_arguments(),
+    print the comparison, and exit with status 1 if any metric has regressed.
+    """
+    thresholds = {}
+    for keyvalue in args.metric_threshold:
+        key, value = keyvalue.rsplit('=', 1)
+        thresholds[key] = float(value)
+
+    rows, regressions = compare(load(args.baseline), load(args.current), args.threshold, thresholds, args.min_value)
+    print_comparison(rows)
+    if regressions:
+        print("Regressed: " + ", ".join(regressions), file=sys.stderr)
+        sys.exit(1)
+
+
+def print_comparison(rows, fout=sys.stdout):
+    """
+    Print rows returned by compare().
+    """
+    width = max([len(row[0]) for row in rows] + [6])
+    print("{:{width}}  {:>14}  {:>14}  {:>8}".format("metric", "baseline", "current", "change", width=width), file=fout)
+    for name, before, after, change, verdict in rows:
+        print("{:{width}}  {:>14}  {:>14}  {:>8}  {}".format(
+            name, _format_value(before), _format_value(after),
+            "" if change is None else "{:+.1%}".format(change),
+            verdict, width=width), file=fout)
+
+
+def _format_value(value):
+    if value is None:
+        return "-"
+    return "{:.6g}".format(value)
@@ -0,0 +1,224 @@
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Estimation of on-disk sizes of tables and indexes in PostgreSQL.
+
+The estimates follow PostgreSQL's page layout with the default block size
+and fill factors. Free space map, visibility map and dead tuples are ignored.
+"""
+
+import math
+import re
+
+# Map from SQL type (lower case) -> (size, alignment) in bytes.
+# The SQL types are those in sourcetable.Field.dtypesToSQLType
+# and "Earth", which is a cube of a single point in 3D (a varlena of 4 + 4 + 3*8 bytes).
+sqlTypes = {
+    "boolean"         : (1, 1),
+    "smallint"        : (2, 2),
+    "integer"         : (4, 4),
+    "bigint"          : (8, 8),
+    "real"            : (4, 4),
+    "double precision": (8, 8),
+    "earth"           : (32, 8),
+}
+
+# Size of the bounding box of "Earth" in internal pages of GiST (4 + 4 + 2*3*8 bytes)
+_earthBoxSize = 56
+
+_blockSize = 8192
+_pageHeaderSize = 24
+_itemIdSize = 4
+_maxAlign = 8
+_heapTupleHeaderSize = 23
+_indexTupleHeaderSize = 8
+_indexSpecialSize = 16
+_maxHeapTuplesPerPage = 291
+_maxHeapTupleSize = _blockSize - (_pageHeaderSize + _itemIdSize + _maxAlign - 1) // _maxAlign * _maxAlign
+_maxColumns = 1600
+
+# Default fill factors of indexes built by CREATE INDEX
+_btreeFillFactor = 0.9
+_gistFillFactor = 0.9
+
+
+def _align(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _get_type(sqltype):
+    try:
+        return sqlTypes[sqltype.lower()]
+    except KeyError:
+        raise RuntimeError("Size of SQL type unknown: " + sqltype)
+
+
+def get_data_size(sqltypes):
+    """
+    Get the size of the data part of a tuple.
+    @param sqltypes (list of str)
+        SQL types of the columns in order.
+    @return (int)
+    """
+    offset = 0
+    for sqltype in sqltypes:
+        size, alignment = _get_type(sqltype)
+        offset = _align(offset, alignment) + size
+    return offset
+
+
+def get_heap_tuple_size(sqltypes):
+    """
+    Get the size of a heap tuple (a row), assuming it may contain NULLs.
+    @param sqltypes (list of str)
+        SQL types of the columns in order.
+    @return (int)
+    """
+    nullBitmap = (len(sqltypes) + 7) // 8
+    return _align(_heapTupleHeaderSize + nullBitmap, _maxAlign) + _align(get_data_size(sqltypes), _maxAlign)
+
+
+def estimate_heap_size(sqltypes, nRows):
+    """
+    Estimate the size of a table.
+    @param sqltypes (list of str)
+        SQL types of the columns in order.
+    @param nRows (int)
+        Number of rows.
+    @return (int)
+        Size in bytes.
+    """
+    if len(sqltypes) > _maxColumns:
+        raise RuntimeError("Too many columns: {} > {}".format(len(sqltypes), _maxColumns))
+
+    tupleSize = get_heap_tuple_size(sqltypes)
+    if tupleSize > _maxHeapTupleSize:
+        raise RuntimeError("Row is too big: {} > {} bytes".format(tupleSize, _maxHeapTupleSize))
+
+    tuplesPerPage = min(_maxHeapTuplesPerPage, (_blockSize - _pageHeaderSize) // (tupleSize + _itemIdSize))
+    return int(math.ceil(nRows / tuplesPerPage)) * _blockSize
+
+
+def estimate_index_size(keySize, nRows, fillFactor=_btreeFillFactor, innerKeySize=None):
+    """
+    Estimate the size of a B-tree (or GiST) index built by CREATE INDEX.
+    @param keySize (int)
+        Size of the key (aligned data) in leaf tuples.
+    @param nRows (int)
+        Number of rows indexed.
+    @param fillFactor (float)
+        Fraction of pages filled.
+    @param innerKeySize (int)
+        Size of the key in inner tuples (Default: keySize)
+    @return (int)
+        Size in bytes.
+    """
+    if innerKeySize is None:
+        innerKeySize = keySize
+
+    usable = (_blockSize - _pageHeaderSize - _indexSpecialSize) * fillFactor
+    leafTuplesPerPage = max(2, int(usable // (_align(_indexTupleHeaderSize + keySize, _maxAlign) + _itemIdSize)))
+    innerTuplesPerPage = max(2, int(usable // (_align(_indexTupleHeaderSize + innerKeySize, _maxAlign) + _itemIdSize)))
+
+    # A metapage and the root
+    nPages = 1
+    nLevel = int(math.ceil(nRows / leafTuplesPerPage))
+    while nLevel > 1:
+        nPages += nLevel
+        nLevel = int(math.ceil(nLevel / innerTuplesPerPage))
+
+    return (nPages + 1) * _blockSize
+
+
+_indexPattern = re.compile(
+    r'\bON\s+\S+\s*(?:USING\s+(\w+)\s*)?\((.*)\)\s*(?:TABLESPACE\s+\S+\s*)?(?:WHERE\b.*)?$',
+    re.IGNORECASE | re.DOTALL)
+
+def estimate_index_size_from_sql(sql, columns, nRows):
+    """
+    Estimate the size of an index from the "CREATE INDEX" statement.
+    Partial indexes ("WHERE ...") are assumed to index all rows,
+    so their sizes are overestimated.
+    @param sql (str)
+        "CREATE INDEX" statement.
+    @param columns (list of (name, sqltype))
+        Columns of the table.
+    @param nRows (int)
+        Number of rows in the table.
+    @return (int)
+        Size in bytes.
+    """
+    m = _indexPattern.search(sql)
+    if not m:
+        raise RuntimeError("Index not understood: " + " ".join(sql.split()))
+
+    method, keys = m.groups()
+    types = dict((name.lower(), sqltype) for name, sqltype in columns)
+
+    keyTypes = []
+    for key in _split_keys(keys):
+        key = key.strip().strip('"').lower()
+        # Expressions (function calls) are assumed to be Bigint.
+        keyTypes.append(types.get(key, "Bigint"))
+
+    if method is not None and method.lower() == "gist":
+        if keyTypes != ["Earth"]:
+            raise RuntimeError("GiST index not understood: " + " ".join(sql.split()))
+        return estimate_index_size(get_data_size(keyTypes), nRows, _gistFillFactor, innerKeySize=_earthBoxSize)
+
+    return estimate_index_size(get_data_size(keyTypes), nRows, _btreeFillFactor)
+
+
+def _split_keys(keys):
+    """
+    Split "a, f(b, c)" into ["a", "f(b, c)"].
+    """
+    ret = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(keys):
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "," and depth == 0:
+            ret.append(keys[start:i])
+            start = i + 1
+    ret.append(keys[start:])
+    return ret
+
+
+def format_size(nBytes):
+    """
+    Format a size in bytes like "1.23 GB".
+    """
+    for unit in ["B", "kB", "MB", "GB", "TB"]:
+        if abs(nBytes) < 1024 or unit == "TB":
+            return "{:.2f} {}".format(nBytes, unit) if unit != "B" else "{} B".format(int(nBytes))
+        nBytes /= 1024.0
+
+
+def parse_size(size):
+    """
+    Parse a size like "500GB" or "2 TB" (units are powers of 1024).
+    @return (int)
+        Size in bytes.
+    """
+    m = re.match(r'^\s*([0-9.]+)\s*([kMGT]?)B?\s*$', size, re.IGNORECASE)
+    if not m:
+        raise RuntimeError("Size not understood: " + size)
+    number, unit = m.groups()
+    return int(float(number) * 1024 ** ["", "k", "m", "g", "t"].index(unit.lower()))
@@ -14,6 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import collections
+import fnmatch
 import glob
 import os
 import re
@@ -22,6 +23,7 @@ import psycopg2
 
 from . import config
 from . import libdb
+from . import manifest
 
 
 def get_image_path(rerunDir, tract, patch, filter):
@@ -53,7 +55,10 @@ def get_existing_filters(rerunDir, hsc=False):
         List of filter names, sorted.
     """
 
-    filters = os.listdir("{rerunDir}/deepCoadd-results".format(**locals()))
+    if config.manifest:
+        filters = get_manifest(rerunDir).get_filters()
+    else:
+        filters = os.listdir("{rerunDir}/deepCoadd-results".format(**locals()))
     if hsc:
         return sorted((f for f in filters if re.match(r'^(?:HSC-.*|NB.*)$', f)),
                       key=lambda f: filterOrder[f])
@@ -70,12 +75,77 @@ def get_existing_tracts(rerunDir):
     @return
         List of tract numbers, sorted.
     """
-    tracts = [os.path.basename(path) for path in glob.iglob("{rerunDir}/deepCoadd-results/*/*".format(**locals()))]
+    if config.manifest:
+        tracts = get_manifest(rerunDir).get_tracts()
+    else:
+        tracts = [os.path.basename(path) for path in glob.iglob("{rerunDir}/deepCoadd-results/*/*".format(**locals()))]
 
     return sorted(set(
         int(tract) for tract in tracts if re.match(r'^[0-9]+$', tract)
     ) )
 
+def get_existing_patches(rerunDir, tract, filterDir, kind):
+    """
+    Search "rerunDir" and return patches in which catalogs of a kind exist.
+    @param rerunDir
+        Path to the rerun directory from which to generate the master table
+    @param tract
+        Tract number.
+    @param filterDir
+        Name (or glob pattern) of the directories of filters: "merged", "*", etc.
+    @param kind
+        Kind of catalogs: "ref", "meas", "ran", etc.
+    @return
+        List of patch numbers, sorted.
+    """
+    if config.manifest:
+        return get_manifest(rerunDir).get_patches(kind, tract, filterDir)
+
+    patches = set(
+        os.path.basename(os.path.dirname(path))
+        for path in glob.iglob("{rerunDir}/deepCoadd-results/{filterDir}/{tract}/*,*/{kind}-*.fits*".format(**locals()))
+        if path.endswith('.fits') or path.endswith('.fits.gz')
+    )
+
+    return sorted(set(
+        patch_to_number(patch) for patch in patches if re.match(r'^[0-9]+,[0-9]+$', patch)
+    ))
+
+
+# Map from rerunDir -> lib.manifest.Manifest
+_manifests = {}
+
+def get_manifest(rerunDir):
+    """
+    Get the manifest (config.manifest) of "rerunDir",
+    which is brought up to date when it is first got in the process.
+    @param rerunDir
+        Path to the rerun directory.
+    @return (lib.manifest.Manifest)
+    """
+    rerunDir = os.path.normpath(rerunDir)
+    m = _manifests.get(rerunDir)
+    if m is None:
+        m = manifest.Manifest(rerunDir, config.manifest)
+        nListed, nRead = m.refresh()
+        print("Manifest {}: {} files ({} directories listed, {} headers read)".format(
+            config.manifest, len(m.files), nListed, nRead))
+        _manifests[rerunDir] = m
+    return m
+
+
+def _get_manifest_covering(path):
+    """
+    Get a manifest already got by get_manifest() that can tell about the path.
+    @return (lib.manifest.Manifest)
+        None if there is no such manifest.
+    """
+    for m in _manifests.values():
+        if m.covers(path):
+            return m
+    return None
+
+
 def patch_to_number(patchStr):
     """
     Convert "x,y" to 100*x + y
@@ -93,9 +163,9 @@ def path_decompose(path):
     basename = os.path.basename(path)
     #print("In path_decompose called with path=", path)
     #print("Computed basename=", basename)
-    # For LSST forced source filepaths have only 'forced', not 'forced_src'
+    # For LSST forced source filepaths may have 'forced' instead of 'forced_src'
     #m = re.match(r'^(?:calexp|forced_src|meas|ran|forced_src_undeblendedConvolved)-(HSC-\w+|NB-?\w+)-([0-9]+)-([0-9]+),([0-9]+)\.fits(?:\.gz)?$', basename)
-    m = re.match(r'^(?:calexp|forced|meas|ran|forced_src_undeblendedConvolved)-([a-z])-([0-9]+)-([0-9]+),([0-9]+)\.fits(?:\.gz)?$', basename)
+    m = re.match(r'^(?:calexp|forced|forced_src|meas|ran|forced_src_undeblendedConvolved)-([a-z])-([0-9]+)-([0-9]+),([0-9]+)\.fits(?:\.gz)?$', basename)
     if m:
         filter, tract, x, y = m.groups()
         patch = int(x)*100 + int(y)
@@ -113,17 +183,41 @@ def path_exists(path):
     """
     os.path.exists() with gzip compression considered
     """
+    m = _get_manifest_covering(path)
+    if m is not None:
+        return m.get_file(path) is not None
     return os.path.exists(path) or os.path.exists(path + ".gz")
 
 
+def iglob_compressed(pattern):
+    """
+    glob.iglob() with gzip compression considered.
+    Paths matching the pattern, or the pattern + ".gz", are yielded
+    in a single walk of the directories. The ".gz" is not removed.
+    """
+    m = _get_manifest_covering(pattern)
+    if m is not None:
+        yield from m.iglob(pattern)
+        return
+
+    for path in glob.iglob(pattern + "*"):
+        if fnmatch.fnmatchcase(path, pattern) or fnmatch.fnmatchcase(path, pattern + ".gz"):
+            yield path
+
+
 def new_db_connection():
     """
     Create a connection to the database.
     """
+    dbServer = dict(config.dbServer)
+    if config.bulkMode:
+        # Loaded data is not durable until the tables are set LOGGED anyway.
+        dbServer["options"] = (dbServer.get("options", "") + " -c synchronous_commit=off").strip()
+
     if config.NDEBUG:
-        return psycopg2.connect(**config.dbServer)
+        return psycopg2.connect(**dbServer)
     else:
-        return libdb.DBConnectionDebug(psycopg2.connect(**config.dbServer))
+        return libdb.DBConnectionDebug(psycopg2.connect(**dbServer))
 
 # Not needed for LSST DC2 data.  Short names are always used.
 filterToShortName = collections.OrderedDict([
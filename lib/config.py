@@ -19,11 +19,73 @@ NDEBUG = True
 #NDEBUG = False
 MULTICORE = True
 
+# "binary" or "text": format of COPY with which to insert rows
+copyFormat = "binary"
+
 withSkymapWcs = ""
 
+# Path to the manifest (SQLite file) of the rerun directory.
+# If empty, the rerun directory is searched by glob.
+manifest = ""
+
+# Whether the flags of each algorithm are packed into Bigint bitmasks
+# instead of being stored in Boolean columns (See algobase.Algo.get_flag_bits())
+packFlags = False
+
+# Whether aliases (ALIAS in fits headers) are stored only once in a table
+# (See algobase.link_aliases())
+dedupeAliases = False
+
+# Physical layout of the tables (See lib.layout).
+# If empty, columns are stored as they are in the catalogs.
+layout = {}
+
+# File from which the layout was read. The layout is written back into it
+# when it is fitted to a rerun (See lib.layout.fit()).
+layoutPath = ""
+
+# Whether the algorithms of multiband tables are packed into part tables
+# automatically (See lib.partitioner) instead of by the lists in the loaders.
+# A part table has at most partMaxColumns columns (also in its view)
+# and rows of at most partMaxRowWidth bytes when it has partFilters filters.
+# The loaders raise partFilters to the number of filters in the rerun directory.
+autoPartition = False
+partMaxColumns = 1400
+partMaxRowWidth = 8000
+partFilters = 6
+
+# Whether dpdd is a table of primary objects filled at load time
+# instead of a view (See create-dryrun-forced.py and dpdd.DpddTable)
+materializeDpdd = False
+
+# Whether the contents of loaded files are hashed (See lib.filesync).
+# Without the hashes, files that have been touched are reloaded by --sync.
+hashFiles = False
+
+# Whether tables are range-partitioned on object_id by tract
+partitionByTract = False
+
+# Whether tables are created UNLOGGED and set LOGGED after loading,
+# with synchronous_commit turned off.
+bulkMode = False
+
+# Queue of patches shared by loaders on several hosts (See lib.workqueue):
+# a job whose heartbeat has stopped for queueStaleSeconds is claimed again,
+# and a job that has failed queueMaxAttempts times is given up.
+queueHeartbeatSeconds = 30
+queueStaleSeconds = 600
+queueMaxAttempts = 3
+
 tableSpace = ""
 indexSpace = ""
 
+# Number of DB connections with which to create indexes in parallel
+indexJobs = 1
+# maintenance_work_mem and max_parallel_maintenance_workers
+# of the connections with which to create indexes ("" and None: server's defaults)
+maintenanceWorkMem = ""
+maxParallelMaintenanceWorkers = None
+
 dbServer = {
     'dbname': os.environ.get("USER", "postgres"),
 }
@@ -35,6 +97,12 @@ def get_table_space():
     else:
         return ''
 
+def get_persistence():
+    if bulkMode:
+        return 'UNLOGGED'
+    else:
+        return ''
+
 def get_index_space():
     if indexSpace:
         return 'TABLESPACE "{}"'.format(indexSpace)
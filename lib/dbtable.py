@@ -13,8 +13,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from . import algobase
 from . import common
 from . import config
+from . import layout
+
+# Range of object_id per tract.
+# (See public.tract_from_object_id() in postgres-objcatalog)
+_objectIdsPerTract = 1 << 42
 
 class DBTable(object):
     """
@@ -51,6 +57,9 @@ class DBTable(object):
         self.algos   = algos
         self.filters = None
 
+        if config.dedupeAliases:
+            algobase.link_aliases(list(algos.values()))
+
     def set_filters(self, filters):
         """
         Set list of filters.
@@ -108,24 +117,22 @@ class DBTable(object):
         @param schemaName
             Name of the schema in which to locate the master table
         """
-        members = ['object_id Bigint']
-
-        for filter in self.filters:
-            #filt = common.filterToShortName[filter] + "_" if filter else ""
-            filt = filter + "_" if filter else ""
-            for algo in self.algos.values():
-                for name, type in algo.get_backend_fields(filt):
-                    members.append("{name}  {type}".format(**locals()))
+        members = ["{name}  {type}".format(**locals()) for name, type in self.get_backend_fields()]
 
         members = """,
         """.join(members)
 
         tableSpace = config.get_table_space()
+        partitioning = "PARTITION BY RANGE (object_id)" if config.partitionByTract else ""
+
+        # A partitioned table itself cannot be UNLOGGED; its partitions are.
+        persistence = config.get_persistence() if not config.partitionByTract else ""
 
         create_string = """
-        CREATE TABLE "{schemaName}"."{self.name}" (
+        CREATE {persistence} TABLE "{schemaName}"."{self.name}" (
             {members}
         )
+        {partitioning}
         {tableSpace}
         """.format(**locals())
 
@@ -134,29 +141,67 @@ class DBTable(object):
         else:
             print(create_string)
 
-    def create_index(self, cursor, schemaName):
+    def get_backend_fields(self, filters=None):
+        """
+        Get the columns of the table in the database.
+        @param filters (list of str)
+            Filters whose columns to get. (Default: self.filters)
+        @return list of (fieldname, sqltype).
+            The first one is ("object_id", "Bigint").
+        """
+        members = [("object_id", "Bigint")]
+
+        if filters is None:
+            filters = self.filters
+
+        for filter in filters:
+            #filt = common.filterToShortName[filter] + "_" if filter else ""
+            filt = filter + "_" if filter else ""
+            for algo in self.algos.values():
+                members += algo.get_backend_fields(filt)
+
+        return layout.apply_to_backend_fields(self.name, members)
+
+    def create_index(self, cursor, schemaName, tableName=None):
         """
         Create indexes on this table.
         @param cursor
             DB connection's cursor object
         @param schemaName
             Name of the schema in which to locate the master table
+        @param tableName
+            Name of the table (e.g. a partition of this table) on which to create the indexes.
+            (Default: self.name)
         """
+        if tableName is None:
+            tableName = self.name
+
         indexSpace = config.get_index_space()
 
         cursor.execute("""
-        CREATE UNIQUE INDEX
-            "{self.name}_pkey"
+        CREATE UNIQUE INDEX IF NOT EXISTS
+            "{tableName}_pkey"
         ON
-            "{schemaName}"."{self.name}" (object_id)
+            "{schemaName}"."{tableName}" (object_id)
         {indexSpace}
         """.format(**locals())
         )
+        # The primary key may have been added by a previous --create-index
+        # that failed on other indexes.
         cursor.execute("""
-        ALTER TABLE
-            "{schemaName}"."{self.name}"
-        ADD PRIMARY KEY USING INDEX
-          "{self.name}_pkey"
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = '"{schemaName}"."{tableName}"'::regclass AND contype = 'p'
+            ) THEN
+                ALTER TABLE
+                    "{schemaName}"."{tableName}"
+                ADD PRIMARY KEY USING INDEX
+                  "{tableName}_pkey";
+            END IF;
+        END
+        $$
         """.format(**locals())
         )
 
@@ -184,6 +229,263 @@ class DBTable(object):
         """.format(**locals())
         )
 
+    def get_load_table_name(self, tract):
+        """
+        Get the name of the table into which to insert data of a tract.
+        It is the name of this table unless config.partitionByTract is True,
+        in which case it is that of the tract's partition.
+        @param tract
+            Tract number.
+        """
+        if config.partitionByTract:
+            return self.get_partition_name(tract)
+        else:
+            return self.name
+
+    def get_partition_name(self, tract):
+        """
+        Get the name of the partition of this table that holds a tract.
+        @param tract
+            Tract number.
+        """
+        return "{}:tract{}".format(self.name, tract)
+
+    def create_partition_if_not_exists(self, cursor, schemaName, tract):
+        """
+        Create the partition that holds a tract unless it exists.
+        The partition is not attached to this table
+        until attach_partition() is called, so that data can be inserted
+        into it and indexes can be created on it without affecting this table.
+        @param cursor
+            DB connection's cursor object
+        @param schemaName
+            Name of the schema in which to locate the master table
+        @param tract
+            Tract number.
+        """
+        cursor.execute("""
+        SELECT relkind FROM pg_class WHERE oid = to_regclass(%(name)s)
+        """, dict(name = '"{}"."{}"'.format(schemaName, self.name))
+        )
+        relkind, = cursor.fetchone()
+        if relkind != "p":
+            raise RuntimeError('"{schemaName}"."{self.name}" is not partitioned by tract.'.format(**locals()))
+
+        partitionName = self.get_partition_name(tract)
+        minObjectId, maxObjectId = tract * _objectIdsPerTract, (tract + 1) * _objectIdsPerTract
+        tableSpace = config.get_table_space()
+        persistence = config.get_persistence()
+
+        # The CHECK constraint makes ATTACH PARTITION skip scanning the partition.
+        cursor.execute("""
+        CREATE {persistence} TABLE IF NOT EXISTS "{schemaName}"."{partitionName}" (
+            LIKE "{schemaName}"."{self.name}",
+            CONSTRAINT "{partitionName}_range_check"
+                CHECK (object_id >= {minObjectId} AND object_id < {maxObjectId})
+        )
+        {tableSpace}
+        """.format(**locals())
+        )
+
+    def get_detached_partitions(self, cursor, schemaName):
+        """
+        Get tracts whose partitions have been created but not attached yet.
+        @param cursor
+            DB connection's cursor object
+        @param schemaName
+            Name of the schema in which to locate the master table
+        @return
+            List of tract numbers, sorted.
+        """
+        prefix = self.get_partition_name("")
+        cursor.execute("""
+        SELECT
+            relname
+        FROM
+            pg_class JOIN pg_namespace ON pg_class.relnamespace = pg_namespace.oid
+        WHERE
+            nspname = %(schemaName)s
+            AND relkind = 'r'
+            AND left(relname, %(length)s) = %(prefix)s
+            AND NOT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = pg_class.oid)
+        """, dict(schemaName = schemaName, length = len(prefix), prefix = prefix)
+        )
+
+        return sorted(
+            int(relname[len(prefix):]) for relname, in cursor
+            if relname[len(prefix):].isdigit()
+        )
+
+    def attach_partition(self, cursor, schemaName, tract):
+        """
+        Create indexes on the partition that holds a tract,
+        and attach the partition to this table.
+        @param cursor
+            DB connection's cursor object
+        @param schemaName
+            Name of the schema in which to locate the master table
+        @param tract
+            Tract number.
+        """
+        partitionName = self.get_partition_name(tract)
+        self.create_index(cursor, schemaName, partitionName)
+
+        minObjectId, maxObjectId = tract * _objectIdsPerTract, (tract + 1) * _objectIdsPerTract
+
+        cursor.execute("""
+        ALTER TABLE
+            "{schemaName}"."{self.name}"
+        ATTACH PARTITION
+            "{schemaName}"."{partitionName}"
+        FOR VALUES FROM ({minObjectId}) TO ({maxObjectId})
+        """.format(**locals())
+        )
+
+    def add_band(self, cursor, schemaName, filter):
+        """
+        Add the columns of a filter to the table unless they exist.
+        The columns are NULL in existing rows.
+        @param cursor
+            DB connection's cursor object
+        @param schemaName
+            Name of the schema in which to locate the master table
+        @param filter
+            Filter name.
+        """
+        names = [self.name]
+        if config.partitionByTract:
+            # Attached partitions are altered together with this table.
+            names += [self.get_partition_name(tract) for tract in self.get_detached_partitions(cursor, schemaName)]
+
+        columns = """,
+            """.join(
+            "ADD COLUMN IF NOT EXISTS {name}  {type}".format(**locals())
+            for name, type in self.get_backend_fields([filter])[1:]
+        )
+
+        for tableName in names:
+            cursor.execute("""
+            ALTER TABLE "{schemaName}"."{tableName}"
+            {columns}
+            """.format(**locals())
+            )
+
+    def get_loaded_filters(self, cursor, schemaName, filters):
+        """
+        Get the filters whose columns exist in the table in the database.
+        @param cursor
+            DB connection's cursor object
+        @param schemaName
+            Name of the schema in which to locate the master table
+        @param filters
+            List of filter names to look for.
+        @return
+            List of filter names, in the order of "filters".
+        """
+        cursor.execute("""
+        SELECT
+            column_name
+        FROM
+            information_schema.columns
+        WHERE
+            table_schema = %(schemaName)s
+            AND table_name = %(tableName)s
+        """, dict(schemaName = schemaName, tableName = self.name)
+        )
+        columns = set(name for name, in cursor)
+
+        ret = []
+        for filter in filters:
+            names = [name.lower() for name, type in self.get_backend_fields([filter])[1:]]
+            if names and all(name in columns for name in names):
+                ret.append(filter)
+
+        return ret
+
+    def create_band_stage(self, cursor, filter):
+        """
+        Create a temporary table into which to COPY the columns of a filter
+        before they are merged into this table by merge_band_stage().
+        The rows in it are deleted on commit.
+        @param cursor
+            DB connection's cursor object
+        @param filter
+            Filter name.
+        @return (str)
+            Quoted name of the temporary table.
+        """
+        stageName = '"stage:{}"'.format(self.name)
+        members = """,
+            """.join("{name}  {type}".format(**locals()) for name, type in self.get_backend_fields([filter]))
+
+        cursor.execute("""
+        CREATE TEMPORARY TABLE IF NOT EXISTS {stageName} (
+            {members}
+        )
+        ON COMMIT DELETE ROWS
+        """.format(**locals())
+        )
+        return stageName
+
+    def merge_band_stage(self, cursor, schemaName, tract, filter):
+        """
+        Set the columns of a filter in this table to the values
+        in the temporary table created by create_band_stage(),
+        with a single UPDATE.
+        @param cursor
+            DB connection's cursor object
+        @param schemaName
+            Name of the schema in which to locate the master table
+        @param tract
+            Tract number of the rows in the temporary table.
+        @param filter
+            Filter name.
+        @return (int)
+            Number of rows updated.
+        """
+        stageName = '"stage:{}"'.format(self.name)
+        tableName = self.get_load_table_name(tract)
+        assignments = """,
+            """.join(
+            "{name} = stage.{name}".format(**locals())
+            for name, type in self.get_backend_fields([filter])[1:]
+        )
+
+        cursor.execute("""
+        UPDATE "{schemaName}"."{tableName}" AS target SET
+            {assignments}
+        FROM {stageName} AS stage
+        WHERE target.object_id = stage.object_id
+        """.format(**locals())
+        )
+        return cursor.rowcount
+
+    def set_logged(self, cursor, schemaName):
+        """
+        Set this table and its partitions LOGGED if they are UNLOGGED
+        (See set_logged()).
+        @param cursor
+            DB connection's cursor object. The connection must be in autocommit mode.
+        @param schemaName
+            Name of the schema in which to locate the master table
+        """
+        prefix = self.get_partition_name("")
+        cursor.execute("""
+        SELECT
+            relname
+        FROM
+            pg_class JOIN pg_namespace ON pg_class.relnamespace = pg_namespace.oid
+        WHERE
+            nspname = %(schemaName)s
+            AND relkind = 'r'
+            AND relpersistence = 'u'
+            AND (relname = %(name)s OR left(relname, %(length)s) = %(prefix)s)
+        """, dict(schemaName = schemaName, name = self.name, length = len(prefix), prefix = prefix)
+        )
+
+        for relname in sorted(relname for relname, in cursor.fetchall()):
+            set_logged(cursor, schemaName, relname)
+
     def get_backend_field_data(self, filter):
         """
         Get field data for the backend table.
@@ -200,7 +502,7 @@ class DBTable(object):
         for algo in self.algos.values():
             members += algo.get_backend_field_data(filt)
 
-        return members
+        return layout.apply_to_backend_field_data(self.name, members)
 
 
     def get_exported_fields(self, filter):
@@ -218,7 +520,7 @@ class DBTable(object):
         for algo in self.algos.values():
             members += algo.get_frontend_fields(filt)
 
-        return members
+        return layout.apply_to_exported_fields(self.name, members)
 
 
 class DBTable_BandIndependent(DBTable):
@@ -229,10 +531,36 @@ class DBTable_BandIndependent(DBTable):
     """
     __slots__ = []
 
-    def create(self, cursor, schemaName):
-        filters = self.filters
-        self.filters = [""]
-        try:
-            return DBTable.create(self, cursor, schemaName)
-        finally:
-            self.filters = filters
+    def get_backend_fields(self, filters=None):
+        return DBTable.get_backend_fields(self, [""])
+
+
+def set_logged(cursor, schemaName, tableName):
+    """
+    Set a table LOGGED if it is UNLOGGED, and then freeze it.
+    SET LOGGED rewrites the table with new tuples, so the table is frozen
+    after it, lest the rows should be rewritten later for hint bits
+    or anti-wraparound vacuum.
+    @param cursor
+        DB connection's cursor object. The connection must be in autocommit mode.
+    @param schemaName
+        Name of the schema in which the table is.
+    @param tableName
+        Name of the table.
+    """
+    cursor.execute("""
+    SELECT relpersistence FROM pg_class WHERE oid = to_regclass(%(name)s)
+    """, dict(name = '"{}"."{}"'.format(schemaName, tableName))
+    )
+    row = cursor.fetchone()
+    if row is None or row[0] != "u":
+        return
+
+    cursor.execute("""
+    ALTER TABLE "{schemaName}"."{tableName}" SET LOGGED
+    """.format(**locals())
+    )
+    cursor.execute("""
+    VACUUM (FREEZE, ANALYZE) "{schemaName}"."{tableName}"
+    """.format(**locals())
+    )
@@ -1,5 +1,6 @@
 # Copyright notice??
-from yaml import load as yload
+from yaml import load as yload, SafeLoader
+import numpy
 import re
 
 class DpddYaml(object):
@@ -14,7 +15,7 @@ class DpddYaml(object):
         self.inf = infile        # string or  file pointer to yaml text file
 
     def parse(self):
-        y = yload(self.inf)
+        y = yload(self.inf, Loader=SafeLoader)
         if type(y) != type([]):
             raise TypeError("Input is not a list")
         dpdd_dict = {}
@@ -166,7 +167,7 @@ class DpddView(object):
             return asvl
         else: return [asv]        
         
-    def view_string(self):
+    def _get_table_spec(self):
         dbschema = self.dbschema
         if len(self.tables) == 1:
             table_spec = '"{}"."{}"'.format(dbschema, self.tables[0])
@@ -177,7 +178,12 @@ class DpddView(object):
                   
             table_spec = """
             """.join(join_list)
-        
+        return table_spec
+
+    def get_definitions(self):
+        """
+        Get the items of the yaml file, with the overrides applied.
+        """
         dpdd_yaml = DpddYaml(open(self.yaml_path)).parse()
         if self.yaml_override:
             override_yaml = DpddYaml(open(self.yaml_override)).parse()
@@ -198,16 +204,22 @@ class DpddView(object):
                 if not found:
                     new_elt = dict(i)
                     dpdd_yaml.append(new_elt)
+        return dpdd_yaml
 
-
+    def _get_fields(self):
         fields = []
-        for i in dpdd_yaml:
+        for i in self.get_definitions():
             r = self.resolve(i)
             if r: fields += r
             #r = DpddYaml.resolve(i)
             #if r: fields.append(r)
+        return fields
+
+    def view_string(self):
+        dbschema = self.dbschema
+        table_spec = self._get_table_spec()
         sFields = """,
-        """.join(fields)
+        """.join(self._get_fields())
 
         cv = """CREATE VIEW {dbschema}.dpdd AS ( 
              SELECT
@@ -219,6 +231,321 @@ class DpddView(object):
         """.format(**locals())
         return cv
 
+
+# Map from Datatype in the yaml file (lower case) -> SQL type
+_datatypes = {
+    'int'   : 'Integer',
+    'long'  : 'Bigint',
+    'float' : 'Real',
+    'double': 'Double precision',
+    'flag'  : 'Boolean',
+    'earth' : 'Earth',
+}
+
+# Map from SQL type (lower case) -> (numpy dtype, printf format)
+_sqltypes = {
+    'boolean'         : (numpy.bool_,   '%d'),
+    'smallint'        : (numpy.int16,   '%ld'),
+    'integer'         : (numpy.int32,   '%ld'),
+    'bigint'          : (numpy.int64,   '%ld'),
+    'real'            : (numpy.float32, '%.8e'),
+    'double precision': (numpy.float64, '%.16e'),
+    'earth'           : (numpy.float64, '(%.16e,%.16e,%.16e)'),
+}
+
+def _coord_to_ra(xyz):
+    return numpy.degrees(numpy.arctan2(xyz[..., 1], xyz[..., 0])) % 360.0
+
+def _coord_to_dec(xyz):
+    return numpy.degrees(numpy.arctan2(xyz[..., 2], numpy.hypot(xyz[..., 0], xyz[..., 1])))
+
+def _export_mag(flux):
+    return (numpy.float32(27.0) - numpy.float32(2.5) * numpy.log10(flux)).astype(numpy.float32)
+
+def _export_magerr(flux, fluxerr):
+    return numpy.where(flux > 0, numpy.float32(1.0857362047581294) * (fluxerr / flux), numpy.nan).astype(numpy.float32)
+
+# Operators and functions in RPN, evaluated in numpy as PostgreSQL would do
+# the expressions made by DpddView.rpn_value()
+_rpnBinaryOperators = {
+    '*'  : numpy.multiply,
+    '+'  : numpy.add,
+    '-'  : numpy.subtract,
+    '/'  : numpy.divide,
+    '^'  : numpy.power,
+    '|'  : numpy.bitwise_or,
+    '%'  : numpy.fmod,
+    '&'  : numpy.bitwise_and,
+    'or' : numpy.logical_or,
+    'and': numpy.logical_and,
+}
+
+_rpnFunctions = {
+    'log'                  : numpy.log10,
+    'ln'                   : numpy.log,
+    'exp'                  : numpy.exp,
+    'sqrt'                 : numpy.sqrt,
+    'abs'                  : numpy.abs,
+    'public.coord_to_ra'   : _coord_to_ra,
+    'public.coord_to_dec'  : _coord_to_dec,
+    '_forced:export_mag'   : _export_mag,
+    '_forced:export_magerr': _export_magerr,
+}
+
+_varpat = re.compile(r'x(\d+)$')
+_funcpat = re.compile(r'([a-zA-Z_]+[:a-zA-Z0-9_.]*)\(\)$')
+_func2pat = re.compile(r'([a-zA-Z_]+[:a-zA-Z0-9_.]*)\(,\)$')
+
+
+class DpddTable(DpddView):
+    """
+    DPDD quantities materialized in a table of primary objects,
+    instead of the view made by DpddView.
+
+    Rows are computed from native quantities in numpy when patches are loaded
+    (get_field_data()), by evaluating the same definitions as the view's.
+    The rows of a tract can also be computed again in the DB
+    from the tables of native quantities (refresh_strings()).
+
+    Arguments are the same as DpddView's.
+    """
+    tableName = 'dpdd'
+
+    def expand(self, item_dict):
+        """
+        Expand an item of the yaml file into DPDD fields.
+        @return list of (DPDDname, Datatype, NativeInputs, RPN, band).
+            {FLUX}, {ERR}, {PIXEL_SCALE} and {BAND} in them are substituted,
+            and "band" is None unless the item has {BAND}.
+            Datatype is None if the item does not have it.
+        """
+        name = item_dict['DPDDname']
+        datatype = item_dict.get('Datatype')
+        inputs = item_dict['NativeInputs']
+        rpn = item_dict.get('RPN')
+
+        def subst(elt, band):
+            elt = str(elt)
+            if '{' not in elt:
+                return elt
+            return elt.format(FLUX=self.FLUX, ERR=self.ERR, PIXEL_SCALE=self.pixel_scale,
+                              BAND=band if band is not None else '{BAND}')
+
+        texts = [name] + [str(i) for i in inputs]
+        bands = self.bands if any('{BAND}' in t for t in texts) else [None]
+
+        return [
+            (subst(name, band), datatype, [subst(i, band) for i in inputs],
+             [subst(elt, band) for elt in rpn] if rpn else None, band)
+            for band in bands
+        ]
+
+    def _get_expanded(self):
+        fields = []
+        for i in self.get_definitions():
+            fields += self.expand(i)
+        return fields
+
+    @staticmethod
+    def _get_native_types(tables):
+        """
+        Get the SQL types of native quantities.
+        @param tables
+            List of (table: DBTable, filter: str).
+            filter is "" for band-independent tables.
+        @return dict mapping native name (lower case) -> sqltype.
+            Multiband quantities are also mapped from "{band}_name",
+            so that the types are known for bands absent from "tables".
+        """
+        types = {'object_id': 'Bigint'}
+        for table, filter in tables:
+            for name, sqltype in table.get_backend_fields([filter]):
+                types[name.lower()] = sqltype
+                if filter:
+                    types['{band}' + name[len(filter):].lower()] = sqltype
+        return types
+
+    @staticmethod
+    def _get_sqltype(datatype, inputs, rpn, band, nativeTypes):
+        """
+        Get the SQL type of a DPDD field: that of Datatype if it is given,
+        or else that of the native quantity if the field is a copy of it
+        (as the view would show it), or else Real.
+        """
+        if datatype is not None:
+            return _datatypes[datatype.lower()]
+        if not rpn:
+            key = inputs[0].split('.')[-1].lower()
+            if key not in nativeTypes and band is not None and key.startswith(band.lower() + '_'):
+                key = '{band}' + key[len(band):]
+            return nativeTypes.get(key, 'Real')
+        return 'Real'
+
+    def get_columns(self, tables):
+        """
+        Get the columns of the table.
+        @param tables
+            List of (table: DBTable, filter: str), from which the types of
+            native quantities are taken (See get_field_data()).
+        @return list of (name, sqltype), in the same order as the view's fields.
+        """
+        nativeTypes = self._get_native_types(tables)
+        return [(name.lower(), self._get_sqltype(datatype, inputs, rpn, band, nativeTypes))
+                for name, datatype, inputs, rpn, band in self._get_expanded()]
+
+    def create_string(self, tables, tableSpace=''):
+        dbschema = self.dbschema
+        members = """,
+             """.join('{} {}'.format(name, sqltype) for name, sqltype in self.get_columns(tables))
+        return """CREATE TABLE {dbschema}.{self.tableName} (
+             {members}
+           )
+           {tableSpace}
+        """.format(**locals())
+
+    def index_strings(self, indexSpace=''):
+        dbschema = self.dbschema
+        columns = [name.lower() for name, datatype, inputs, rpn, band in self._get_expanded()]
+        strings = []
+        if 'objectid' in columns:
+            strings.append("""CREATE UNIQUE INDEX IF NOT EXISTS "{self.tableName}_objectid_idx"
+             ON {dbschema}.{self.tableName} (objectId) {indexSpace}
+            """.format(**locals()))
+        if 'coord' in columns:
+            strings.append("""CREATE INDEX IF NOT EXISTS "{self.tableName}_coord_idx"
+             ON {dbschema}.{self.tableName} USING GiST (coord) {indexSpace}
+             WHERE coord IS NOT NULL
+            """.format(**locals()))
+        return strings
+
+    def drop_index_strings(self):
+        return [
+            'DROP INDEX IF EXISTS {}."{}_{}_idx"'.format(self.dbschema, self.tableName, column)
+            for column in ['objectid', 'coord']
+        ]
+
+    def refresh_strings(self, tract):
+        """
+        Get the statements that compute again the rows of a tract
+        from the tables of native quantities.
+        """
+        dbschema = self.dbschema
+        table_spec = self._get_table_spec()
+        sColumns = ", ".join(name.lower() for name, datatype, inputs, rpn, band in self._get_expanded())
+        sFields = """,
+        """.join(self._get_fields())
+        tract = int(tract)
+
+        return [
+            """DELETE FROM {dbschema}.{self.tableName}
+             WHERE tractSearch(objectId, {tract})
+            """.format(**locals()),
+            """INSERT INTO {dbschema}.{self.tableName} ({sColumns})
+             SELECT
+                   {sFields}
+             FROM
+                   {table_spec}
+             WHERE {dbschema}.position.detect_isprimary
+               AND tractSearch({dbschema}.position.object_id, {tract})
+            """.format(**locals()),
+        ]
+
+    @staticmethod
+    def rpn_evaluate(inputs, rpn):
+        """
+        Evaluate an RPN list in numpy.
+        The order of operands is the same as in DpddView.rpn_value().
+        @param inputs
+            List of numpy.array, which are referred to by x1, x2, ...
+        @param rpn
+            RPN list with {FLUX} etc. substituted.
+        @return numpy.array
+        """
+        argstack = []
+        for elt in rpn:
+            elt = str(elt)
+            try:
+                argstack.append(float(elt))
+                continue
+            except ValueError:
+                pass
+            m = _varpat.match(elt)
+            if m:
+                i = int(m.group(1))
+                if i > len(inputs):
+                    raise ValueError('RPN elt {} references non-existent input'.format(elt))
+                argstack.append(inputs[i - 1])
+                continue
+            if elt in _rpnBinaryOperators:
+                argstack.append(_rpnBinaryOperators[elt](argstack.pop(), argstack.pop()))
+                continue
+            if elt in ['!', 'not']:
+                argstack.append(numpy.logical_not(argstack.pop()))
+                continue
+            m = _funcpat.match(elt) or _func2pat.match(elt)
+            if m:
+                f = _rpnFunctions.get(m.group(1))
+                if f is None:
+                    raise ValueError('Function {} cannot be evaluated at load time. Use the view instead.'.format(m.group(1)))
+                if m.re is _funcpat:
+                    argstack.append(f(argstack.pop()))
+                else:
+                    argstack.append(f(argstack.pop(), argstack.pop()))
+                continue
+            raise ValueError('Unknown element {} in RPN list'.format(elt))
+        if len(argstack) != 1:
+            raise ValueError('Bad RPN list')
+        return argstack.pop()
+
+    def get_field_data(self, tables, object_id):
+        """
+        Compute the rows of primary objects in a patch.
+        @param tables
+            List of (table: DBTable, filter: str) that have been transformed.
+            filter is "" for band-independent tables.
+        @param object_id
+            numpy.array of object ID.
+        @return list of (fieldname, printf_format, [column]).
+            Fields of bands absent from "tables" are not included,
+            so they will be NULL as in the view.
+        """
+        natives = {'object_id': object_id}
+        for table, filter in tables:
+            for name, fmt, cols in table.get_backend_field_data(filter):
+                cols = [numpy.asarray(col) for col in cols]
+                natives[name.lower()] = cols[0] if len(cols) == 1 else numpy.stack(cols, axis=-1)
+
+        nativeTypes = self._get_native_types(tables)
+        bands = set(filter for table, filter in tables if filter)
+        primary = numpy.asarray(natives['detect_isprimary'], dtype=bool)
+
+        members = []
+        for name, datatype, inputs, rpn, band in self._get_expanded():
+            if band is not None and band not in bands:
+                continue
+            args = []
+            for i in inputs:
+                key = i.split('.')[-1].lower()
+                if key not in natives:
+                    raise RuntimeError('Native input of DPDD field {} not found: {}'.format(name, i))
+                args.append(natives[key])
+
+            with numpy.errstate(all='ignore'):
+                value = self.rpn_evaluate(args, rpn) if rpn else args[0]
+            value = numpy.broadcast_to(value, primary.shape + numpy.shape(value)[1:])[primary]
+
+            sqltype = self._get_sqltype(datatype, inputs, rpn, band, nativeTypes)
+            dtype, fmt = _sqltypes[sqltype.lower()]
+            value = value.astype(dtype)
+            if sqltype.lower() == 'earth':
+                cols = [value[..., i] for i in range(value.shape[-1])]
+            else:
+                cols = [value]
+            members.append((name.lower(), fmt, cols))
+
+        return members
+
+
 import sys
 if __name__ =='__main__':
     if len(sys.argv) > 1: 
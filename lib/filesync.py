@@ -0,0 +1,315 @@
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Registry of the catalog files loaded into the DB, with which
+patches whose files have changed are found and reloaded (--sync).
+
+Each loader has, in addition to its registry of inserted patches
+"_temp:{loader}_patch", the registry of files "_temp:{loader}_file"
+that records the size, mtime and content hash of every file loaded.
+Both registries use the same file_id: (tract*10000 + patch)*100 + filter,
+where filter is 0 for "ref" and lib.common.filterOrder[f]+1 for the others.
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import os
+
+from . import common
+from . import config
+from . import misc
+
+
+def get_file_ids(tract, patch, catPaths, refPath=None):
+    """
+    Get the file_ids of the files of a patch.
+    @param tract
+        Tract number
+    @param patch
+        Patch number (x*100 + y)
+    @param catPaths
+        {filter: path} of multiband catalogs that exist.
+    @param refPath
+        Path to the "ref" catalog, if any.
+    @return
+        {file_id: path}
+    """
+    patchId = tract*10000 + patch
+    files = dict(
+        (patchId*100 + common.filterOrder[filter]+1, path)
+        for filter, path in catPaths.items()
+    )
+    if refPath is not None:
+        files[patchId*100] = refPath
+    return files
+
+
+def get_object_id_key(tract, patch):
+    """
+    Get "object_id >> 32", which is common to all objects in a patch.
+    (object_id = (tract << 42) | (patch_x << 37) | (patch_y << 32) | counter)
+    """
+    return (tract << 10) | ((patch // 100) << 5) | (patch % 100)
+
+
+def get_range_condition(column, ranges):
+    """
+    Get an SQL condition that "column" is in any of the ranges.
+    Adjacent ranges are merged.
+    @param column (str)
+        Name of an integer column.
+    @param ranges
+        List of (begin, end) of integers. "end" is not included.
+    @return (str)
+    """
+    merged = []
+    for begin, end in sorted(ranges):
+        if merged and begin <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([begin, end])
+
+    return "(" + " OR ".join(
+        "({0} >= {1} AND {0} < {2})".format(column, begin, end) for begin, end in merged
+    ) + ")"
+
+
+def get_file_stat(path):
+    """
+    Get (size, mtime) of a file.
+    @param path
+        Path to the file.
+        The file may be compressed, but the path is virtualized so it always ends with '.fits'.
+    @return (size, mtime)
+        mtime is in nanoseconds.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        stat = os.stat(path + ".gz")
+    return stat.st_size, stat.st_mtime_ns
+
+
+def get_content_hash(path):
+    """
+    Get the hash of the contents of a file (BLAKE2b, 128 bits, in hex).
+    @param path
+        Path to the file.
+        The file may be compressed, but the path is virtualized so it always ends with '.fits'.
+        The hash is that of the compressed file.
+    """
+    if not os.path.exists(path):
+        path += ".gz"
+
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def create_file_registry_if_not_exists(cursor, schemaName, loaderName):
+    """
+    Create the registry of loaded files.
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param loaderName
+        "forced", "meas", etc. The registry is "_temp:{loaderName}_file".
+    """
+    # In bulk mode, the registry must be lost together with the data
+    # if the DB server crashes.
+    persistence = config.get_persistence()
+
+    cursor.execute("""
+    CREATE {persistence} TABLE IF NOT EXISTS "{schemaName}"."_temp:{loaderName}_file" (
+        file_id   Bigint   PRIMARY KEY,
+        path      Text     NOT NULL,
+        size      Bigint   NOT NULL,
+        mtime     Bigint   NOT NULL,
+        hash      Text
+    )
+    """.format(**locals())
+    )
+
+
+def get_file_records(files):
+    """
+    Get the records of files to be registered by register_files().
+    The files are read to be hashed only if config.hashFiles is True;
+    otherwise the hash is None.
+    @param files
+        {file_id: path}
+    @return
+        List of (file_id, path, size, mtime, hash)
+    """
+    records = []
+    for fileId, path in sorted(files.items()):
+        size, mtime = get_file_stat(path)
+        hash = get_content_hash(path) if config.hashFiles else None
+        records.append((fileId, path, size, mtime, hash))
+    return records
+
+
+def register_files(cursor, schemaName, loaderName, records):
+    """
+    Record files loaded (or about to be loaded in the same transaction).
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param loaderName
+        "forced", "meas", etc.
+    @param records
+        Return value of get_file_records().
+    """
+    cursor.executemany("""
+    INSERT INTO "{schemaName}"."_temp:{loaderName}_file" (file_id, path, size, mtime, hash)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (file_id) DO UPDATE SET
+        path = EXCLUDED.path, size = EXCLUDED.size, mtime = EXCLUDED.mtime, hash = EXCLUDED.hash
+    """.format(**locals()), records
+    )
+
+
+def sync_patches(db, schemaName, loaderName, patchFiles, getTableNames, jobs=1):
+    """
+    Find patches whose files have been changed since they were loaded,
+    and delete them from the tables and from the registries
+    so that they will be loaded again as new patches.
+    Patches whose files have only been touched (the same contents with different mtimes)
+    are kept, and the new mtimes are recorded, if the files were hashed when loaded
+    (config.hashFiles).
+    @param db
+        DB connection. It is committed.
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param loaderName
+        "forced", "meas", etc.
+    @param patchFiles
+        {(tract, patch): {file_id: path}} of the files that exist now.
+    @param getTableNames
+        Function: tract -> list of names of the tables into which the tract is loaded.
+    @param jobs
+        Number of threads with which to hash files.
+    @return
+        List of (tract, patch) deleted.
+    """
+    with db.cursor() as cursor:
+        create_file_registry_if_not_exists(cursor, schemaName, loaderName)
+
+        cursor.execute("""
+        SELECT file_id FROM "{schemaName}"."_temp:{loaderName}_patch"
+        """.format(**locals())
+        )
+        loadedIds = {}
+        for id, in cursor:
+            loadedIds.setdefault(id // 100, set()).add(id)
+
+        cursor.execute("""
+        SELECT file_id, size, mtime, hash FROM "{schemaName}"."_temp:{loaderName}_file"
+        """.format(**locals())
+        )
+        records = dict((id, (size, mtime, hash)) for id, size, mtime, hash in cursor)
+
+    changed = set()
+    unregistered = {}
+    suspects = {}
+    for (tract, patch), files in patchFiles.items():
+        ids = loadedIds.get(tract*10000 + patch)
+        if not ids:
+            # A new patch
+            continue
+        if ids != set(files):
+            changed.add((tract, patch))
+            continue
+        if not any(id in records for id in ids):
+            # Loaded before the registry of files existed.
+            unregistered.update(files)
+            continue
+
+        for id, path in files.items():
+            if id not in records:
+                changed.add((tract, patch))
+            elif records[id][:2] != get_file_stat(path):
+                if records[id][2] is None:
+                    # Loaded without the hash: the contents cannot be compared.
+                    changed.add((tract, patch))
+                else:
+                    suspects[id] = ((tract, patch), path)
+
+    with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) as executor:
+        hashes = dict(zip(suspects, executor.map(get_content_hash, (path for key, path in suspects.values()))))
+
+    touched = {}
+    for id, ((tract, patch), path) in suspects.items():
+        if hashes[id] == records[id][2]:
+            touched[id] = path
+        else:
+            changed.add((tract, patch))
+
+    changed = sorted(changed)
+
+    with db.cursor() as cursor:
+        if unregistered:
+            misc.warning("Files loaded before the registry of files existed are assumed unchanged:", len(unregistered))
+            register_files(cursor, schemaName, loaderName, get_file_records(unregistered))
+
+        for id, path in touched.items():
+            size, mtime = get_file_stat(path)
+            cursor.execute("""
+            UPDATE "{schemaName}"."_temp:{loaderName}_file" SET size = %(size)s, mtime = %(mtime)s
+            WHERE file_id = %(id)s
+            """.format(**locals()), dict(size=size, mtime=mtime, id=id)
+            )
+
+        # One DELETE per table for all the changed patches in it.
+        # The patches are given as ranges of object_id
+        # so that the index on object_id and partition pruning are used.
+        tableKeys = collections.OrderedDict()
+        for tract, patch in changed:
+            for tableName in getTableNames(tract):
+                tableKeys.setdefault(tableName, []).append(get_object_id_key(tract, patch))
+
+        for tableName, keys in tableKeys.items():
+            condition = get_range_condition("object_id", [(key << 32, (key + 1) << 32) for key in keys])
+            cursor.execute("""
+            DELETE FROM "{schemaName}"."{tableName}" WHERE {condition}
+            """.format(**locals())
+            )
+
+        if changed:
+            condition = get_range_condition("file_id",
+                [((tract*10000 + patch)*100, (tract*10000 + patch + 1)*100) for tract, patch in changed])
+            for registry in ["patch", "file"]:
+                cursor.execute("""
+                DELETE FROM "{schemaName}"."_temp:{loaderName}_{registry}" WHERE {condition}
+                """.format(**locals())
+                )
+
+    db.commit()
+
+    for tract, patch in changed:
+        print("Changed: (tract,patch) = ({tract}, {patch})".format(**locals()))
+    if touched:
+        print("Touched but unchanged: {} files".format(len(touched)))
+
+    return changed
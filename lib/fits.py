@@ -20,8 +20,13 @@ except ImportError:
 
 import numpy
 
+from .misc import stage_time
+
+import functools
 import gzip
+import hashlib
 import io
+import mmap
 import os
 import re
 
@@ -38,7 +43,7 @@ def fits_open(path, headerOnly = False):
     @return
         pyfits HDUList object.
     """
-    header = b""
+    header = []
     dtype = numpy.dtype([("key", bytes, 8), ("value", bytes, 72)])
 
     if os.path.exists(path):
@@ -53,7 +58,7 @@ def fits_open(path, headerOnly = False):
         chunk = fin.read(2880)
         arr = numpy.frombuffer(chunk, dtype=dtype)
 
-        header += chunk
+        header.append(chunk)
         if numpy.any(arr["key"] == b'END     '): break
 
     if headerOnly:
@@ -62,7 +67,7 @@ def fits_open(path, headerOnly = False):
             arr = numpy.copy(numpy.frombuffer(chunk, dtype=dtype))
             arr["value"][arr["key"] == b'NAXIS2  '] = b'=                    0 / length of data axis 2                          '
 
-            header += memoryview(arr).tobytes()
+            header.append(memoryview(arr).tobytes())
             if numpy.any(arr["key"] == b'END     '): break
     else:
         bitpix = None
@@ -71,7 +76,7 @@ def fits_open(path, headerOnly = False):
         while True:
             chunk = fin.read(2880)
             arr = numpy.frombuffer(chunk, dtype=dtype)
-            header += chunk
+            header.append(chunk)
 
             arrBitpix = arr["value"][arr["key"] == b'BITPIX  ']
             arrNaxis1 = arr["value"][arr["key"] == b'NAXIS1  ']
@@ -85,7 +90,529 @@ def fits_open(path, headerOnly = False):
 
             if numpy.any(arr["key"] == b'END     '): break
 
-        header += fin.read(((abs(bitpix)*width*height + (8*2880-1))//(8*2880))*2880)
+        header.append(fin.read(((abs(bitpix)*width*height + (8*2880-1))//(8*2880))*2880))
 
     fin.close()
-    return pyfits.open(io.BytesIO(header), uint=True)
+    return pyfits.open(io.BytesIO(b"".join(header)), uint=True)
+
+
+@stage_time("fits_open")
+def fits_open_table(path, headerOnly=False):
+    """
+    Open the binary table in the 2nd HDU of a FITS file.
+    The primary HDU must be empty. The 3rd HDU and the latter are ignored.
+
+    If the file is not compressed, it is memory-mapped and
+    the columns are numpy views of the mapped file: they are not
+    read until they are actually used. Otherwise, this function
+    falls back to fits_open().
+    @param path
+        Path to a FITS file to read.
+        The file may be compressed, but "path" must ends with ".fits".
+        The prefix ".gz" will be added automatically by this function.
+    @param headerOnly
+        Read header only. The table is opened as if it had no rows:
+        NAXIS2 is 0, and the columns are empty arrays of the right types.
+    @return
+        HDU-like object that has "header" and "data" members.
+    """
+    if not os.path.exists(path):
+        return fits_open(path, headerOnly=headerOnly)[1]
+
+    with open(path, "rb") as fin:
+        # Pages written to are private to this process (ACCESS_COPY)
+        # because users may modify columns in place.
+        mapped = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    offset = _skip_header(mapped, 0)
+    header, offset = _read_header(mapped, offset)
+
+    if headerOnly:
+        header = Header(
+            [(key, 0 if key == "NAXIS2" else value) for key, value in header.cards],
+            fingerprint=header.fingerprint
+        )
+
+    try:
+        data = TableData(mapped, offset, header)
+    except _UnsupportedFormat:
+        return fits_open(path)[1]
+
+    return TableHDU(header, data)
+
+
+def fits_get_nrows(path):
+    """
+    Get the number of rows (NAXIS2) of the binary table in the 2nd HDU
+    of a FITS file. Only the headers are read.
+    The primary HDU must be empty.
+    @param path
+        Path to a FITS file to read.
+        The file may be compressed, but "path" must ends with ".fits".
+        The prefix ".gz" will be added automatically by this function.
+    @return (int)
+    """
+    if os.path.exists(path):
+        fin = open(path, "rb")
+    elif os.path.exists(path + ".gz"):
+        fin = gzip.open(path + ".gz", "rb")
+    else:
+        raise RuntimeError("File inaccessible: " + path)
+
+    with fin:
+        for hdu in range(2):
+            while True:
+                block = fin.read(2880)
+                if len(block) < 2880:
+                    raise RuntimeError("Unexpected end of FITS file: " + path)
+
+                if hdu == 1:
+                    pos = _find_card(block, b"NAXIS2  ")
+                    if pos >= 0:
+                        return int(_parse_value(block[pos+10:pos+80].decode("ascii")))
+
+                if _find_card(block, b"END     ") >= 0:
+                    break
+
+    raise RuntimeError("NAXIS2 not found: " + path)
+
+
+def fits_write(path, hdus, compress=False):
+    """
+    Write a FITS file whose primary HDU is empty.
+    @param path
+        Path to a FITS file to write. If compress is True,
+        ".gz" is added to it.
+    @param hdus
+        List of (cards, data) of the extension HDUs.
+        "cards" is a list of (key, value) including XTENSION, BITPIX, etc.
+        Keys may be duplicate. "data" is bytes (or a numpy.array,
+        which must be big-endian) of the HDU's data.
+    @param compress
+        Whether to compress the file with gzip.
+    """
+    primary = [("SIMPLE", True), ("BITPIX", 8), ("NAXIS", 0), ("EXTEND", True)]
+
+    chunks = [_format_header(primary)]
+    for cards, data in hdus:
+        data = bytes(memoryview(data).cast("B")) if not isinstance(data, bytes) else data
+        chunks.append(_format_header(cards))
+        chunks.append(data + b"\0" * (-len(data) % 2880))
+
+    if compress:
+        fout = gzip.open(path + ".gz", "wb")
+    else:
+        fout = open(path, "wb")
+
+    with fout:
+        for chunk in chunks:
+            fout.write(chunk)
+
+
+def _format_header(cards):
+    """
+    Format a header.
+    @param cards
+        List of (key, value).
+    @return
+        bytes of the header, padded to a multiple of 2880 bytes.
+    """
+    lines = [_format_card(key, value) for key, value in cards]
+    lines.append("END".ljust(80))
+    text = "".join(lines)
+    text += " " * (-len(text) % 2880)
+    return text.encode("ascii")
+
+
+def _format_card(key, value):
+    """
+    Format a header card. String values longer than a card
+    are continued to "CONTINUE" cards. Keys longer than 8 characters
+    are written with the "HIERARCH" convention.
+    """
+    if len(key) > 8:
+        return "HIERARCH {} = {}".format(key, value).ljust(80)
+
+    if isinstance(value, bool):
+        return "{:8}= {:>20}".format(key, "T" if value else "F").ljust(80)
+    if isinstance(value, (int, numpy.integer)):
+        return "{:8}= {:>20}".format(key, int(value)).ljust(80)
+    if isinstance(value, (float, numpy.floating)):
+        return "{:8}= {:>20}".format(key, repr(float(value)).upper()).ljust(80)
+
+    # Each piece, quotes doubled and "&" appended, must fit in 67 columns.
+    pieces = [""]
+    for c in str(value):
+        c = c.replace("'", "''")
+        if len(pieces[-1]) + len(c) > 66:
+            pieces.append("")
+        pieces[-1] += c
+    lines = []
+    for i, piece in enumerate(pieces):
+        if i < len(pieces) - 1:
+            piece += "&"
+        text = "'{:8}'".format(piece)
+        if i == 0:
+            lines.append("{:8}= {}".format(key, text).ljust(80))
+        else:
+            lines.append("CONTINUE  {}".format(text).ljust(80))
+    return "".join(lines)
+
+
+class TableHDU(object):
+    """
+    HDU of a binary table returned by fits_open_table().
+    """
+    __slots__ = ["header", "data"]
+
+    def __init__(self, header, data):
+        self.header = header
+        self.data   = data
+
+
+class Header(object):
+    """
+    FITS header parsed by fits_open_table().
+    This class mimics a small part of pyfits.Header.
+    """
+    __slots__ = ["cards", "values", "fingerprint"]
+
+    def __init__(self, cards, values=None, fingerprint=None):
+        """
+        @param cards
+            List of (key, value). Keys may be duplicate.
+        @param values
+            Map from key -> value of the first card of the key.
+            If None, it is made from "cards".
+        @param fingerprint (str)
+            Fingerprint of the layout of the table (See get_schema_fingerprint()).
+        """
+        self.cards  = cards
+        self.fingerprint = fingerprint
+        if values is None:
+            values = {}
+            for key, value in cards:
+                values.setdefault(key, value)
+        self.values = values
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def items(self):
+        return iter(self.cards)
+
+
+# Keys of the header cards that define the layout of a binary table
+_schemaKeyPattern = re.compile(
+    r'^(?:NAXIS1|PCOUNT|TFIELDS|FLAGCOL|ALIAS|AFW_TABLE_VERSION'
+    r'|T(?:TYPE|FORM|CCLS|UNIT|DOC|DIM|ZERO|SCAL|FLAG|FDOC)[0-9]+)$'
+)
+
+
+def get_schema_fingerprint(header):
+    """
+    Get the fingerprint of the layout of a binary table.
+    Tables with the same fingerprint have the same columns
+    (names, types, units, docs, aliases) at the same offsets in rows,
+    though they may have different numbers of rows.
+    @param header
+        Header (or pyfits.Header) of the binary table.
+    @return (str)
+    """
+    digest = hashlib.sha1()
+    for key, value in header.items():
+        if _schemaKeyPattern.match(key):
+            digest.update(repr((key, value)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class TableData(object):
+    """
+    Columns of a binary table in a memory-mapped file.
+    data[name] returns numpy.array as pyfits would.
+    """
+    __slots__ = ["records", "converters"]
+
+    def __init__(self, buffer, offset, header):
+        """
+        @param buffer
+            Buffer (mmap) holding the file.
+        @param offset
+            Position in the buffer at which the table begins.
+        @param header
+            Header of the table.
+        """
+        dtype, self.converters = _get_table_layout(header)
+
+        self.records = numpy.ndarray(
+            shape=(header["NAXIS2"],), dtype=dtype, buffer=buffer, offset=offset
+        )
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, name):
+        column = self.records[name]
+        converter = self.converters.get(name)
+        if converter is not None:
+            column = converter(column)
+        return column
+
+
+# Map from fingerprint: str -> (dtype, converters) or _UnsupportedFormat
+_tableLayouts = {}
+
+
+def _get_table_layout(header):
+    """
+    Get the layout of rows of a binary table.
+    It is made only once for each fingerprint of headers.
+    @return (dtype, converters)
+        * dtype: numpy.dtype of rows.
+        * converters: Map from column name -> function
+            to convert the raw column to what pyfits would return.
+    @exception _UnsupportedFormat
+    """
+    layout = _tableLayouts.get(header.fingerprint)
+    if layout is None:
+        try:
+            layout = _make_table_layout(header)
+        except _UnsupportedFormat as e:
+            layout = e
+        if header.fingerprint is not None:
+            _tableLayouts[header.fingerprint] = layout
+
+    if isinstance(layout, _UnsupportedFormat):
+        raise layout
+    return layout
+
+
+def _make_table_layout(header):
+    dtype = []
+    converters = {}
+
+    for i in range(1, 1+header["TFIELDS"]):
+        name = header.get("TTYPE{}".format(i), "")
+        tform = header["TFORM{}".format(i)]
+        m = re.match(r'^([0-9]*)([LXBIJKEDA])$', tform.strip())
+        if not m:
+            raise _UnsupportedFormat(tform)
+
+        repeat = int(m.group(1)) if m.group(1) else 1
+        code = m.group(2)
+        if code == "X":
+            dtype.append((name, "u1", ((repeat+7)//8,)))
+            converters[name] = _BitConverter(repeat)
+            continue
+        if code == "A":
+            dtype.append((name, "S{}".format(repeat)))
+            continue
+
+        shape = (repeat,)
+        tdim = header.get("TDIM{}".format(i))
+        if tdim:
+            shape = tuple(reversed([int(n) for n in tdim.strip("() ").split(",")]))
+
+        if shape == (1,):
+            dtype.append((name, _tformToDtype[code]))
+        else:
+            dtype.append((name, _tformToDtype[code], shape))
+
+        if code == "L":
+            converters[name] = _convert_logical
+
+        tzero = header.get("TZERO{}".format(i))
+        if tzero and code in _unsignedZero and tzero == _unsignedZero[code]:
+            converters[name] = _UnsignedConverter(code)
+        elif tzero or header.get("TSCAL{}".format(i), 1) != 1:
+            raise _UnsupportedFormat(tform)
+
+    if header.get("PCOUNT", 0) != 0:
+        raise _UnsupportedFormat("PCOUNT")
+
+    dtype = numpy.dtype(dtype)
+    if dtype.itemsize != header["NAXIS1"]:
+        raise _UnsupportedFormat("NAXIS1")
+
+    return dtype, converters
+
+
+
+_tformToDtype = {
+    "L": "u1",
+    "B": "u1",
+    "I": ">i2",
+    "J": ">i4",
+    "K": ">i8",
+    "E": ">f4",
+    "D": ">f8",
+}
+
+_unsignedZero = {
+    "I": 1 << 15,
+    "J": 1 << 31,
+    "K": 1 << 63,
+}
+
+
+class _UnsupportedFormat(Exception):
+    pass
+
+
+def _convert_logical(column):
+    return column == ord("T")
+
+
+class _BitConverter(object):
+    def __init__(self, nBits):
+        self.nBits = nBits
+
+    def __call__(self, column):
+        return numpy.unpackbits(column, axis=-1)[..., :self.nBits].astype(bool)
+
+
+class _UnsignedConverter(object):
+    def __init__(self, code):
+        self.signBit = numpy.array(_unsignedZero[code], dtype=_tformToDtype[code].replace("i", "u"))
+
+    def __call__(self, column):
+        return column.view(self.signBit.dtype) ^ self.signBit
+
+
+def _skip_header(buffer, offset):
+    """
+    Skip a header beginning at offset, and the data of the HDU.
+    @return
+        Position of the next HDU.
+    """
+    header, offset = _read_header(buffer, offset)
+    size = abs(header.get("BITPIX", 8)) // 8
+    naxis = header.get("NAXIS", 0)
+    if naxis:
+        for i in range(1, 1+naxis):
+            size *= header["NAXIS{}".format(i)]
+        size += header.get("PCOUNT", 0)
+    else:
+        size = 0
+    return offset + ((size + 2879)//2880)*2880
+
+
+def _read_header(buffer, offset):
+    """
+    Read a header beginning at offset.
+    Headers that differ only in NAXIS2 (the number of rows)
+    are parsed only once.
+    @return (header, offset)
+        * header: Header object.
+        * offset: Position at which the data begins.
+    """
+    begin = offset
+    while True:
+        block = buffer[offset:offset+2880]
+        if len(block) < 2880:
+            raise RuntimeError("Unexpected end of FITS file")
+        offset += 2880
+        if _find_card(block, b"END     ") >= 0:
+            break
+
+    text = buffer[begin:offset]
+    naxis2 = _find_card(text, b"NAXIS2  ")
+    if naxis2 < 0 or text[naxis2+8:naxis2+10] != b"= ":
+        prototype, index = _parse_header(text)
+        return Header(list(prototype.cards), dict(prototype.values), prototype.fingerprint), offset
+
+    prototype, index = _parse_header(text[:naxis2+10] + b" " * 70 + text[naxis2+80:])
+    value = _parse_value(text[naxis2+10:naxis2+80].decode("ascii"))
+
+    cards = list(prototype.cards)
+    cards[index] = ("NAXIS2", value)
+    values = dict(prototype.values)
+    values["NAXIS2"] = value
+    return Header(cards, values, prototype.fingerprint), offset
+
+
+def _find_card(text, key):
+    """
+    Find a card in a header.
+    @param text (bytes)
+        Header.
+    @param key (bytes)
+        First 8 bytes of the card.
+    @return
+        Position of the first card that begins with the key, or -1.
+    """
+    pos = text.find(key)
+    while pos >= 0 and pos % 80 != 0:
+        pos = text.find(key, pos + 1)
+    return pos
+
+
+@functools.lru_cache(maxsize=16)
+def _parse_header(text):
+    """
+    Parse a header.
+    @param text (bytes)
+        Header, whose length is a multiple of 2880.
+    @return (header, index)
+        * header: Header object, which must not be modified.
+        * index: Index of the NAXIS2 card in header.cards, or None.
+    """
+    cards = []
+    for offset in range(0, len(text), 2880):
+        block = text[offset:offset+2880]
+        for i in range(0, 2880, 80):
+            card = block[i:i+80].decode("ascii")
+            key = card[:8].rstrip()
+            if key == "END":
+                header = Header(cards)
+                header.fingerprint = get_schema_fingerprint(header)
+                index = next((n for n, (k, v) in enumerate(cards) if k == "NAXIS2"), None)
+                return header, index
+
+            if key == "CONTINUE" and cards and isinstance(cards[-1][1], str) and cards[-1][1].endswith("&"):
+                value = _parse_value(card[8:])
+                if isinstance(value, str):
+                    cards[-1] = (cards[-1][0], cards[-1][1][:-1] + value)
+                continue
+
+            if key == "HIERARCH" and "=" in card:
+                key, value = card[9:].split("=", 1)
+                cards.append((key.strip(), _parse_value(value)))
+            elif card[8:10] == "= ":
+                cards.append((key, _parse_value(card[10:])))
+            elif key:
+                cards.append((key, card[8:].rstrip()))
+
+    raise RuntimeError("Unexpected end of FITS header")
+
+
+def _parse_value(text):
+    """
+    Parse the value in a header card (the comment following "/" is discarded).
+    """
+    text = text.strip()
+    if text.startswith("'"):
+        m = re.match(r"^'((?:[^']|'')*)'", text)
+        return m.group(1).replace("''", "'").rstrip() if m else text
+
+    text = text.split("/", 1)[0].strip()
+    if text == "T":
+        return True
+    if text == "F":
+        return False
+    if not text:
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text.replace("D", "E"))
+    except ValueError:
+        return text
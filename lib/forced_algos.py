@@ -15,6 +15,7 @@
 
 import importlib
 
+from .algobase import PrefixDispatcher
 from .misc import PoppingOrderedDict
 
 def _import_algo(name):
@@ -90,6 +91,8 @@ ref_algos_ignored = [ ]    #none
     # #"subaru_FilterFraction_",                 # doesn't exist for LSST
     #]
 
+ref_dispatcher = PrefixDispatcher(ref_algos, ref_algos_ignored)
+
 # Associate column class name/prefix (e.g., 'detect') with package which
 # handles it.
 forced_algos = PoppingOrderedDict(
@@ -134,3 +137,16 @@ forced_algos_ignored = [
     #"undeblended_ext_convolved_ConvolvedFlux_", # add for LSST 1.2
     "modelfit_GeneralShapeletPsfApprox_",       # added for LSST
 ]
+
+forced_dispatcher = PrefixDispatcher(forced_algos, forced_algos_ignored)
+
+# Algorithms that are queried together, which lib.partitioner keeps
+# in the same part table. The first group goes to the first part table.
+forced_coaccess_groups = [
+    # Per-band ("{BAND}_") inputs to the DPDD view (See native_to_dpdd.yaml).
+    # The view also reads base_PixelFlags and base_ClassificationExtendedness,
+    # but those of the reference catalog, which are not in the multiband tables.
+    ["modelfit_CModel", "base_PsfFlux", "base_SdssShape"],
+    # Flags and quantities with which objects are selected
+    ["base_PixelFlags", "base_InputCount", "base_Variance", "base_LocalBackground", "base_ClassificationExtendedness"],
+]
@@ -0,0 +1,201 @@
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import re
+import sys
+import threading
+import time
+
+from . import common
+from . import config
+from .misc import stage_time
+
+# Priorities of statements (smaller is earlier)
+_priorityTail  = 0
+_priorityGiST  = 1
+_priorityIndex = 2
+
+
+class IndexBuilder(object):
+    """
+    Scheduler of CREATE INDEX statements.
+
+    Statements are not executed immediately but recorded by cursor-like
+    objects returned by cursor(). run() then executes independent
+    CREATE INDEX statements in parallel over a pool of DB connections.
+    """
+    __slots__ = ["tables"]
+
+    def __init__(self):
+        self.tables = []
+
+    def cursor(self):
+        """
+        Get a cursor-like object that records statements executed on it.
+        It is assumed that the statements recorded by one cursor
+        are on one table: CREATE INDEX statements may run in parallel,
+        while the other statements (e.g. "ALTER TABLE ... ADD PRIMARY KEY USING INDEX")
+        run in order after all the CREATE INDEX statements have finished.
+        """
+        recorder = _StatementRecorder()
+        self.tables.append(recorder)
+        return recorder
+
+    def get_indexes(self):
+        """
+        Get the CREATE INDEX statements that have been recorded.
+        @return
+            List, for each cursor, of lists of (sql, params, isGiST).
+        """
+        return [
+            [(sql, params, _is_gist(sql)) for sql, params in recorder.statements if _is_create_index(sql)]
+            for recorder in self.tables
+        ]
+
+    @stage_time("index")
+    def run(self, jobs=None, maintenanceWorkMem=None, maxParallelMaintenanceWorkers=None):
+        """
+        Execute the recorded statements.
+        GiST indexes, which take the longest to build, are created first.
+        Each statement is committed as soon as it has finished.
+        The statements are expected to be idempotent
+        (e.g. "CREATE INDEX IF NOT EXISTS") so that the indexes left by a failed run
+        do not make the next run fail.
+        @param jobs (int)
+            Number of DB connections. (Default: config.indexJobs)
+        @param maintenanceWorkMem (str)
+            maintenance_work_mem of each connection, like "4GB".
+            (Default: config.maintenanceWorkMem)
+        @param maxParallelMaintenanceWorkers (int)
+            max_parallel_maintenance_workers of each connection.
+            (Default: config.maxParallelMaintenanceWorkers)
+        """
+        if jobs is None:
+            jobs = config.indexJobs
+        if maintenanceWorkMem is None:
+            maintenanceWorkMem = config.maintenanceWorkMem
+        if maxParallelMaintenanceWorkers is None:
+            maxParallelMaintenanceWorkers = config.maxParallelMaintenanceWorkers
+
+        queue = []
+        sequence = 0
+        pending = {}
+        for iTable, recorder in enumerate(self.tables):
+            indexes = [statement for statement in recorder.statements if _is_create_index(statement[0])]
+            tail = [statement for statement in recorder.statements if not _is_create_index(statement[0])]
+            pending[iTable] = [len(indexes), tail]
+            for statement in indexes:
+                priority = _priorityGiST if _is_gist(statement[0]) else _priorityIndex
+                heapq.heappush(queue, (priority, sequence, iTable, [statement]))
+                sequence += 1
+            if not indexes and tail:
+                heapq.heappush(queue, (_priorityTail, sequence, iTable, tail))
+                sequence += 1
+                pending[iTable][1] = []
+
+        condition = threading.Condition()
+        running = [0]
+        errors = []
+
+        def work():
+            db = common.new_db_connection()
+            with db.cursor() as cursor:
+                if maintenanceWorkMem:
+                    cursor.execute("SET maintenance_work_mem = %s", (maintenanceWorkMem,))
+                if maxParallelMaintenanceWorkers is not None:
+                    cursor.execute("SET max_parallel_maintenance_workers = %s", (maxParallelMaintenanceWorkers,))
+            db.commit()
+
+            while True:
+                with condition:
+                    while not queue and running[0] > 0 and not errors:
+                        condition.wait()
+                    if not queue or errors:
+                        condition.notify_all()
+                        break
+                    priority, seq, iTable, statements = heapq.heappop(queue)
+                    running[0] += 1
+
+                try:
+                    for sql, params in statements:
+                        start = time.time()
+                        with db.cursor() as cursor:
+                            cursor.execute(sql, params)
+                        db.commit()
+                        print("{:.3f} sec: {}".format(time.time() - start, _describe(sql)))
+                except BaseException:
+                    with condition:
+                        errors.append(sys.exc_info())
+                        running[0] -= 1
+                        condition.notify_all()
+                    break
+
+                with condition:
+                    running[0] -= 1
+                    if priority != _priorityTail:
+                        pending[iTable][0] -= 1
+                        if pending[iTable][0] == 0 and pending[iTable][1]:
+                            heapq.heappush(queue, (_priorityTail, seq, iTable, pending[iTable][1]))
+                    condition.notify_all()
+
+            db.close()
+
+        start = time.time()
+        threads = [threading.Thread(target=work, daemon=True) for i in range(max(1, jobs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            excType, excValue, excTraceback = errors[0]
+            raise excValue.with_traceback(excTraceback)
+
+        print("{:.3f} sec: all indexes".format(time.time() - start))
+
+
+class _StatementRecorder(object):
+    """
+    Cursor-like object that records statements executed on it.
+    """
+    __slots__ = ["statements"]
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+
+
+def _is_create_index(sql):
+    return re.match(r"\s*CREATE\s+(UNIQUE\s+)?INDEX\b", sql, re.IGNORECASE) is not None
+
+
+def _is_gist(sql):
+    return re.search(r"\bUSING\s+GiST\b", sql, re.IGNORECASE) is not None
+
+
+def _describe(sql):
+    """
+    Get a short description of a statement to be reported.
+    """
+    m = re.match(r'\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?("[^"]*"|\S+)', sql, re.IGNORECASE)
+    if m:
+        return "index " + m.group(1)
+    m = re.search(r'\bADD\s+PRIMARY\s+KEY\s+USING\s+INDEX\s+("[^"]*"|[^\s;]+)', sql, re.IGNORECASE)
+    if m:
+        return "primary key " + m.group(1)
+    return " ".join(sql.split())[:80]
@@ -0,0 +1,364 @@
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Physical layout of the tables in the DB.
+
+A layout is planned by "plan-capacity.py --optimize-layout" from sampled catalogs,
+and given to the loaders by "--layout" (config.layout). With a layout,
+    * columns are ordered by alignment so that tuples have no padding;
+    * integer columns are narrowed to the smallest types that hold the sampled values;
+    * floating-point columns that are NaN in all the sampled catalogs are not stored.
+The views show the columns in the original order with the original types,
+and the columns not stored as NULL.
+
+The loaders fit the layout to all the patches before they create the tables (See fit()).
+
+A layout is a dict (saved in JSON):
+    {"tables": {tableName: {"narrow": {column: [sqltype, narrowed]}, "empty": {column: sqltype}}}}
+where sqltype is the original type of a column.
+"""
+
+import functools
+import json
+import multiprocessing
+import re
+
+import numpy
+
+from . import capacity
+from . import config
+
+# Map from SQL types to which integers are narrowed -> numpy dtype
+_narrowTypes = [
+    ("Smallint", numpy.int16),
+    ("Integer" , numpy.int32),
+]
+
+# Sampled values must fit in this fraction of the range of a narrowed type,
+# lest other catalogs should have values out of the range.
+_narrowingHeadroom = 0.5
+
+# Bitmasks of packed flags (See algobase.Algo.get_flag_bits()) are not narrowed
+# because the bits are extracted by shifting, which depends on the width.
+_unnarrowable = re.compile(r'_flagbits[0-9]+$')
+
+
+def load(path):
+    """
+    Load a layout from a JSON file.
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(path, layout):
+    """
+    Save a layout into a JSON file.
+    """
+    with open(path, "w") as f:
+        json.dump(layout, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+class LayoutMismatch(RuntimeError):
+    """
+    Raised by apply_to_backend_field_data() when data do not fit config.layout.
+    """
+    def __init__(self, tableName, columns):
+        """
+        @param tableName (str)
+        @param columns (dict)
+            Map from column name -> SQL type that the column needs.
+        """
+        RuntimeError.__init__(self,
+            'Columns of "{}" have values that do not fit the layout: {}. Plan the layout again.'.format(
+                tableName, ", ".join(sorted(columns))))
+        self.tableName = tableName
+        self.columns = columns
+
+
+class ColumnStats(object):
+    """
+    Statistics of the values of a column in sampled catalogs.
+    """
+    __slots__ = ["sqltype", "nRows", "min", "max", "allNaN"]
+
+    def __init__(self, sqltype):
+        """
+        @param sqltype (str)
+            SQL type of the column.
+        """
+        self.sqltype = sqltype
+        self.nRows = 0
+        self.min = None
+        self.max = None
+        self.allNaN = True
+
+    def add(self, data):
+        """
+        Add the values of a column in a catalog.
+        @param data (numpy.array)
+        """
+        if len(data) == 0:
+            return
+
+        self.nRows += len(data)
+        kind = data.dtype.kind
+        if kind in "iu":
+            lo, hi = int(data.min()), int(data.max())
+            self.min = lo if self.min is None else min(self.min, lo)
+            self.max = hi if self.max is None else max(self.max, hi)
+        if kind != "f" or not numpy.isnan(data).all():
+            self.allNaN = False
+
+
+def plan(stats):
+    """
+    Plan a layout from the statistics of sampled catalogs.
+    @param stats (dict)
+        Map from table name -> {column name -> ColumnStats}.
+    @return (dict)
+        Layout.
+    """
+    tables = {}
+    for tableName, columns in sorted(stats.items()):
+        narrow = {}
+        empty = {}
+        for name, s in sorted(columns.items()):
+            if s.nRows == 0:
+                continue
+            if s.allNaN:
+                empty[name] = s.sqltype
+            elif s.min is not None and not _unnarrowable.search(name):
+                sqltype = _get_narrow_type(s.sqltype, s.min, s.max)
+                if sqltype is not None:
+                    narrow[name] = [s.sqltype, sqltype]
+
+        tables[tableName] = {"narrow": narrow, "empty": empty}
+
+    return {"tables": tables}
+
+
+def _get_narrow_type(sqltype, lo, hi):
+    """
+    Get the narrowest integer type that holds [lo, hi] with headroom,
+    or None if it is not narrower than sqltype.
+    """
+    width = _get_width(sqltype)
+    for narrowType, dtype in _narrowTypes:
+        if _get_width(narrowType) >= width:
+            return None
+        info = numpy.iinfo(dtype)
+        if info.min * _narrowingHeadroom <= lo and hi <= info.max * _narrowingHeadroom:
+            return narrowType
+    return None
+
+
+def _get_table_layout(tableName):
+    """
+    Get the layout of a table in config.layout.
+    @return (dict)
+        {"narrow": {column: [sqltype, narrowed]}, "empty": {column: sqltype}}
+    """
+    return config.layout.get("tables", {}).get(tableName, {"narrow": {}, "empty": {}})
+
+
+def apply_to_backend_fields(tableName, members):
+    """
+    Apply config.layout to the columns of a table.
+    @param tableName (str)
+    @param members
+        List of (fieldname, sqltype) in the logical order.
+    @return
+        List of (fieldname, sqltype) in the physical order,
+        without the columns not stored and with the types narrowed.
+    """
+    if not config.layout:
+        return members
+
+    layout = _get_table_layout(tableName)
+    narrow = layout["narrow"]
+    empty = layout["empty"]
+
+    members = [
+        (name, narrow[name][1] if name in narrow else sqltype)
+        for name, sqltype in members if name not in empty
+    ]
+
+    # Fixed-width columns come first in descending order of alignment,
+    # followed by variable-length ones (e.g. Earth). The sort is stable,
+    # so "object_id" remains at the top.
+    def key(member):
+        name, sqltype = member
+        sqltype = sqltype.lower()
+        if sqltype not in capacity.sqlTypes or sqltype == "earth":
+            return (1, 0)
+        return (0, -capacity.sqlTypes[sqltype][1])
+
+    return sorted(members, key=key)
+
+
+def apply_to_backend_field_data(tableName, members):
+    """
+    Apply config.layout to the data of a table.
+    @param tableName (str)
+    @param members
+        List of (fieldname, printf_format, [column]).
+    @return
+        List of (fieldname, printf_format, [column])
+        without the columns not stored and with the columns narrowed.
+    """
+    if not config.layout:
+        return members
+
+    layout = _get_table_layout(tableName)
+    narrow = layout["narrow"]
+    empty = layout["empty"]
+    dtypes = dict(_narrowTypes)
+
+    ret = []
+    mismatches = {}
+    for name, fmt, cols in members:
+        if name in empty:
+            if not numpy.isnan(cols[0]).all():
+                mismatches[name] = empty[name]
+            continue
+        if name in narrow:
+            sqltype, narrowed = narrow[name]
+            info = numpy.iinfo(dtypes[narrowed])
+            column = numpy.asarray(cols[0])
+            if len(column):
+                lo, hi = int(column.min()), int(column.max())
+                if lo < info.min or hi > info.max:
+                    mismatches[name] = _get_narrow_type(sqltype, lo, hi) or sqltype
+                    continue
+            cols = [column.astype(dtypes[narrowed])]
+        ret.append((name, fmt, cols))
+
+    if mismatches:
+        raise LayoutMismatch(tableName, mismatches)
+
+    return ret
+
+
+def fit(get_patch_tables, patches, jobs=1):
+    """
+    Read patches, and widen config.layout where their data do not fit it:
+    columns not stored are stored, and narrowed columns are widened.
+    Insertion with the layout then does not fail halfway
+    because of a patch not sampled when the layout was planned.
+    The layout is saved into config.layoutPath if it is changed.
+    @param get_patch_tables
+        Function (tract, patch) -> list of (table: DBTable, filter: str),
+        where the tables have the data of the patch.
+        It must be picklable if jobs > 1.
+    @param patches
+        Iterable of (tract, patch).
+    @param jobs
+        Number of worker processes.
+    @return (dict)
+        Map from table name -> {column name -> SQL type} of the columns changed.
+    """
+    check = functools.partial(_check_patch, get_patch_tables)
+    changes = {}
+
+    def merge(mismatches):
+        for tableName, columns in mismatches.items():
+            changed = changes.setdefault(tableName, {})
+            for name, sqltype in columns.items():
+                if name not in changed or _get_width(sqltype) > _get_width(changed[name]):
+                    changed[name] = sqltype
+
+    if jobs <= 1:
+        for tract_patch in patches:
+            merge(check(tract_patch))
+    else:
+        # The workers are forked so that they inherit config.layout.
+        context = multiprocessing.get_context("fork")
+        with context.Pool(jobs) as pool:
+            for mismatches in pool.imap_unordered(check, patches, chunksize=1):
+                merge(mismatches)
+
+    for tableName, columns in changes.items():
+        layout = _get_table_layout(tableName)
+        for name, sqltype in columns.items():
+            layout["empty"].pop(name, None)
+            if name in layout["narrow"]:
+                if layout["narrow"][name][0] == sqltype:
+                    del layout["narrow"][name]
+                else:
+                    layout["narrow"][name][1] = sqltype
+            print('layout: "{tableName}".{name} is stored as {sqltype}'.format(**locals()))
+
+    if changes and config.layoutPath:
+        save(config.layoutPath, config.layout)
+
+    return changes
+
+
+def _check_patch(get_patch_tables, tract_patch):
+    """
+    Get the columns whose data in a patch do not fit config.layout.
+    @return (dict)
+        Map from table name -> {column name -> SQL type that the column needs}.
+    """
+    mismatches = {}
+    for table, filter in get_patch_tables(*tract_patch):
+        getters = [lambda: table.get_backend_field_data(filter)]
+        if hasattr(table, "get_bandindependent_backend_field_data"):
+            getters.append(table.get_bandindependent_backend_field_data)
+        for getter in getters:
+            try:
+                getter()
+            except LayoutMismatch as e:
+                mismatches.setdefault(e.tableName, {}).update(e.columns)
+    return mismatches
+
+
+def _get_width(sqltype):
+    return capacity.sqlTypes.get(sqltype.lower(), (0, 0))[0]
+
+
+def apply_to_exported_fields(tableName, members):
+    """
+    Apply config.layout to the definitions of the fields in the views.
+    Columns not stored are read as NULL, and narrowed columns are cast
+    to their original types.
+    @param tableName (str)
+    @param members
+        List of (fieldname, definition, unit, document).
+    @return
+        List of (fieldname, definition, unit, document).
+    """
+    if not config.layout:
+        return members
+
+    layout = _get_table_layout(tableName)
+
+    replacements = {}
+    for name, sqltype in layout["empty"].items():
+        replacements[name] = "NULL::{}".format(sqltype)
+    for name, (sqltype, narrowed) in layout["narrow"].items():
+        replacements[name] = "{}::{}".format(name, sqltype)
+
+    if not replacements:
+        return members
+
+    pattern = re.compile(r'\b(?:{})\b'.format("|".join(re.escape(name) for name in replacements)))
+    return [
+        (member, pattern.sub(lambda m: replacements[m.group(0)], definition), unit, doc)
+        for member, definition, unit, doc in members
+    ]
@@ -0,0 +1,331 @@
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Inventory of the catalog files in a rerun directory.
+
+The inventory is kept in an SQLite file so that the directory tree,
+which is often on a network file system where metadata operations
+are expensive, need not be crawled every time a loader starts.
+Only directories whose mtimes have changed since the last scan are listed again.
+"""
+
+import collections
+import concurrent.futures
+import fnmatch
+import os
+import re
+import sqlite3
+
+from . import fits
+
+# The tree of a rerun is: deepCoadd-results/{filter or "merged"}/{tract}/{x},{y}/{files}
+_topDir = "deepCoadd-results"
+_depthOfPatch = 3
+
+# Kinds of catalogs recorded in manifests
+kinds = ["ref", "forced_src", "forced", "meas", "ran", "forced_src_undeblendedConvolved"]
+
+_catalogPattern = re.compile(r'^({})-(?:(.+)-)?([0-9]+)-([0-9]+),([0-9]+)\.fits(\.gz)?$'.format("|".join(kinds)))
+
+File = collections.namedtuple("File", [
+    "path", "dir", "kind", "filter", "tract", "patch", "compressed", "size", "mtime", "naxis2",
+])
+File.__doc__ = """
+A catalog file in a manifest.
+  * path: Path relative to the rerun directory, virtualized (without ".gz").
+  * dir: Directory (relative to the rerun directory) that contains the file.
+  * kind: "ref", "forced_src", "meas", "ran", etc.
+  * filter: Filter name ("" for "ref").
+  * tract, patch: Tract number and patch number (x*100 + y).
+  * compressed: Whether the actual file has ".gz".
+  * size, mtime: Size and mtime (in nanoseconds) of the actual file.
+  * naxis2: Number of rows.
+"""
+
+
+class Manifest(object):
+    """
+    Inventory of the catalog files in a rerun directory.
+    The whole inventory is held in memory once it has been loaded,
+    and the SQLite file is not kept open: it is safe to use
+    a Manifest object in forked processes.
+    """
+    __slots__ = ["rerunDir", "path", "dirs", "files"]
+
+    def __init__(self, rerunDir, path):
+        """
+        @param rerunDir (str)
+            Path to the rerun directory.
+        @param path (str)
+            Path to the SQLite file. It is created if it does not exist.
+        """
+        self.rerunDir = os.path.normpath(rerunDir)
+        self.path = path
+        # Map from dir: str -> (mtime, [subdir]) for directories above patches,
+        # or (mtime, None) for patch directories.
+        self.dirs = {}
+        # Map from path: str -> File
+        self.files = {}
+
+        self._load()
+
+    def refresh(self, jobs=16):
+        """
+        Scan the rerun directory and save the result in the SQLite file.
+        Directories whose mtimes are the same as recorded are not listed again.
+        @param jobs (int)
+            Number of threads with which to scan directories in parallel.
+        @return (nListed, nRead)
+            Number of directories listed and number of files whose headers were read.
+        """
+        oldDirs = self.dirs
+        oldFiles = collections.defaultdict(list)
+        for file in self.files.values():
+            oldFiles[file.dir].append(file)
+
+        dirs = {}
+        files = {}
+        changedDirs = []
+        nRead = 0
+
+        with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) as executor:
+            level = [_topDir]
+            for depth in range(_depthOfPatch + 1):
+                results = executor.map(
+                    lambda dir: self._scan_dir(dir, depth, oldDirs.get(dir), oldFiles.get(dir, [])),
+                    level
+                )
+
+                nextLevel = []
+                for dir, result in zip(level, results):
+                    if result is None:
+                        continue
+                    mtime, subdirs, dirFiles, changed = result
+                    dirs[dir] = (mtime, subdirs)
+                    if changed:
+                        changedDirs.append(dir)
+                    if subdirs is not None:
+                        nextLevel.extend(subdirs)
+                    for file, read in dirFiles:
+                        files[file.path] = file
+                        nRead += read
+                level = nextLevel
+
+        removedDirs = [dir for dir in oldDirs if dir not in dirs]
+        self._save(changedDirs, removedDirs, dirs, files)
+
+        self.dirs = dirs
+        self.files = files
+        return len(changedDirs), nRead
+
+    def get_filters(self):
+        """
+        Get the names of the directories of filters (and "merged").
+        """
+        return [os.path.basename(dir) for dir in self.dirs.get(_topDir, (None, []))[1] or []]
+
+    def get_tracts(self):
+        """
+        Get the names of the directories of tracts in all filters.
+        """
+        return sorted(set(
+            os.path.basename(dir) for dir in self.dirs if dir.count("/") == 2
+        ))
+
+    def get_patches(self, kind, tract, filterDir="*"):
+        """
+        Get patches in which catalogs of a kind exist.
+        @param kind (str)
+            "ref", "forced_src", "meas", "ran", etc.
+        @param tract (int)
+        @param filterDir (str)
+            Name (or glob pattern) of the directory of the filter ("merged" for "ref").
+        @return
+            List of patch numbers, sorted.
+        """
+        return sorted(set(
+            file.patch for file in self.files.values()
+            if file.kind == kind and file.tract == tract
+            and fnmatch.fnmatchcase(file.dir.split("/")[1], filterDir)
+        ))
+
+    def iglob(self, pattern):
+        """
+        glob.iglob() with gzip compression considered (as lib.common.iglob_compressed)
+        @param pattern (str)
+            Pattern of virtualized paths (without ".gz").
+        """
+        relPattern = self._relpath(pattern)
+        for file in self.files.values():
+            if fnmatch.fnmatchcase(file.path, relPattern):
+                path = os.path.join(self.rerunDir, file.path)
+                yield path + ".gz" if file.compressed else path
+
+    def get_file(self, path):
+        """
+        Get a file by its path.
+        @param path (str)
+            Path (virtualized: without ".gz"), which may or may not begin with the rerun directory.
+        @return (File)
+            None if the file does not exist.
+        """
+        return self.files.get(self._relpath(path))
+
+    def covers(self, path):
+        """
+        Whether this manifest can tell about the path.
+        @param path (str)
+            Path or glob pattern of catalogs (virtualized: without ".gz").
+        """
+        path = self._relpath(path)
+        return path is not None and path.startswith(_topDir + "/") \
+            and os.path.basename(path).split("-", 1)[0] in kinds
+
+    def _relpath(self, path):
+        path = os.path.normpath(path)
+        if os.path.isabs(path) != os.path.isabs(self.rerunDir):
+            path = os.path.abspath(path)
+            rerunDir = os.path.abspath(self.rerunDir)
+        else:
+            rerunDir = self.rerunDir
+
+        if rerunDir == ".":
+            return None if path.startswith("..") else path
+        if not path.startswith(rerunDir + os.sep):
+            return None
+        return path[len(rerunDir)+1:]
+
+    def _scan_dir(self, dir, depth, old, oldFiles):
+        """
+        Scan a directory.
+        @param dir (str)
+            Directory relative to the rerun directory.
+        @param depth (int)
+            Depth of the directory (0 for "deepCoadd-results").
+        @param old
+            (mtime, subdirs) of the directory recorded in the last scan, or None.
+        @param oldFiles
+            Files in the directory recorded in the last scan.
+        @return (mtime, subdirs, files, changed)
+            * subdirs: list of subdirectories (None if the directory is a patch directory)
+            * files: list of (File, read: bool) in the directory.
+            * changed: whether the directory has been listed.
+            None is returned if the directory does not exist.
+        """
+        try:
+            mtime = os.stat(os.path.join(self.rerunDir, dir)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        if old is not None and old[0] == mtime:
+            return mtime, old[1], [(file, False) for file in oldFiles], False
+
+        oldFiles = dict((file.path, file) for file in oldFiles)
+        subdirs = [] if depth < _depthOfPatch else None
+        files = []
+
+        with os.scandir(os.path.join(self.rerunDir, dir)) as entries:
+            entries = list(entries)
+            names = set(entry.name for entry in entries)
+            for entry in entries:
+                if depth < _depthOfPatch:
+                    if entry.is_dir():
+                        subdirs.append(dir + "/" + entry.name)
+                    continue
+
+                m = _catalogPattern.match(entry.name)
+                if not m or not entry.is_file():
+                    continue
+
+                kind, filter, tract, x, y, gz = m.groups()
+                if gz and entry.name[:-3] in names:
+                    # lib.fits opens the uncompressed one if both exist.
+                    continue
+                path = dir + "/" + (entry.name[:-3] if gz else entry.name)
+                stat = entry.stat()
+
+                file = oldFiles.get(path)
+                if file is not None and (file.compressed, file.size, file.mtime) == (bool(gz), stat.st_size, stat.st_mtime_ns):
+                    files.append((file, False))
+                    continue
+
+                naxis2 = fits.fits_get_nrows(os.path.join(self.rerunDir, path))
+                files.append((File(
+                    path, dir, kind, filter or "", int(tract), int(x)*100 + int(y),
+                    bool(gz), stat.st_size, stat.st_mtime_ns, naxis2
+                ), True))
+
+        if subdirs is not None:
+            subdirs.sort()
+        return mtime, subdirs, files, True
+
+    def _connect(self):
+        db = sqlite3.connect(self.path)
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS dirs (
+            path    TEXT PRIMARY KEY,
+            mtime   INTEGER NOT NULL,
+            subdirs TEXT
+        )
+        """)
+        db.execute("""
+        CREATE TABLE IF NOT EXISTS files (
+            path       TEXT PRIMARY KEY,
+            dir        TEXT NOT NULL,
+            kind       TEXT NOT NULL,
+            filter     TEXT NOT NULL,
+            tract      INTEGER NOT NULL,
+            patch      INTEGER NOT NULL,
+            compressed INTEGER NOT NULL,
+            size       INTEGER NOT NULL,
+            mtime      INTEGER NOT NULL,
+            naxis2     INTEGER NOT NULL
+        )
+        """)
+        db.execute("""
+        CREATE INDEX IF NOT EXISTS files_dir ON files (dir)
+        """)
+        return db
+
+    def _load(self):
+        db = self._connect()
+        try:
+            for path, mtime, subdirs in db.execute("SELECT path, mtime, subdirs FROM dirs"):
+                self.dirs[path] = (mtime, subdirs.split("\n") if subdirs else ([] if subdirs is not None else None))
+            for row in db.execute("SELECT {} FROM files".format(", ".join(File._fields))):
+                file = File(*row)
+                self.files[file.path] = file._replace(compressed=bool(file.compressed))
+        finally:
+            db.close()
+
+    def _save(self, changedDirs, removedDirs, dirs, files):
+        db = self._connect()
+        try:
+            with db:
+                for dir in removedDirs:
+                    db.execute("DELETE FROM dirs WHERE path = ?", (dir,))
+                    db.execute("DELETE FROM files WHERE dir = ?", (dir,))
+                for dir in changedDirs:
+                    mtime, subdirs = dirs[dir]
+                    db.execute("INSERT OR REPLACE INTO dirs (path, mtime, subdirs) VALUES (?, ?, ?)",
+                        (dir, mtime, "\n".join(subdirs) if subdirs is not None else None))
+                    db.execute("DELETE FROM files WHERE dir = ?", (dir,))
+                    db.executemany("INSERT INTO files ({}) VALUES ({})".format(
+                            ", ".join(File._fields), ", ".join("?" * len(File._fields))),
+                        (file for file in files.values() if file.dir == dir)
+                    )
+        finally:
+            db.close()
@@ -15,6 +15,7 @@
 
 import importlib
 
+from .algobase import PrefixDispatcher
 from .misc import PoppingOrderedDict
 
 def _import_algo(name):
@@ -60,3 +61,15 @@ meas_algos = PoppingOrderedDict(
 meas_algos_ignored = [
     "footprint",
 ]
+
+meas_dispatcher = PrefixDispatcher(meas_algos, meas_algos_ignored)
+
+# Algorithms that are queried together, which lib.partitioner keeps
+# in the same part table. The first group goes to the first part table.
+meas_coaccess_groups = [
+    # Flags and quantities with which objects are selected
+    ["base_PixelFlags", "calib", "detect", "deblend", "base_Blendedness", "base_ClassificationExtendedness",
+     "base_FootprintArea", "base_InputCount", "base_Variance", "base_LocalBackground", "meas_modelfit_CModel"],
+    # Centroids and shapes
+    ["base_SdssCentroid", "base_SdssShape", "ext_shapeHSM"],
+]
@@ -14,6 +14,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import collections
+import contextlib
+import io
+import json
+import threading
+import time
 import warnings
 
 
@@ -111,3 +116,120 @@ def meas_time(id):
     return _meas_time
 
 _timeDict = {}
+
+
+@contextlib.contextmanager
+def stage_time(name):
+    """
+    Accumulate time of execution of a stage of loading.
+    Usage:
+        with stage_time("transform"):
+            ...
+
+    Or this function can be used as a function decorator:
+    @stage_time("transform")
+    def do_something(): ...
+
+    Unlike meas_time(), nothing is printed. Accumulated times are
+    retrieved by get_stage_times() (in the same process).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(name, time.perf_counter() - start)
+
+
+def add_stage_time(name, seconds, nBytes=0):
+    """
+    Add time (and the amount of data processed in the time) to a stage.
+    """
+    with _stageLock:
+        _stageTimes[name] = _stageTimes.get(name, 0.0) + seconds
+        if nBytes:
+            _stageBytes[name] = _stageBytes.get(name, 0) + nBytes
+
+
+class TimedReader(object):
+    """
+    File-like object that accumulates time spent in read()
+    (i.e. time to produce data) of another file-like object to a stage.
+    """
+    __slots__ = ["name", "fin"]
+
+    def __init__(self, name, fin):
+        """
+        @param name (str)
+            Name of the stage.
+        @param fin
+            File-like object that has read().
+        """
+        self.name = name
+        self.fin  = fin
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self.fin.read(size)
+        add_stage_time(self.name, time.perf_counter() - start, len(data))
+        return data
+
+    def readline(self, size=-1):
+        start = time.perf_counter()
+        data = self.fin.readline(size)
+        add_stage_time(self.name, time.perf_counter() - start, len(data))
+        return data
+
+    def close(self):
+        if hasattr(self.fin, "close"):
+            self.fin.close()
+
+
+class ChunkReader(io.RawIOBase):
+    """
+    Read-only file that concatenates chunks (bytes) from a generator.
+    """
+    def __init__(self, chunks):
+        io.RawIOBase.__init__(self)
+        self.__chunks = chunks
+        self.__buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.__buffer:
+            chunk = next(self.__chunks, None)
+            if chunk is None:
+                return 0
+            self.__buffer = memoryview(chunk)
+
+        n = min(len(b), len(self.__buffer))
+        b[:n] = self.__buffer[:n]
+        self.__buffer = self.__buffer[n:]
+        return n
+
+    def close(self):
+        io.RawIOBase.close(self)
+        self.__chunks.close()
+
+
+def get_stage_times():
+    """
+    Get times accumulated by stage_time() etc.
+    @return
+        {"seconds": {name: float}, "bytes": {name: int}}
+    """
+    with _stageLock:
+        return {"seconds": dict(_stageTimes), "bytes": dict(_stageBytes)}
+
+
+def dump_stage_times(path):
+    """
+    Write get_stage_times() to a JSON file.
+    """
+    with open(path, "w") as fout:
+        json.dump(get_stage_times(), fout, indent=2, sort_keys=True)
+
+_stageLock  = threading.Lock()
+_stageTimes = {}
+_stageBytes = {}
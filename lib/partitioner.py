@@ -0,0 +1,148 @@
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Vertical partitioning of multiband tables.
+
+PostgreSQL limits the number of columns of a table (and of a view) to 1600,
+and a row of fixed-width columns must fit in a page. The algorithms of
+a catalog are therefore split into part tables. With config.autoPartition,
+the split is computed from the columns of the algorithms instead of
+the lists written in the loaders: algorithms are packed into as few part tables
+as fit the budget (config.partMaxColumns and config.partMaxRowWidth
+for config.partFilters filters, which the loaders raise to the number of
+filters in the rerun directory), keeping the algorithms of each co-access
+group (e.g. the inputs to the DPDD view) in the same part table.
+
+The partition depends only on the header of the catalog and on the budget,
+so that the loaders compute the same part tables every time.
+"""
+
+from . import capacity
+from . import config
+from . import misc
+
+
+class _Unit(object):
+    """
+    Algorithms that are to be placed in the same part table.
+    """
+    __slots__ = ["names", "types", "nViewColumns"]
+
+    def __init__(self, names, algos):
+        """
+        @param names (list of str)
+            Names of the algorithms.
+        @param algos (dict of (str, Algo))
+        """
+        self.names = list(names)
+        self.types = [sqltype for name in names for fieldname, sqltype in algos[name].get_backend_fields("")]
+        self.nViewColumns = sum(len(algos[name].get_frontend_fields("")) for name in names)
+
+
+class _Part(object):
+    """
+    A part table being packed.
+    """
+    __slots__ = ["names", "types", "nViewColumns"]
+
+    def __init__(self):
+        self.names = []
+        self.types = []
+        self.nViewColumns = 0
+
+    def fits(self, unit):
+        """
+        Whether the unit can be added to this part table within the budget.
+        """
+        return _fits_budget(self.types + unit.types, self.nViewColumns + unit.nViewColumns)
+
+    def add(self, unit):
+        self.names += unit.names
+        self.types += unit.types
+        self.nViewColumns += unit.nViewColumns
+
+
+def _fits_budget(types, nViewColumns):
+    """
+    Whether a part table fits the budget.
+    @param types (list of str)
+        SQL types of the columns of a single band.
+    @param nViewColumns (int)
+        Number of the columns of a single band in the view.
+    """
+    nFilters = config.partFilters
+    # "object_id" is prepended to the columns of all the bands.
+    if 1 + len(types) * nFilters > config.partMaxColumns:
+        return False
+    if 1 + nViewColumns * nFilters > config.partMaxColumns:
+        return False
+    return capacity.get_heap_tuple_size(["Bigint"] + types * nFilters) <= config.partMaxRowWidth
+
+
+def partition(algos, groups=[]):
+    """
+    Pack algorithms into part tables.
+
+    The column types are those in the catalog, before the algorithms
+    transform them (e.g. to single precision), so the row width is overestimated.
+
+    @param algos (PoppingOrderedDict of (str, Algo))
+        Algorithms of a multiband table.
+    @param groups (list of list of str)
+        Co-access groups. The algorithms in a group are placed in the same
+        part table unless they are too many for a part table.
+        Algorithms absent from "algos" are ignored.
+    @return
+        List of parts, each of which is a list of names of algorithms
+        in the order of "algos". The first part contains the first group.
+    """
+    units = []
+    grouped = set()
+    for group in groups:
+        names = [name for name in group if name in algos and name not in grouped]
+        if not names:
+            continue
+        grouped.update(names)
+        unit = _Unit(names, algos)
+        if _fits_budget(unit.types, unit.nViewColumns):
+            units.append(unit)
+        else:
+            misc.warning("Co-access group is too large for a part table, and is split:", names)
+            units += [_Unit([name], algos) for name in names]
+
+    # The other algorithms, widest first, so that they pack tightly
+    # ("first fit decreasing"). The sort is stable for the partition to be reproducible.
+    singles = [_Unit([name], algos) for name in algos if name not in grouped]
+    singles.sort(key=lambda unit: capacity.get_data_size(unit.types), reverse=True)
+    units += singles
+
+    parts = []
+    for unit in units:
+        if not _fits_budget(unit.types, unit.nViewColumns):
+            raise RuntimeError(
+                'Algorithm "{}" alone exceeds the budget of a part table ({} columns, {} bytes per row, {} filters)'
+                .format(unit.names[0], config.partMaxColumns, config.partMaxRowWidth, config.partFilters))
+        for part in parts:
+            if part.fits(unit):
+                part.add(unit)
+                break
+        else:
+            part = _Part()
+            part.add(unit)
+            parts.append(part)
+
+    order = dict((name, i) for i, name in enumerate(algos))
+    return [sorted(part.names, key=lambda name: order[name]) for part in parts]
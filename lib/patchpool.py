@@ -0,0 +1,72 @@
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import functools
+import multiprocessing
+
+from . import common
+
+# DB connection owned by this process if it is a worker of insert_patches()
+_workerDb = None
+
+
+def get_db_connection():
+    """
+    Get a DB connection with which to insert a patch.
+    In a worker process of insert_patches(), the connection opened
+    when the worker started is returned. Otherwise, a new connection is.
+    """
+    if _workerDb is not None:
+        return _workerDb
+    return common.new_db_connection()
+
+
+def insert_patches(insert_patch, patches, jobs=1):
+    """
+    Call insert_patch(tract, patch) for every (tract, patch) in patches.
+    @param insert_patch
+        Function that inserts a patch into the DB.
+        It must be picklable, i.e. a module-level function
+        or a functools.partial object of one.
+    @param patches
+        Iterable of (tract, patch).
+    @param jobs
+        Number of worker processes.
+        If jobs <= 1, patches are inserted in this process one by one.
+    """
+    if jobs <= 1:
+        for tract, patch in patches:
+            insert_patch(tract, patch)
+        return
+
+    # The workers are forked so that they inherit lib.config
+    # that has been set according to the command line.
+    context = multiprocessing.get_context("fork")
+    with context.Pool(jobs, initializer=init_worker) as pool:
+        for _ in pool.imap_unordered(functools.partial(_insert_patch, insert_patch), patches, chunksize=1):
+            pass
+
+
+def init_worker():
+    """
+    Open the DB connection of a worker process (See get_db_connection()).
+    """
+    global _workerDb
+    _workerDb = common.new_db_connection()
+
+
+def _insert_patch(insert_patch, tract_patch):
+    tract, patch = tract_patch
+    insert_patch(tract, patch)
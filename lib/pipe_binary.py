@@ -0,0 +1,198 @@
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+
+import numpy
+
+from . import misc
+
+_signature = b"PGCOPY\n\377\r\n\0" + struct.pack(">ii", 0, 0)
+_trailer = struct.pack(">h", -1)
+
+# Number of rows packed at a time
+_blockSize = 65536
+
+# Map from dtype names of the column data to the big-endian dtypes
+# of the SQL types in sourcetable.Field.dtypesToSQLType
+dtypesToBinary = {
+    'bool'   : "?",     # Boolean
+    'int8'   : ">i2",   # Smallint
+    'uint8'  : ">i2",   # Smallint
+    'int16'  : ">i2",   # Smallint
+    'uint16' : ">i4",   # Integer
+    'int32'  : ">i4",   # Integer
+    'uint32' : ">i8",   # Bigint
+    'int64'  : ">i8",   # Bigint
+    'uint64' : ">i8",   # Bigint (values must be < 2**63. See open())
+    'float16': ">f4",   # Real
+    'float32': ">f4",   # Real
+    'float64': ">f8",   # Double precision
+}
+
+# Header word of a cube that is a point (see contrib/cube/cubedata.h)
+_cubePointBit = 0x80000000
+
+
+def open(fields):
+    """
+    Get a file-like object from which to read
+    the binary COPY stream of the given fields.
+    @param fields
+        List of (printf_format, [column]), in the order of the table's columns.
+        'column' is a numpy.array.
+        If printf_format is like "(%.16e,%.16e,%.16e)", the columns are
+        the coordinates of a point of type cube (or earth).
+        Otherwise, printf_format must be for a scalar and [column] must be of length 1.
+    @return
+        File-like object
+    """
+    signature = []
+    columns = []
+    for fmt, cols in fields:
+        if _is_cube(fmt):
+            dim = fmt.count("%")
+            if dim != len(cols):
+                raise RuntimeError("Number of columns does not agree with format: " + fmt)
+            signature.append(("cube", dim))
+            columns.append([numpy.asarray(col) for col in cols])
+        else:
+            if len(cols) != 1:
+                raise RuntimeError("Only one column is allowed for format: " + fmt)
+            column = numpy.asarray(cols[0])
+            # uint64 is sent as Bigint, in which values >= 2**63 would wrap around.
+            if column.dtype.name == 'uint64' and len(column) and column.max() >= (1 << 63):
+                raise RuntimeError("uint64 value is out of the range of Bigint: {}".format(column.max()))
+            signature.append(("scalar", column.dtype.name))
+            columns.append(column)
+
+    return misc.ChunkReader(_generate_chunks(_get_row_layout(tuple(signature)), columns))
+
+
+def is_supported(connection, fields):
+    """
+    Check whether the server can receive the fields in the binary format.
+    @param connection
+        DB connection object
+    @param fields
+        List of (printf_format, [column]). See open().
+    """
+    if any(_is_cube(fmt) for fmt, cols in fields):
+        return _can_receive_cube(connection)
+    return True
+
+
+@misc.cached
+def _can_receive_cube(connection):
+    """
+    Check whether type cube has the binary input function (cube_recv()).
+    It is in the cube extension >= 1.5 (PostgreSQL >= 14), but a database
+    upgraded with pg_upgrade keeps the older version of the extension
+    until "ALTER EXTENSION cube UPDATE".
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        SELECT typreceive <> 0 FROM pg_type WHERE typname = 'cube'
+        """
+        )
+        row = cursor.fetchone()
+    return row is not None and row[0]
+
+
+def copy_command(tableName, fieldNames):
+    """
+    Get "COPY ... FROM STDIN" command with which to send the stream from open().
+    @param tableName
+        Table name, quoted if necessary.
+    @param fieldNames
+        List of field names.
+    """
+    columns = ",".join(fieldNames)
+    return "COPY {tableName} ({columns}) FROM STDIN WITH (FORMAT binary)".format(**locals())
+
+
+def _is_cube(fmt):
+    return fmt.startswith("(")
+
+
+@misc.cached
+def _get_row_layout(signature):
+    """
+    Get the layout of rows in the binary COPY format.
+    Layouts are made once for each list of column types,
+    which does not change from patch to patch.
+    @param signature (tuple)
+        Tuple of ("cube", dimension) or ("scalar", dtype name) of the fields.
+    @return (dtype, template)
+        * dtype: numpy.dtype of rows.
+        * template: numpy.array of a row, in which the field count,
+            the lengths of the fields, and the headers of cubes are set.
+            The values "val{i}" of the i-th fields are to be set.
+    """
+    dtype = [("count", ">i2")]
+    for i, (kind, param) in enumerate(signature):
+        if kind == "cube":
+            dtype += [("len{}".format(i), ">i4"), ("hdr{}".format(i), ">u4"), ("val{}".format(i), ">f8", (param,))]
+        else:
+            dtype += [("len{}".format(i), ">i4"), ("val{}".format(i), dtypesToBinary[param])]
+    dtype = numpy.dtype(dtype)
+
+    template = numpy.zeros(1, dtype=dtype)
+    template["count"] = len(signature)
+    for i, (kind, param) in enumerate(signature):
+        if kind == "cube":
+            template["len{}".format(i)] = 4 + 8*param
+            template["hdr{}".format(i)] = _cubePointBit | param
+        else:
+            template["len{}".format(i)] = numpy.dtype(dtypesToBinary[param]).itemsize
+
+    return dtype, template
+
+
+def _generate_chunks(layout, columns):
+    """
+    Generate binary COPY stream chunk by chunk.
+    Rows are not formatted one by one, but a block of rows is packed at once
+    into a numpy structured array whose memory layout is exactly that of tuples
+    in the binary COPY format.
+    @param layout
+        (dtype, template) returned by _get_row_layout().
+    @param columns
+        List of the columns of the fields: numpy.array for a scalar field,
+        and list of numpy.array for a cube field.
+    """
+    dtype, template = layout
+    values = ["val{}".format(i) for i in range(len(columns))]
+
+    nRows = min((len(col[0] if isinstance(col, list) else col) for col in columns), default=0)
+
+    yield _signature
+
+    # The block is reused, in which the lengths of fields, etc are set only once.
+    block = numpy.empty(min(nRows, _blockSize), dtype=dtype)
+    block[...] = template
+
+    for begin in range(0, nRows, _blockSize):
+        end = min(begin + _blockSize, nRows)
+        arr = block[:end - begin]
+        for value, col in zip(values, columns):
+            if isinstance(col, list):
+                for k, c in enumerate(col):
+                    arr[value][:, k] = c[begin:end]
+            else:
+                arr[value] = col[begin:end]
+        yield arr.tobytes()
+
+    yield _trailer
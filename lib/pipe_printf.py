@@ -13,13 +13,57 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
 import contextlib
 import io
+import multiprocessing
+import multiprocessing.resource_tracker
+import multiprocessing.shared_memory
 import os
 import sys
+import threading
+
+import numpy
+
+from . import misc
+
+# Number of rows that an encoder process formats at a time
+_blockSize = 65536
+
+# Pool of encoder processes (See open())
+_pool = None
+_poolSize = 0
 
 
 def open(format, *columns):
+    """
+    Get a file-like object from which to read rows "format % tpl"
+    for tpl in zip(*columns).
+
+    The rows are formatted by a long-lived pool of encoder processes,
+    to which the columns are passed through shared memory.
+    Each encoder formats a range of rows, and the formatted chunks
+    are read in order.
+    @param format (bytes)
+        printf format of a row.
+    @param columns
+        numpy.array's. If some of them are not numpy arrays of
+        fixed-size elements, or if the pool cannot be created in this process
+        or in this thread, the rows are formatted by a child process
+        forked for this call.
+    """
+    if _pool_is_usable(columns):
+        return misc.ChunkReader(_generate_chunks(format, columns))
+    else:
+        return open_forked(format, *columns)
+
+
+def open_forked(format, *columns):
+    """
+    Get a file-like object from which to read rows "format % tpl"
+    for tpl in zip(*columns). The rows are formatted by a child process
+    forked for this call.
+    """
     desc_in, desc_out = os.pipe()
     pid = os.fork()
     if pid == 0:
@@ -55,6 +99,113 @@ def __open_child(desc_out, format, *columns):
             fout.write(format % tpl)
 
 
+def start():
+    """
+    Create the pool of encoder processes in advance.
+
+    The encoders are forked, and a process forked while other threads
+    hold locks would inherit the locks held. This function must therefore
+    be called in the main thread before other threads start
+    (e.g. before lib.pipeline.run_pipeline()) if open() is to be called
+    in those threads.
+    """
+    if not multiprocessing.current_process().daemon:
+        _get_pool()
+
+
+def _pool_is_usable(columns):
+    """
+    Check whether the columns can be passed to the encoder pool.
+    """
+    if not columns:
+        return False
+    # Worker processes of multiprocessing.Pool cannot have children.
+    if multiprocessing.current_process().daemon:
+        return False
+    # The pool is created only in the main thread (See start()).
+    if _pool is None and threading.current_thread() is not threading.main_thread():
+        return False
+    return all(
+        isinstance(column, numpy.ndarray) and column.ndim == 1 and not column.dtype.hasobject
+        for column in columns
+    )
+
+
+def _get_pool():
+    """
+    Get the pool of encoder processes, creating it on first call.
+    """
+    global _pool, _poolSize
+    if _pool is None:
+        _poolSize = multiprocessing.cpu_count()
+        # The encoders must share the resource tracker of this process
+        # lest they should report the shared memory they attach to as leaked.
+        multiprocessing.resource_tracker.ensure_running()
+        # The encoders are forked before they receive any columns,
+        # so they share few pages with this process.
+        _pool = multiprocessing.get_context("fork").Pool(_poolSize)
+    return _pool
+
+
+def _generate_chunks(format, columns):
+    """
+    Generate formatted rows chunk by chunk, in order.
+    """
+    nRows = min(len(column) for column in columns)
+    columns = [numpy.ascontiguousarray(column[:nRows]) for column in columns]
+
+    layout = []
+    offset = 0
+    for column in columns:
+        layout.append((column.dtype.str, offset))
+        offset += column.nbytes
+
+    pool = _get_pool()
+    # At most this many ranges are being formatted or waiting to be read
+    # so that formatted rows do not pile up in memory.
+    nPending = 2 * _poolSize
+    pending = collections.deque()
+
+    shm = multiprocessing.shared_memory.SharedMemory(create=True, size=max(1, offset))
+    try:
+        for column, (dtype, offset) in zip(columns, layout):
+            numpy.ndarray(len(column), dtype=dtype, buffer=shm.buf, offset=offset)[:] = column
+
+        for begin in range(0, nRows, _blockSize):
+            end = min(begin + _blockSize, nRows)
+            pending.append(pool.apply_async(_encode, (shm.name, layout, format, nRows, begin, end)))
+            if len(pending) >= nPending:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        # Let encoders still reading the shared memory finish before unlinking it.
+        for result in pending:
+            result.wait()
+        shm.close()
+        shm.unlink()
+
+
+def _encode(name, layout, format, nRows, begin, end):
+    """
+    Format rows [begin, end) in an encoder process.
+    """
+    shm = multiprocessing.shared_memory.SharedMemory(name=name)
+    try:
+        columns = [
+            numpy.ndarray(nRows, dtype=dtype, buffer=shm.buf, offset=offset)[begin:end]
+            for dtype, offset in layout
+        ]
+        chunk = b"".join(format % tpl for tpl in zip(*columns))
+        # The views must be released before the shared memory is closed.
+        del columns
+    finally:
+        shm.close()
+
+    return chunk
+
+
 class PipeReadEnd(io.FileIO):
     def __init__(self, pid, desc):
         try:
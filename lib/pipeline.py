@@ -0,0 +1,170 @@
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import queue
+import sys
+import threading
+import time
+
+
+class _end:
+    """
+    Marker of the end of items in a queue.
+    """
+
+
+class Stage(object):
+    """
+    A stage in a pipeline. It runs in its own thread.
+    """
+    __slots__ = ["name", "func", "count", "busy", "waitIn", "waitOut"]
+
+    def __init__(self, name, func):
+        """
+        @param name (str)
+            Name of this stage, used in reports.
+        @param func
+            Function (item) -> item.
+            The return value is passed to the next stage.
+            If it is None, the item is dropped.
+        """
+        self.name    = name
+        self.func    = func
+        self.count   = 0
+        self.busy    = 0.0
+        self.waitIn  = 0.0
+        self.waitOut = 0.0
+
+
+def run_pipeline(items, stages, queueSize=1):
+    """
+    Pass items through stages.
+    Each stage runs in its own thread, and the stages are connected
+    by queues of at most queueSize items so that the number of items
+    in memory at a time is limited.
+
+    Threads are effective in overlapping stages only if the stages
+    release the GIL (in I/O, in decompression, in numpy, in DB calls, etc.)
+    @param items
+        Iterable of items to be passed to the first stage.
+    @param stages (list of Stage)
+    @param queueSize (int)
+        Maximum number of items waiting between two stages.
+    @return
+        The stages, on which statistics have been set.
+    """
+    queues = [queue.Queue(maxsize=queueSize) for i in range(len(stages) + 1)]
+    abort = threading.Event()
+    errors = []
+
+    def feed():
+        try:
+            for item in items:
+                if not _put(queues[0], item, abort):
+                    return
+            _put(queues[0], _end, abort)
+        except BaseException:
+            errors.append(sys.exc_info())
+            abort.set()
+
+    def work(stage, inQueue, outQueue):
+        try:
+            while True:
+                start = time.time()
+                item = _get(inQueue, abort)
+                stage.waitIn += time.time() - start
+                if item is _end or abort.is_set():
+                    break
+
+                start = time.time()
+                item = stage.func(item)
+                stage.busy += time.time() - start
+                stage.count += 1
+
+                if item is None:
+                    continue
+
+                start = time.time()
+                if not _put(outQueue, item, abort):
+                    return
+                stage.waitOut += time.time() - start
+
+            _put(outQueue, _end, abort)
+        except BaseException:
+            errors.append(sys.exc_info())
+            abort.set()
+
+    threads = [threading.Thread(target=feed, name="pipeline:feed", daemon=True)]
+    threads += [
+        threading.Thread(target=work, args=(stage, queues[i], queues[i+1]), name="pipeline:" + stage.name, daemon=True)
+        for i, stage in enumerate(stages)
+    ]
+
+    # The last queue is drained here.
+    threads.append(threading.Thread(target=_drain, args=(queues[-1], abort), daemon=True))
+
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    if errors:
+        excType, excValue, excTraceback = errors[0]
+        raise excValue.with_traceback(excTraceback)
+
+    report(stages, elapsed)
+    return stages
+
+
+def report(stages, elapsed):
+    """
+    Print utilization of stages.
+    The stage whose utilization is the highest is the bottleneck.
+    @param stages (list of Stage)
+    @param elapsed (float)
+        Wall-clock time of the whole pipeline in seconds.
+    """
+    elapsed = max(elapsed, 1e-9)
+    print("pipeline: {:.3f} sec".format(elapsed))
+    for stage in stages:
+        print("  stage {}: {} items, busy {:.3f} sec ({:.0%}), waiting for input {:.3f} sec, waiting for output {:.3f} sec".format(
+            stage.name, stage.count, stage.busy, stage.busy / elapsed, stage.waitIn, stage.waitOut
+        ))
+
+
+def _put(outQueue, item, abort):
+    while not abort.is_set():
+        try:
+            outQueue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(inQueue, abort):
+    while not abort.is_set():
+        try:
+            return inQueue.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _end
+
+
+def _drain(inQueue, abort):
+    while _get(inQueue, abort) is not _end:
+        pass
@@ -15,6 +15,7 @@
 
 import importlib
 
+from .algobase import PrefixDispatcher
 from .misc import PoppingOrderedDict
 
 def _import_algo(name):
@@ -44,3 +45,5 @@ random_algos_ignored = [
     "footprint",
     "base_PeakCentroid_",
 ]
+
+random_dispatcher = PrefixDispatcher(random_algos, random_algos_ignored)
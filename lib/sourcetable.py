@@ -15,10 +15,11 @@
 
 import re
 import collections
+import itertools
 
 import numpy
 
-from .misc import PoppingOrderedDict
+from .misc import PoppingOrderedDict, stage_time
 from . import config
 
 class SourceTable(object):
@@ -32,9 +33,9 @@ class SourceTable(object):
     SourceTable can be abandoned --- It was originally designed to hold
     ("fields", "slots","fitsheader"), but only "fields" is used currently.
     """
-    __slots__ = ["fields", "slots", "fitsheader"]
+    __slots__ = ["fields", "slots", "fitsheader", "unread"]
 
-    def __init__(self, fields, slots, fitsheader):
+    def __init__(self, fields, slots, fitsheader, unread=()):
         """
         @param fields (PoppingOrderedDict)
             Map from name: str -> field: Field
@@ -42,16 +43,21 @@ class SourceTable(object):
             Map from alias: str -> algorithm_name: str
         @param fitsheader
             Fits header.
+        @param unread (tuple of str)
+            Names of the fields in the file that were not read
+            because of "prefixes" of from_hdu().
         """
         self.fields = fields
         self.slots  = slots
         self.fitsheader = fitsheader
+        self.unread = unread
 
     def cutout_subtable(self, prefix):
         """
         Cut out a subtable. Fiels that are cut are removed from the self.
-        @param prefix (str)
-            Fields whose keys start from this prefix will be cut out.
+        @param prefix (str or tuple of str)
+            Fields whose keys start from this prefix
+            (or any of these prefixes) will be cut out.
         @return (SourceTable)
         """
         included = PoppingOrderedDict()
@@ -66,52 +72,167 @@ class SourceTable(object):
         self.fields = excluded
         return SourceTable(included, self.slots, self.fitsheader)
 
+    def get_aliases(self):
+        """
+        Get the aliases, other than slots, declared in the fits header.
+        @return (dict)
+            Map from reference: str -> referend: str
+        """
+        if self.fitsheader is None:
+            return {}
+        return _get_aliases(self.fitsheader)
+
     def dm_schema_version(self):
         if 'AFW_TABLE_VERSION' in self.fitsheader:
             return self.fitsheader['AFW_TABLE_VERSION']
         return None
 
     @staticmethod
-    def from_hdu(hdu):
+    @stage_time("from_hdu")
+    def from_hdu(hdu, prefixes=None):
         """
         Read Fits HDU to return an instance of SourceTable.
+        @param hdu
+            HDU of the binary table.
+        @param prefixes (list of str)
+            If given, only fields whose names start with any of these
+            prefixes are read. The data of the other fields are not touched,
+            and their names are kept in "unread" of the returned table.
         """
         header = hdu.header
         data   = hdu.data
 
-        fields = PoppingOrderedDict()
+        plan = _get_read_plan(header, prefixes)
 
-        iFlag = header.get("FLAGCOL", None)
+        fields = PoppingOrderedDict()
 
-        for i in range(1, 1+header["TFIELDS"]):
-            if i != iFlag:
-                name   = header.get("TTYPE{}".format(i), "")
-                type   = header.get("TCCLS{}".format(i), "")
-                unit   = header.get("TUNIT{}".format(i), "")
-                doc    = header.get("TDOC{}" .format(i), "")
-                fields[name] = Field(name, type, unit, data[name], to_safe_doc(doc))
-                #if 'ConvolvedFlux_seeing' in str(name):
-                #    print('Found name ', str(name))
+        for name, type, unit, doc in plan.columns:
+            fields[name] = Field(name, type, unit, data[name], doc)
 
-        if iFlag is not None:
+        if plan.flags:
             data = data["flags"]
-            nFlags = int(re.match(r'^([0-9]+)X$', header["TFORM{}".format(iFlag)]).group(1))
-            for i in range(1, 1+nFlags):
-                name = header.get("TFLAG{}".format(i), "")
+        for i, name, doc in plan.flags:
+            fields[name] = Field(name, "Scalar", "", data[:,i-1], doc)
+
+        for reference, referend in plan.aliases:
+            fields[reference] = fields[referend]._replace(name=reference)
+
+        return SourceTable(fields, dict(plan.slots), header, plan.unread)
+
+
+_ReadPlan = collections.namedtuple("_ReadPlan", ["columns", "flags", "aliases", "slots", "unread"])
+
+# Map from (fingerprint, prefixes) -> _ReadPlan
+_readPlans = {}
+
+
+def _get_read_plan(header, prefixes):
+    """
+    Get the plan for SourceTable.from_hdu() to read a binary table.
+    Plans are made once for each fingerprint of headers
+    (See fits.get_schema_fingerprint()) and are reused for other patches.
+    @param header
+        Header of the binary table.
+    @param prefixes (list of str)
+        See SourceTable.from_hdu().
+    @return (_ReadPlan)
+        * columns: list of (name, type, unit, doc) of columns to read.
+        * flags: list of (index (1-based), name, doc) of bits in the flag column to read.
+        * aliases: list of (reference, referend) of aliases to resolve.
+        * slots: map from slot name -> algorithm name.
+        * unread: tuple of names of columns, flags and aliases not to read.
+    """
+    if prefixes is not None:
+        prefixes = tuple(prefixes)
+
+    fingerprint = getattr(header, "fingerprint", None)
+    if fingerprint is None:
+        return _make_read_plan(header, prefixes)
+
+    key = (fingerprint, prefixes)
+    plan = _readPlans.get(key)
+    if plan is None:
+        plan = _readPlans[key] = _make_read_plan(header, prefixes)
+    return plan
+
+
+def _make_read_plan(header, prefixes):
+    aliases = [
+        value.split(':') for key, value in header.items() if key == "ALIAS"
+    ]
+
+    if prefixes is None:
+        wanted = lambda name: True
+    else:
+        # Referends of wanted aliases must also be read.
+        referends = set(
+            referend for reference, referend in aliases if reference.startswith(prefixes)
+        )
+        wanted = lambda name: name.startswith(prefixes) or name in referends
+
+    columns = []
+    unread = []
+
+    iFlag = header.get("FLAGCOL", None)
+
+    for i in range(1, 1+header["TFIELDS"]):
+        if i != iFlag:
+            name   = header.get("TTYPE{}".format(i), "")
+            if not wanted(name):
+                unread.append(name)
+                continue
+            type   = header.get("TCCLS{}".format(i), "")
+            unit   = header.get("TUNIT{}".format(i), "")
+            doc    = header.get("TDOC{}" .format(i), "")
+            columns.append((name, type, unit, to_safe_doc(doc)))
+
+    flags = []
+
+    if iFlag is not None:
+        nFlags = int(re.match(r'^([0-9]+)X$', header["TFORM{}".format(iFlag)]).group(1))
+        for i in range(1, 1+nFlags):
+            name = header.get("TFLAG{}".format(i), "")
+            if wanted(name):
                 doc  = header.get("TFDOC{}".format(i), "")
-                fields[name] = Field(name, "Scalar", "", data[:,i-1], to_safe_doc(doc))
+                flags.append((i, name, to_safe_doc(doc)))
+            else:
+                unread.append(name)
 
-        slots = {}
+    slots = {}
+    wantedAliases = []
 
-        for key, value in header.items():
-            if key == "ALIAS":
-                reference, referend = value.split(':')
-                if reference.startswith("slot_"):
-                    slots[reference[len("slot_"):]] = referend
-                else:
-                    fields[reference] = fields[referend]._replace(name=reference)
+    for reference, referend in aliases:
+        if reference.startswith("slot_"):
+            slots[reference[len("slot_"):]] = referend
+        elif wanted(reference):
+            wantedAliases.append((reference, referend))
+        else:
+            unread.append(reference)
+
+    return _ReadPlan(columns, flags, wantedAliases, slots, tuple(unread))
 
-        return SourceTable(fields, slots, header)
+
+# Map from fingerprint -> aliases (See _get_aliases())
+_aliases = {}
+
+
+def _get_aliases(header):
+    """
+    Get the aliases, other than slots, declared in a header.
+    They are got once for each fingerprint of headers.
+    @return (dict)
+        Map from reference: str -> referend: str
+    """
+    fingerprint = getattr(header, "fingerprint", None)
+    aliases = _aliases.get(fingerprint) if fingerprint is not None else None
+    if aliases is None:
+        aliases = dict(
+            value.split(':') for key, value in header.items()
+            if key == "ALIAS" and not value.startswith("slot_")
+        )
+        if fingerprint is not None:
+            _aliases[fingerprint] = aliases
+    return aliases
 
 
 class Field(collections.namedtuple("Field_",
@@ -219,7 +340,7 @@ class Field(collections.namedtuple("Field_",
         For example, if the data is [ [1,2], [3,4] ],
         the returned value will be [ iter([1,3]), iter([2,4]) ].
         """
-        if config.MULTICORE:
+        if config.MULTICORE or config.copyFormat == "binary":
             if len(self.data.shape) <= 1:
                 return [ self.data ]
             else:
@@ -0,0 +1,446 @@
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import os
+
+import numpy
+
+from . import common
+from . import fits
+from . import libwcs
+
+# Pixels per side of a patch, and of the overlap between patches
+patchSize = 4000
+patchBorder = 100
+
+# Number of patches per side of a tract
+patchesPerTract = 9
+
+
+# Columns of compound types (TCCLS) added to some algorithms,
+# in addition to the scalar fields that the algorithms describe.
+# Map from prefix -> list of (suffix, format, type, unit)
+compoundColumns = {
+    "base_SdssCentroid_": [
+        ("positionCov", "3E", "Covariance(Point)", "pixel^2"),
+    ],
+    "base_TransformedCentroid_": [
+        ("position", "2D", "Point", "pixel"),
+    ],
+    "base_TransformedShape_": [
+        ("moments", "3D", "Moments", "pixel^2"),
+        ("momentsCov", "6E", "Covariance(Moments)", "pixel^4"),
+    ],
+    "modelfit_DoubleShapeletPsfApprox_": [
+        ("0_coefficients", "6E", "Array", ""),
+    ],
+}
+
+
+class Column(collections.namedtuple("Column_",
+    ["name", "format", "type", "unit", "doc"]
+)):
+    """
+    A column of a synthetic catalog. This is a tuple of:
+      * name: Name of this column (TTYPE)
+      * format: FITS format (TFORM) like "D" or "3E"
+      * type: afw's type (TCCLS) like "Scalar", "Point", "Moments"
+      * unit: Unit of the values (TUNIT)
+      * doc : Document text (TDOC)
+    """
+    __slots__ = []
+
+
+class Schema(object):
+    """
+    Schema of a synthetic catalog: columns, flags and aliases
+    as afw writes them in a FITS binary table.
+    """
+    __slots__ = ["columns", "flags", "aliases"]
+
+    def __init__(self):
+        self.columns = collections.OrderedDict()
+        self.flags   = collections.OrderedDict()
+        self.aliases = []
+
+    def add_column(self, name, format, type="Scalar", unit="", doc=""):
+        """
+        Add a column unless it exists.
+        """
+        if name not in self.columns and name not in self.flags:
+            self.columns[name] = Column(name, format, type, unit, doc or name)
+
+    def add_flag(self, name, doc=""):
+        """
+        Add a flag bit, which is stored in the FLAGCOL column, unless it exists.
+        """
+        if name not in self.columns and name not in self.flags:
+            self.flags[name] = doc or name
+
+
+def get_schema(algoclasses, ignored=[], filters=[]):
+    """
+    Get the schema of a catalog that the given algorithms take.
+    Columns are derived from the algorithms' "sourceprefixes"
+    and their descriptions of fluxes, positions, shapes, etc.
+    @param algoclasses (iterable of class)
+        Subclasses of Algo (values of ref_algos, forced_algos, meas_algos, ...)
+    @param ignored (list of str)
+        Prefixes that loaders ignore. A column is added for each of them
+        so that the loaders will have something to ignore.
+    @param filters (list of str)
+        Filter names, used in the names of "merge_*" flags.
+    @return (Schema)
+    """
+    schema = Schema()
+    schema.add_column("id", "K", doc="unique id")
+
+    for algoclass in algoclasses:
+        prefixes = tuple(algoclass.sourceprefixes)
+        add_algo_columns(schema, algoclass, prefixes, filters)
+
+    for prefix in ignored:
+        if prefix.endswith("_"):
+            schema.add_column(prefix + "value", "E")
+        else:
+            _add_named_column(schema, prefix)
+
+    for slot, algo in [
+        ("Centroid", "base_SdssCentroid"),
+        ("Shape"   , "base_SdssShape"),
+        ("PsfFlux" , "base_PsfFlux"),
+        ("ModelFlux", "modelfit_CModel"),
+    ]:
+        if any(name.startswith(algo + "_") for name in schema.columns):
+            schema.aliases.append("slot_{}:{}".format(slot, algo))
+
+    # Aliases other than slots, which --dedupe-aliases links to their referends.
+    # afw lets measurements that take the centroid slot have "*_flag_badCentroid"
+    # that refers to the flag of the centroid.
+    centroidFlag = "base_SdssCentroid_flag"
+    if centroidFlag in schema.flags:
+        for algo in ["base_PsfFlux", "base_SdssShape", "base_GaussianFlux", "modelfit_CModel"]:
+            reference = algo + "_flag_badCentroid"
+            if algo + "_flag" in schema.flags and reference not in schema.flags and reference not in schema.columns:
+                schema.aliases.append("{}:{}".format(reference, centroidFlag))
+
+    return schema
+
+
+def add_algo_columns(schema, algoclass, prefixes, filters):
+    """
+    Add the columns that an algorithm takes.
+    Every field that the algorithm's descriptions refer to is a scalar column,
+    as afw (AFW_TABLE_VERSION >= 2) writes it.
+    """
+    def add(name, format, unit=""):
+        if name.startswith(prefixes):
+            schema.add_column(name, format, unit=unit)
+
+    for prefix in prefixes:
+        if not prefix.endswith("_"):
+            # "prefixes" of a special algorithm are whole names of fields
+            _add_named_column(schema, prefix)
+
+    for descs, keys, format, unit in [
+        (algoclass.positions     , ["x", "y"]                 , "D", "pixel"),
+        (algoclass.positionerrs  , ["xx", "xy", "yy"]         , "E", "pixel^2"),
+        (algoclass.positionsigmas, ["xsigma", "ysigma"]       , "E", "pixel"),
+        (algoclass.fluxes        , ["flux"]                   , "D", "count"),
+        (algoclass.fluxerrs      , ["flux", "fluxerr"]        , "D", "count"),
+        (algoclass.sizes         , ["size"]                   , "E", "pixel"),
+        (algoclass.shapes        , ["xx", "yy", "xy"]         , "D", "pixel^2"),
+        (algoclass.shapeerrs     , ["xx_xx", "xx_yy", "yy_yy", "xx_xy", "yy_xy", "xy_xy"], "E", "pixel^4"),
+        (algoclass.shapesigmas   , ["xxsigma", "yysigma", "xysigma"], "E", "pixel^2"),
+        (algoclass.ellipticities , ["e1", "e2"]               , "E", ""),
+    ]:
+        for desc in descs:
+            for key in keys:
+                add(desc[key], format, unit)
+
+    for prefix in prefixes:
+        for suffix, format, type, unit in compoundColumns.get(prefix, []):
+            schema.add_column(prefix + suffix, format, type=type, unit=unit)
+
+    for prefix in prefixes:
+        if not prefix.endswith("_"):
+            continue
+
+        if prefix == "base_PixelFlags_":
+            for name in ["edge", "bad", "interpolated", "saturated", "cr", "suspect"]:
+                schema.add_flag(prefix + "flag_" + name)
+                if name != "edge":
+                    schema.add_flag(prefix + "flag_" + name + "Center")
+        elif prefix == "detect_":
+            for name in ["isPrimary", "isPatchInner", "isTractInner"]:
+                schema.add_flag(prefix + name)
+        elif prefix == "merge_":
+            for filter in filters:
+                schema.add_flag("merge_footprint_" + filter)
+                schema.add_flag("merge_peak_" + filter)
+        elif prefix == "calib_":
+            for name in ["psf_candidate", "psf_used", "astrometry_used", "photometry_used"]:
+                schema.add_flag(prefix + name)
+        elif prefix == "deblend_":
+            schema.add_flag(prefix + "skipped")
+            schema.add_column(prefix + "nChild", "J")
+        elif not any(name.startswith(prefix) for name in schema.columns):
+            schema.add_column(prefix + "value", "E")
+
+        if prefix not in ["detect_", "merge_", "calib_"]:
+            schema.add_flag(prefix + "flag")
+
+
+def _add_named_column(schema, name):
+    """
+    Add a column whose name is listed as a whole in "sourceprefixes".
+    """
+    if name in ["coord_ra", "coord_dec"]:
+        schema.add_column(name, "D", type="Angle", unit="rad")
+    elif name in ["parent"]:
+        schema.add_column(name, "K")
+    elif name in ["deblend_nChild", "footprint"]:
+        schema.add_column(name, "J")
+    elif name.startswith(("detect_is", "deblend_", "calib_")):
+        schema.add_flag(name)
+    else:
+        schema.add_column(name, "D")
+
+
+def get_object_id(tract, patch, nRows):
+    """
+    Get object IDs of a patch, of which the skymap_id in the DB
+    (public.skymap_from_object_id()) will be (tract, patch).
+    @param tract
+        Tract number.
+    @param patch
+        Patch number (x*100 + y)
+    @param nRows
+        Number of objects.
+    """
+    x, y = patch // 100, patch % 100
+    return (numpy.int64(tract) << 42) + (numpy.int64(x) << 37) + (numpy.int64(y) << 32) + numpy.arange(nRows, dtype=numpy.int64)
+
+
+def get_tract_center(tract):
+    """
+    Get the (ra, dec) in degrees of the center of a synthetic tract.
+    """
+    ra  = (tract * 1.7) % 360.0
+    dec = ((tract * 0.37) % 120.0) - 60.0
+    return ra, dec
+
+
+def get_tract_wcs_cards(tract):
+    """
+    Get WCS cards of a synthetic tract
+    that lib.libwcs.Wcs can read.
+    """
+    ra, dec = get_tract_center(tract)
+    scale = common.defaultPixelScale / 3600.0
+    center = patchesPerTract * patchSize / 2.0
+    return [
+        ("CTYPE1" , "RA---TAN"),
+        ("CTYPE2" , "DEC--TAN"),
+        ("CRPIX1" , center),
+        ("CRPIX2" , center),
+        ("CRVAL1" , ra),
+        ("CRVAL2" , dec),
+        ("CD1_1"  , -scale),
+        ("CD1_2"  , 0.0),
+        ("CD2_1"  , 0.0),
+        ("CD2_2"  , scale),
+        ("CRPIX1A", 1.0),
+        ("CRPIX2A", 1.0),
+        ("CRVAL1A", 0.0),
+        ("CRVAL2A", 0.0),
+    ]
+
+
+def get_patch_coord(tract, patch, nRows, random):
+    """
+    Get random positions in a patch.
+    @return (x, y, ra, dec)
+        Pixel coordinates in the tract and sky coordinates in radians.
+    """
+    px, py = patch // 100, patch % 100
+    x = px * patchSize - patchBorder + random.uniform(0, patchSize + 2*patchBorder, nRows)
+    y = py * patchSize - patchBorder + random.uniform(0, patchSize + 2*patchBorder, nRows)
+
+    wcs = libwcs.Wcs(dict(get_tract_wcs_cards(tract)))
+    ra, dec = wcs.pixeltosky(x, y, outIsDegree=False)
+    return x, y, ra, dec
+
+
+def generate_data(schema, object_id, coord, random):
+    """
+    Generate values of a catalog.
+    @param schema (Schema)
+    @param object_id (numpy.array)
+    @param coord
+        (x, y, ra, dec) returned by get_patch_coord().
+    @param random (numpy.random.RandomState)
+    @return
+        Big-endian numpy structured array of rows
+        in which "flags" column holds packed flag bits.
+    """
+    nRows = len(object_id)
+    x, y, ra, dec = coord
+
+    dtype = []
+    for column in schema.columns.values():
+        repeat, code = _split_format(column.format)
+        if repeat == 1:
+            dtype.append((column.name, fits._tformToDtype[code]))
+        else:
+            dtype.append((column.name, fits._tformToDtype[code], (repeat,)))
+    if schema.flags:
+        dtype.append(("flags", "u1", ((len(schema.flags) + 7)//8,)))
+
+    data = numpy.zeros(nRows, dtype=dtype)
+
+    for column in schema.columns.values():
+        name = column.name
+        repeat, code = _split_format(column.format)
+        shape = (nRows,) if repeat == 1 else (nRows, repeat)
+
+        if name == "id":
+            values = object_id
+        elif name == "parent":
+            values = numpy.where(random.uniform(size=nRows) < 0.8, 0, object_id - random.randint(1, 10, nRows))
+        elif name == "coord_ra":
+            values = ra
+        elif name == "coord_dec":
+            values = dec
+        elif name.endswith("_x"):
+            values = x + random.normal(0, 0.1, nRows)
+        elif name.endswith("_y"):
+            values = y + random.normal(0, 0.1, nRows)
+        elif code in "BIJK":
+            values = random.randint(0, 10, shape)
+        elif name.endswith(("Sigma", "_xx", "_yy", "_xx_xx", "_yy_yy", "_xy_xy", "_radius", "_seeing")):
+            values = numpy.abs(random.normal(3.0, 1.0, shape))
+        elif name.endswith("_flux"):
+            values = random.lognormal(7.0, 1.5, shape)
+        else:
+            values = random.normal(0.0, 1.0, shape)
+
+        if code in "ED" and name not in ("coord_ra", "coord_dec"):
+            values = numpy.where(random.uniform(size=shape) < 0.02, numpy.nan, values)
+
+        data[name] = values
+
+    if schema.flags:
+        bits = numpy.empty((nRows, len(schema.flags)), dtype=bool)
+        for i, name in enumerate(schema.flags):
+            probability = 0.8 if name.startswith("detect_is") else 0.05
+            bits[:, i] = random.uniform(size=nRows) < probability
+        data["flags"] = numpy.packbits(bits, axis=-1)
+
+    return data
+
+
+def get_table_cards(schema, nRows):
+    """
+    Get the header cards of a binary table of a catalog.
+    """
+    columns = list(schema.columns.values())
+    rowSize = sum(
+        _split_format(column.format)[0] * numpy.dtype(fits._tformToDtype[_split_format(column.format)[1]]).itemsize
+        for column in columns
+    )
+    if schema.flags:
+        rowSize += (len(schema.flags) + 7)//8
+
+    nFields = len(columns) + (1 if schema.flags else 0)
+
+    cards = [
+        ("XTENSION", "BINTABLE"),
+        ("BITPIX"  , 8),
+        ("NAXIS"   , 2),
+        ("NAXIS1"  , rowSize),
+        ("NAXIS2"  , nRows),
+        ("PCOUNT"  , 0),
+        ("GCOUNT"  , 1),
+        ("TFIELDS" , nFields),
+    ]
+
+    for i, column in enumerate(columns, start=1):
+        cards += [
+            ("TTYPE{}".format(i), column.name),
+            ("TFORM{}".format(i), column.format),
+            ("TCCLS{}".format(i), column.type),
+        ]
+        if column.unit:
+            cards.append(("TUNIT{}".format(i), column.unit))
+        cards.append(("TDOC{}".format(i), column.doc))
+
+    if schema.flags:
+        iFlag = len(columns) + 1
+        cards += [
+            ("TTYPE{}".format(iFlag), "flags"),
+            ("TFORM{}".format(iFlag), "{}X".format(len(schema.flags))),
+            ("FLAGCOL", iFlag),
+        ]
+        for i, (name, doc) in enumerate(schema.flags.items(), start=1):
+            cards += [
+                ("TFLAG{}".format(i), name),
+                ("TFDOC{}".format(i), doc),
+            ]
+
+    for alias in schema.aliases:
+        cards.append(("ALIAS", alias))
+
+    cards.append(("AFW_TABLE_VERSION", 2))
+    return cards
+
+
+def write_catalog(path, schema, data, compress=False):
+    """
+    Write a catalog as afw writes it.
+    @param path
+        Path to the file. ".gz" is added if compress is True.
+    @param schema (Schema)
+    @param data
+        Array returned by generate_data().
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fits.fits_write(path, [(get_table_cards(schema, len(data)), data.tobytes())], compress=compress)
+
+
+def write_wcs(path, tract):
+    """
+    Write a "skymap_wcs-*.fits" file, whose 2nd HDU is an empty image
+    with the WCS of a synthetic tract.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    cards = [
+        ("XTENSION", "IMAGE"),
+        ("BITPIX"  , 32),
+        ("NAXIS"   , 2),
+        ("NAXIS1"  , 0),
+        ("NAXIS2"  , 0),
+        ("PCOUNT"  , 0),
+        ("GCOUNT"  , 1),
+    ] + get_tract_wcs_cards(tract)
+    fits.fits_write(path, [(cards, b"")])
+
+
+def _split_format(format):
+    """
+    Split a FITS format like "3E" into (3, "E").
+    """
+    return int(format[:-1] or 1), format[-1]
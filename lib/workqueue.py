@@ -0,0 +1,421 @@
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Queue of patches in the DB, from which loaders on any number of hosts
+take patches to insert (--queue).
+
+Each loader has the queue "_temp:{loader}_job" with one row per (tract, patch).
+A worker claims a pending patch with "FOR UPDATE SKIP LOCKED",
+so that workers never wait for each other nor take the same patch.
+While inserting the patch, the worker updates the heartbeat of the job;
+a job whose heartbeat has stopped for config.queueStaleSeconds
+is claimed again by another worker, or marked failed
+if it has been tried config.queueMaxAttempts times.
+
+A patch inserted by a worker that dies before marking the job done
+is not inserted twice when the job is claimed again,
+because the registry of inserted patches ("_temp:{loader}_patch") is
+updated in the same transaction as the patch is inserted.
+"""
+
+import contextlib
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+
+from . import common
+from . import config
+from . import misc
+from . import patchpool
+
+
+def create_queue_if_not_exists(cursor, schemaName, loaderName):
+    """
+    Create the queue of patches.
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param loaderName
+        "forced", "meas", etc. The queue is "_temp:{loaderName}_job".
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS "{schemaName}"."_temp:{loaderName}_job" (
+        tract       Integer     NOT NULL,
+        patch       Integer     NOT NULL,
+        status      Text        NOT NULL DEFAULT 'pending',
+        owner       Text,
+        attempts    Integer     NOT NULL DEFAULT 0,
+        claimed     Timestamptz,
+        heartbeat   Timestamptz,
+        finished    Timestamptz,
+        seconds     Double precision,
+        error       Text,
+        PRIMARY KEY (tract, patch)
+    )
+    """.format(**locals())
+    )
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS "_temp:{loaderName}_job_status_idx"
+        ON "{schemaName}"."_temp:{loaderName}_job" (status)
+    """.format(**locals())
+    )
+
+
+@contextlib.contextmanager
+def exclusive(schemaName, loaderName, enabled=True):
+    """
+    Context manager that excludes other loaders using the same queue.
+    Tables are created and patches are enqueued in this context
+    lest loaders started at the same time should race to do so.
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param loaderName
+        "forced", "meas", etc.
+    @param enabled
+        If False, nothing is excluded.
+    """
+    if not enabled:
+        yield
+        return
+
+    db = common.new_db_connection()
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(hashtext(%s))",
+                ('"{schemaName}"."_temp:{loaderName}_job"'.format(**locals()),))
+        db.commit()
+        yield
+    finally:
+        db.close()
+
+
+def enqueue(schemaName, loaderName, patches, reset=[]):
+    """
+    Add patches to the queue. Patches already in the queue are kept as they are.
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param loaderName
+        "forced", "meas", etc.
+    @param patches
+        List of (tract, patch)
+    @param reset
+        List of (tract, patch) to be inserted again even if they are done
+        (e.g. patches deleted by --sync).
+    """
+    db = common.new_db_connection()
+    with db.cursor() as cursor:
+        create_queue_if_not_exists(cursor, schemaName, loaderName)
+        cursor.executemany("""
+        INSERT INTO "{schemaName}"."_temp:{loaderName}_job" (tract, patch) VALUES (%s, %s)
+        ON CONFLICT (tract, patch) DO NOTHING
+        """.format(**locals()), patches
+        )
+        cursor.executemany("""
+        UPDATE "{schemaName}"."_temp:{loaderName}_job"
+        SET status = 'pending', owner = NULL, attempts = 0, error = NULL
+        WHERE tract = %s AND patch = %s
+        """.format(**locals()), reset
+        )
+    db.commit()
+    db.close()
+
+
+def claim(cursor, schemaName, loaderName, owner):
+    """
+    Claim a pending patch, or a patch whose worker seems to have died.
+    @param cursor
+        DB connection's cursor object. The caller must commit.
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param loaderName
+        "forced", "meas", etc.
+    @param owner
+        Name of the worker.
+    @return
+        (tract, patch), or None if no patch is left.
+    """
+    staleSeconds = config.queueStaleSeconds
+    maxAttempts = config.queueMaxAttempts
+
+    # A job whose worker has died at its last attempt is given up,
+    # lest it should remain 'running' forever.
+    cursor.execute("""
+    UPDATE "{schemaName}"."_temp:{loaderName}_job"
+    SET status = 'failed', finished = now(),
+        error = 'Worker ' || owner || ' stopped updating the heartbeat'
+    WHERE status = 'running' AND heartbeat < now() - %(staleSeconds)s * interval '1 second'
+        AND attempts >= %(maxAttempts)s
+    """.format(**locals()), dict(staleSeconds=staleSeconds, maxAttempts=maxAttempts)
+    )
+
+    cursor.execute("""
+    UPDATE "{schemaName}"."_temp:{loaderName}_job" AS job
+    SET status = 'running', owner = %(owner)s, attempts = job.attempts + 1,
+        claimed = now(), heartbeat = now(), finished = NULL, error = NULL
+    FROM (
+        SELECT tract, patch FROM "{schemaName}"."_temp:{loaderName}_job"
+        WHERE (status = 'pending'
+            OR (status = 'running' AND heartbeat < now() - %(staleSeconds)s * interval '1 second'))
+            AND attempts < %(maxAttempts)s
+        ORDER BY tract, patch
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    ) AS next
+    WHERE job.tract = next.tract AND job.patch = next.patch
+    RETURNING job.tract, job.patch
+    """.format(**locals()), dict(owner=owner, staleSeconds=staleSeconds, maxAttempts=maxAttempts)
+    )
+    return cursor.fetchone()
+
+
+def heartbeat(cursor, schemaName, loaderName, owner, tract, patch):
+    """
+    Tell other workers that the worker claiming (tract, patch) is alive.
+    @param cursor
+        DB connection's cursor object. The caller must commit.
+    @return
+        False if the job has been claimed by another worker.
+    """
+    cursor.execute("""
+    UPDATE "{schemaName}"."_temp:{loaderName}_job" SET heartbeat = now()
+    WHERE tract = %(tract)s AND patch = %(patch)s AND owner = %(owner)s AND status = 'running'
+    """.format(**locals()), dict(owner=owner, tract=tract, patch=patch)
+    )
+    return cursor.rowcount > 0
+
+
+def complete(cursor, schemaName, loaderName, owner, tract, patch, seconds, error=None):
+    """
+    Mark a job done, or failed if error is given.
+    A failed job returns to the queue unless it has been tried config.queueMaxAttempts times.
+    @param cursor
+        DB connection's cursor object. The caller must commit.
+    @param seconds
+        Time spent in inserting the patch.
+    @param error
+        Error message, or None.
+    """
+    maxAttempts = config.queueMaxAttempts
+
+    cursor.execute("""
+    UPDATE "{schemaName}"."_temp:{loaderName}_job"
+    SET status = (CASE
+            WHEN %(error)s IS NULL THEN 'done'
+            WHEN attempts < %(maxAttempts)s THEN 'pending'
+            ELSE 'failed' END),
+        finished = now(), seconds = %(seconds)s, error = %(error)s
+    WHERE tract = %(tract)s AND patch = %(patch)s AND owner = %(owner)s
+    """.format(**locals()), dict(owner=owner, tract=tract, patch=patch, seconds=seconds, error=error, maxAttempts=maxAttempts)
+    )
+
+
+def insert_patches(insert_patch, schemaName, loaderName, jobs=1):
+    """
+    Call insert_patch(tract, patch) for every patch claimed from the queue
+    until no patch is left.
+    @param insert_patch
+        Function that inserts a patch into the DB (See patchpool.insert_patches()).
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param loaderName
+        "forced", "meas", etc.
+    @param jobs
+        Number of worker processes in this host.
+    """
+    if jobs <= 1:
+        patchpool.init_worker()
+        nFailed = _work(insert_patch, schemaName, loaderName)
+    else:
+        # The workers are forked so that they inherit lib.config
+        # that has been set according to the command line.
+        context = multiprocessing.get_context("fork")
+        with context.Pool(jobs, initializer=patchpool.init_worker) as pool:
+            results = [pool.apply_async(_work, (insert_patch, schemaName, loaderName)) for i in range(jobs)]
+            nFailed = sum(result.get() for result in results)
+
+    db = common.new_db_connection()
+    with db.cursor() as cursor:
+        report(cursor, schemaName, loaderName)
+    db.close()
+
+    if nFailed:
+        raise RuntimeError("{} patches have failed to be inserted in this host".format(nFailed))
+
+
+def _work(insert_patch, schemaName, loaderName):
+    """
+    Insert patches claimed from the queue until no patch is left.
+    @return
+        Number of patches that have failed.
+    """
+    owner = "{}:{}".format(socket.gethostname(), os.getpid())
+    db = common.new_db_connection()
+    nFailed = 0
+
+    while True:
+        with db.cursor() as cursor:
+            job = claim(cursor, schemaName, loaderName, owner)
+        db.commit()
+        if job is None:
+            break
+
+        tract, patch = job
+        stop = threading.Event()
+        lost = threading.Event()
+        beat = threading.Thread(target=_beat,
+            args=(stop, lost, patchpool.get_db_connection(), schemaName, loaderName, owner, tract, patch))
+        beat.daemon = True
+        beat.start()
+
+        start = time.time()
+        error = None
+        try:
+            insert_patch(tract, patch)
+        except Exception:
+            patchpool.get_db_connection().rollback()
+            if not lost.is_set():
+                error = traceback.format_exc()
+                misc.warning("Failed: (tract,patch) = ({tract}, {patch})\n{error}".format(**locals()))
+                nFailed += 1
+        finally:
+            stop.set()
+            beat.join()
+
+        # The job is now another worker's, which will complete it.
+        if lost.is_set():
+            continue
+
+        with db.cursor() as cursor:
+            complete(cursor, schemaName, loaderName, owner, tract, patch, time.time() - start, error)
+        db.commit()
+
+    db.close()
+    return nFailed
+
+
+def _beat(stop, lost, insertDb, schemaName, loaderName, owner, tract, patch):
+    """
+    Update the heartbeat of a job every config.queueHeartbeatSeconds until stop is set.
+    If the job has been claimed by another worker, set lost
+    and cancel the statement running on insertDb, lest the patch should be inserted twice.
+    @param insertDb
+        DB connection on which the patch is being inserted.
+    """
+    db = common.new_db_connection()
+    try:
+        while not stop.wait(config.queueHeartbeatSeconds):
+            with db.cursor() as cursor:
+                alive = heartbeat(cursor, schemaName, loaderName, owner, tract, patch)
+            db.commit()
+            if not alive:
+                misc.warning("Claimed by another worker: (tract,patch) = ({tract}, {patch})".format(**locals()))
+                lost.set()
+                insertDb.cancel()
+                break
+    finally:
+        db.close()
+
+
+def is_drained(schemaName, loaderName):
+    """
+    Check whether no patch is waiting or being inserted.
+    Failed patches are not waiting.
+    """
+    db = common.new_db_connection()
+    with db.cursor() as cursor:
+        cursor.execute("""
+        SELECT count(*) FROM "{schemaName}"."_temp:{loaderName}_job" WHERE status IN ('pending', 'running')
+        """.format(**locals())
+        )
+        n, = cursor.fetchone()
+    db.close()
+    return n == 0
+
+
+def report(cursor, schemaName, loaderName):
+    """
+    Print the progress of the queue and the throughput of each worker.
+    @param cursor
+        DB connection's cursor object
+    @param schemaName
+        Name of the schema in which to locate the master table
+    @param loaderName
+        "forced", "meas", etc.
+    """
+    cursor.execute("""
+    SELECT status, count(*) FROM "{schemaName}"."_temp:{loaderName}_job" GROUP BY status ORDER BY status
+    """.format(**locals())
+    )
+    print(", ".join("{}: {}".format(status, n) for status, n in cursor))
+
+    cursor.execute("""
+    SELECT owner, count(*), sum(seconds), extract(epoch FROM max(finished) - min(claimed))
+    FROM "{schemaName}"."_temp:{loaderName}_job"
+    WHERE status = 'done'
+    GROUP BY owner ORDER BY owner
+    """.format(**locals())
+    )
+    rows = cursor.fetchall()
+    if rows:
+        print("{:<32} {:>8} {:>12} {:>14}".format("worker", "patches", "sec/patch", "patches/hour"))
+        for owner, n, seconds, elapsed in rows:
+            perHour = n * 3600.0 / float(elapsed) if elapsed else float("nan")
+            print("{:<32} {:>8} {:>12.1f} {:>14.1f}".format(owner, n, seconds / n, perHour))
+
+    cursor.execute("""
+    SELECT tract, patch, owner, extract(epoch FROM now() - heartbeat)
+    FROM "{schemaName}"."_temp:{loaderName}_job"
+    WHERE status = 'running'
+    ORDER BY tract, patch
+    """.format(**locals())
+    )
+    for tract, patch, owner, age in cursor.fetchall():
+        stale = " (stale)" if age > config.queueStaleSeconds else ""
+        print("running: (tract,patch) = ({tract}, {patch}) by {owner}, heartbeat {age:.0f} sec ago{stale}".format(**locals()))
+
+    cursor.execute("""
+    SELECT tract, patch, attempts, error
+    FROM "{schemaName}"."_temp:{loaderName}_job"
+    WHERE status = 'failed'
+    ORDER BY tract, patch
+    """.format(**locals())
+    )
+    for tract, patch, attempts, error in cursor.fetchall():
+        lastLine = error.strip().splitlines()[-1] if error else ""
+        print("failed: (tract,patch) = ({tract}, {patch}) after {attempts} attempts: {lastLine}".format(**locals()))
+
+
+def retry_failed(cursor, schemaName, loaderName):
+    """
+    Return failed jobs to the queue, together with jobs whose workers
+    have died at their last attempts.
+    @return
+        Number of jobs returned.
+    """
+    staleSeconds = config.queueStaleSeconds
+
+    cursor.execute("""
+    UPDATE "{schemaName}"."_temp:{loaderName}_job"
+    SET status = 'pending', owner = NULL, attempts = 0
+    WHERE status = 'failed'
+        OR (status = 'running' AND heartbeat < now() - %(staleSeconds)s * interval '1 second')
+    """.format(**locals()), dict(staleSeconds=staleSeconds)
+    )
+    return cursor.rowcount
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Predict the sizes of the tables that the loaders (create-table-*.py) would create,
+and the time it would take to load them, from the headers of the catalogs alone.
+"""
+
+import lib.benchmark
+import lib.capacity
+import lib.common
+import lib.config
+import lib.dbtable
+import lib.fits
+import lib.indexbuilder
+import lib.layout
+
+import concurrent.futures
+import importlib.util
+import itertools
+import numpy
+import os
+import sys
+
+scriptDir = os.path.dirname(os.path.abspath(__file__))
+
+loaderNames = ["forced", "meas", "random", "ab"]
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        fromfile_prefix_chars='@',
+        description='Predict table sizes and load time from the headers of the catalogs in a rerun directory.')
+
+    parser.add_argument('rerunDir', help="Rerun directory from which to read data")
+    parser.add_argument("--loaders", nargs="+", choices=loaderNames, default=["forced", "meas"], help="Loaders to plan for")
+    parser.add_argument("--manifest", metavar="FILE", default="",
+        help="Take the numbers of rows from the manifest (an SQLite file) of the rerun directory (See create-table-*.py)")
+    parser.add_argument("--with-skymap-wcs", action="store",
+        help="""Use skymap_wcs at the specified path instead of calexp-*.fits.
+            To generate skymap_wcs, run 'generate-skymap_wcs.py skyMap.pickle'
+        """
+    )
+    parser.add_argument('--pack-flags', action='store_true',
+        help="Plan for tables whose flags are packed into bitmasks (See create-table-*.py)")
+    parser.add_argument('--dedupe-aliases', action='store_true',
+        help="Plan for tables in which aliases are stored only once (See create-table-*.py)")
+    parser.add_argument('--auto-partition', action='store_true',
+        help="Plan for part tables packed automatically (See create-table-*.py)")
+    parser.add_argument('--part-max-columns', type=int, default=1400, metavar="N",
+        help="Maximum number of columns of a part table (with --auto-partition)")
+    parser.add_argument('--part-max-row-width', type=int, default=8000, metavar="BYTES",
+        help="Maximum size of a row of a part table (with --auto-partition)")
+    parser.add_argument('--part-filters', type=int, default=6, metavar="N",
+        help="""Minimum number of filters for which the part tables are sized (with --auto-partition).
+            They are sized for all the filters in the rerun directory if there are more.
+            Give the number of filters that the tables will have in the end (e.g. with --append-band).""")
+    parser.add_argument('--jobs', type=int, default=16,
+        help="Number of threads that read headers in parallel")
+    parser.add_argument('--calibration', metavar="FILE",
+        help="Result of 'benchmark-loaders.py run' on a small rerun, whose rows/s and index seconds/row are used to predict time")
+    parser.add_argument('--rows-per-sec', metavar="loader=N", nargs="+", action="append", default=[],
+        help="Throughput of a loader (rows/s). It overrides that in --calibration.")
+    parser.add_argument('--layout', metavar="FILE",
+        help="Plan for tables in the layout planned by --optimize-layout before")
+    parser.add_argument('--optimize-layout', metavar="FILE",
+        help="""Plan the physical layout of the tables from sampled catalogs, and write it to FILE
+            (to be given to create-table-*.py --layout). The sizes are predicted for that layout.""")
+    parser.add_argument('--layout-samples', type=int, default=8,
+        help="Number of patches sampled by --optimize-layout")
+    parser.add_argument('--table-space-quota', help="Exit with status 1 if the tables are expected to be larger than this (e.g. 2TB)")
+    parser.add_argument('--index-space-quota', help="Exit with status 1 if the indexes are expected to be larger than this (e.g. 500GB)")
+
+    args = parser.parse_args()
+
+    lib.config.withSkymapWcs = args.with_skymap_wcs
+    lib.config.manifest = args.manifest
+    lib.config.packFlags = args.pack_flags
+    lib.config.dedupeAliases = args.dedupe_aliases
+    lib.config.autoPartition = args.auto_partition
+    lib.config.partMaxColumns = args.part_max_columns
+    lib.config.partMaxRowWidth = args.part_max_row_width
+    lib.config.partFilters = args.part_filters
+    lib.config.layout = lib.layout.load(args.layout) if args.layout else {}
+
+    rowsPerSec, indexSecondsPerRow = get_throughputs(args.calibration, dict(
+        (key, float(value)) for key, value in (keyvalue.split('=', 1) for keyvalue in itertools.chain.from_iterable(args.rows_per_sec))
+    ))
+
+    filters = lib.common.get_existing_filters(args.rerunDir)
+    # Part tables are sized for all the filters in the rerun directory.
+    lib.config.partFilters = max(args.part_filters, len(filters))
+    tracts = lib.common.get_existing_tracts(args.rerunDir)
+
+    totalHeap = 0
+    totalIndex = 0
+    tractSeconds = dict((tract, 0.0) for tract in tracts)
+    tractRows = dict((tract, {}) for tract in tracts)
+
+    loaders = dict((name, load_loader(name)) for name in args.loaders)
+    loaderPatchRows = dict(
+        (name, get_patch_rows(loaders[name], name, args.rerunDir, tracts, args.jobs))
+        for name in args.loaders
+    )
+
+    if args.optimize_layout:
+        lib.config.layout = {}
+        stats = {}
+        for name in args.loaders:
+            sample_columns(loaders[name], name, args.rerunDir, filters, sorted(loaderPatchRows[name]), args.layout_samples, stats)
+        lib.config.layout = lib.layout.plan(stats)
+        lib.layout.save(args.optimize_layout, lib.config.layout)
+        tables = lib.config.layout["tables"].values()
+        print("layout: {} columns narrowed, {} columns not stored (written to {})".format(
+            sum(len(table["narrow"]) for table in tables), sum(len(table["empty"]) for table in tables), args.optimize_layout))
+
+    for name in args.loaders:
+        loader = loaders[name]
+        patchRows = loaderPatchRows[name]
+        nRows = sum(patchRows.values())
+        if nRows == 0:
+            print("{}: no catalogs".format(name))
+            continue
+
+        tables = get_tables(loader, name, args.rerunDir, filters)
+
+        print("{}: {} rows in {} patches".format(name, nRows, len(patchRows)))
+        print("  {:<40} {:>8} {:>10} {:>12} {:>12}".format("table", "columns", "row size", "heap", "indexes"))
+        for table in tables:
+            columns = table.get_backend_fields()
+            sqltypes = [sqltype for colname, sqltype in columns]
+            heap = lib.capacity.estimate_heap_size(sqltypes, nRows)
+
+            builder = lib.indexbuilder.IndexBuilder()
+            table.create_index(builder.cursor(), "schema")
+            index = sum(
+                lib.capacity.estimate_index_size_from_sql(sql, columns, nRows)
+                for sql, params, isGiST in itertools.chain.from_iterable(builder.get_indexes())
+            )
+
+            print("  {:<40} {:>8} {:>10} {:>12} {:>12}".format(
+                table.name, len(columns), lib.capacity.get_heap_tuple_size(sqltypes),
+                lib.capacity.format_size(heap), lib.capacity.format_size(index)))
+            totalHeap += heap
+            totalIndex += index
+
+        for (tract, patch), n in patchRows.items():
+            tractRows[tract][name] = tractRows[tract].get(name, 0) + n
+
+        if name in rowsPerSec:
+            for tract in tracts:
+                tractSeconds[tract] += tractRows[tract].get(name, 0) / rowsPerSec[name]
+        if name in indexSecondsPerRow:
+            print("  index creation: {}".format(format_seconds(nRows * indexSecondsPerRow[name])))
+
+    print("total: heap {}, indexes {}".format(lib.capacity.format_size(totalHeap), lib.capacity.format_size(totalIndex)))
+
+    if rowsPerSec:
+        print("{:>8} {:>12} {:>12}".format("tract", "rows", "load time"))
+        for tract in tracts:
+            print("{:>8} {:>12} {:>12}".format(
+                tract, sum(tractRows[tract].values()), format_seconds(tractSeconds[tract])))
+        print("{:>8} {:>12} {:>12}".format(
+            "total", sum(sum(rows.values()) for rows in tractRows.values()), format_seconds(sum(tractSeconds.values()))))
+
+    exceeded = False
+    for quota, size, what in [(args.table_space_quota, totalHeap, "tables"), (args.index_space_quota, totalIndex, "indexes")]:
+        if quota and size > lib.capacity.parse_size(quota):
+            print("The {} ({}) will exceed the quota ({})".format(what, lib.capacity.format_size(size), quota), file=sys.stderr)
+            exceeded = True
+
+    if exceeded:
+        sys.exit(1)
+
+
+def load_loader(name):
+    """
+    Import create-table-{name}.py as a module.
+    The tables are grouped by the functions in it.
+    """
+    path = os.path.join(scriptDir, "create-table-{}.py".format(name))
+    spec = importlib.util.spec_from_file_location("create_table_" + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_tables(loader, name, rerunDir, filters, catalogId=None, headerOnly=True):
+    """
+    Get the tables that the loader would create,
+    as its create_mastertable() gets them, from the header of a catalog.
+    @param catalogId
+        (tract, patch, filter) of the catalog. (Default: any catalog)
+    @param headerOnly
+        If False, the tables have the data of the catalog.
+    @return
+        List of DBTable.
+    """
+    if catalogId is None:
+        catalogId = loader.get_an_exisiting_catalog_id(rerunDir)
+    tract, patch, filter = catalogId
+    catPath = loader.get_catalog_path(rerunDir, tract, patch, filter)
+
+    if name == "forced":
+        refPath = loader.get_ref_path(rerunDir, tract, patch)
+        universals, object_id, coord = loader.get_ref_schema_from_file(refPath, headerOnly=headerOnly)
+        multibands = loader.get_catalog_schema_from_file(catPath, object_id, headerOnly=headerOnly)
+        tables = list(itertools.chain(universals.values(), multibands.values()))
+    elif name == "meas":
+        tablePosition, multibands = loader.get_catalog_schema_from_file(catPath, None, headerOnly=headerOnly)
+        tables = [tablePosition] + list(multibands.values())
+        coord = tablePosition.coords[filter]
+    else:
+        multibands, object_id, coord = loader.get_catalog_schema_from_file(catPath, None, headerOnly=headerOnly)
+        tables = list(multibands.values())
+
+    for table in tables:
+        table.set_filters(filters)
+
+    for table in tables:
+        table.transform(rerunDir, tract, patch, filter, coord)
+
+    return tables
+
+
+def sample_columns(loader, name, rerunDir, filters, patches, nSamples, stats):
+    """
+    Read the catalogs of sampled patches, and collect the statistics
+    of the values of the columns that the loader would store.
+    @param patches
+        List of (tract, patch), from which nSamples patches are taken evenly.
+    @param stats (dict)
+        Map from table name -> {column name -> lib.layout.ColumnStats}.
+        The statistics are added to it.
+    """
+    if not patches:
+        return
+
+    nSamples = max(1, min(nSamples, len(patches)))
+    samples = [patches[i * len(patches) // nSamples] for i in range(nSamples)]
+
+    for tract, patch in samples:
+        for filter in filters:
+            if not lib.common.path_exists(loader.get_catalog_path(rerunDir, tract, patch, filter)):
+                continue
+
+            for table in get_tables(loader, name, rerunDir, [filter], (tract, patch, filter), headerOnly=False):
+                if isinstance(table, lib.dbtable.DBTable_BandIndependent):
+                    members = table.get_backend_field_data("")
+                else:
+                    members = table.get_backend_field_data(filter)
+                    if hasattr(table, "get_bandindependent_backend_field_data"):
+                        members = table.get_bandindependent_backend_field_data() + members
+
+                types = dict(table.get_backend_fields())
+                columns = stats.setdefault(table.name, {})
+                for colname, fmt, cols in members:
+                    if len(cols) != 1:
+                        continue
+                    if colname not in columns:
+                        columns[colname] = lib.layout.ColumnStats(types[colname])
+                    columns[colname].add(numpy.asarray(cols[0]))
+
+
+def get_patch_rows(loader, name, rerunDir, tracts, jobs):
+    """
+    Get the number of objects in each patch, reading NAXIS2 of catalogs in parallel.
+    Only one catalog is read in a patch because all catalogs in it have the same objects.
+    @return
+        {(tract, patch): nRows}
+    """
+    paths = {}
+    for tract in tracts:
+        for patch in loader.get_existing_patches(rerunDir, tract):
+            if name == "forced":
+                paths[tract, patch] = loader.get_ref_path(rerunDir, tract, patch)
+            else:
+                pattern = loader.get_catalog_path(rerunDir, tract, patch, "*")
+                for path in lib.common.iglob_compressed(pattern):
+                    paths[tract, patch] = path[:-3] if path.endswith(".gz") else path
+                    break
+
+    if lib.config.manifest:
+        manifest = lib.common.get_manifest(rerunDir)
+        return dict((key, manifest.get_file(path).naxis2) for key, path in paths.items())
+
+    with concurrent.futures.ThreadPoolExecutor(max(1, jobs)) as executor:
+        return dict(zip(paths.keys(), executor.map(lib.fits.fits_get_nrows, paths.values())))
+
+
+def get_throughputs(calibration, rowsPerSec):
+    """
+    Get the throughputs of the loaders.
+    @param calibration (str)
+        Path to the result of "benchmark-loaders.py run", or None.
+    @param rowsPerSec (dict)
+        {loader: rows/s}, which overrides those in "calibration".
+    @return (rowsPerSec, indexSecondsPerRow)
+        Both are dicts keyed by the names of the loaders.
+    """
+    indexSecondsPerRow = {}
+    if calibration:
+        metrics = lib.benchmark.load(calibration)["metrics"]
+        for name in loaderNames:
+            if name + ".rows_per_sec" in metrics and name not in rowsPerSec:
+                rowsPerSec[name] = metrics[name + ".rows_per_sec"]
+            if name + ".index_seconds" in metrics and metrics.get(name + ".rows"):
+                indexSecondsPerRow[name] = metrics[name + ".index_seconds"] / metrics[name + ".rows"]
+
+    return rowsPerSec, indexSecondsPerRow
+
+
+def format_seconds(seconds):
+    """
+    Format seconds like "1d 02:03:04".
+    """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return "{}d {:02d}:{:02d}:{:02d}".format(days, hours, minutes, seconds)
+    return "{:02d}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2016-2018  Sogo Mineo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Show the progress of the queue of patches shared by loaders
+run with --queue (create-table-*.py), and the throughput of each worker.
+"""
+
+import lib.common
+import lib.config
+import lib.workqueue
+
+import itertools
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        fromfile_prefix_chars='@',
+        description='Show the progress of loaders run with --queue.')
+
+    parser.add_argument('schemaName', help="DB schema name into which data is loaded")
+    parser.add_argument("--loader", choices=["forced", "meas", "random", "ab"], default="forced", help="Loader whose queue to show")
+    parser.add_argument("--db-server", metavar="key=value", nargs="+", action="append", help="DB to connect to. This option must come later than non-optional arguments.")
+    parser.add_argument('--queue-stale', type=float, default=600, metavar="SECONDS",
+       help="Patches whose loaders have not sent heartbeats for this many seconds are shown as stale")
+    parser.add_argument('--retry-failed', action='store_true',
+       help="""Return to the queue the patches that have failed too many times,
+            and stale patches whose loaders have died at their last attempts""")
+
+    args = parser.parse_args()
+
+    if args.db_server:
+        lib.config.dbServer.update(keyvalue.split('=', 1) for keyvalue in itertools.chain.from_iterable(args.db_server))
+
+    lib.config.queueStaleSeconds = args.queue_stale
+
+    db = lib.common.new_db_connection()
+    with db.cursor() as cursor:
+        if args.retry_failed:
+            n = lib.workqueue.retry_failed(cursor, args.schemaName, args.loader)
+            print("Returned to the queue: {} patches".format(n))
+        lib.workqueue.report(cursor, args.schemaName, args.loader)
+    db.commit()
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Tests of lib.algobase.PrefixDispatcher on fields not read by SourceTable.from_hdu().
+
+    python test/test_dispatcher.py
+"""
+
+import os
+import sys
+import unittest
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy
+
+import lib.algobase
+import lib.sourcetable
+from lib.misc import PoppingOrderedDict
+
+
+class Algo_a(object):
+    sourceprefixes = ["a_"]
+
+
+class Algo_b(object):
+    sourceprefixes = ["b_"]
+
+
+class Header(dict):
+    """
+    Header of a binary table, with a fingerprint like that of fits.fits_open_table().
+    Read plans are cached by fingerprint, so each test uses its own fingerprints.
+    """
+    def __init__(self, names, fingerprint):
+        dict.__init__(self, TFIELDS=len(names))
+        for i, name in enumerate(names, start=1):
+            self["TTYPE{}".format(i)] = name
+        self.fingerprint = fingerprint
+
+
+class HDU(object):
+    def __init__(self, names, fingerprint):
+        self.header = Header(names, fingerprint)
+        self.data = numpy.zeros(3, dtype=[(name, "f8") for name in names])
+
+
+class TestDispatcher(unittest.TestCase):
+    def setUp(self):
+        algos = PoppingOrderedDict([("a", Algo_a), ("b", Algo_b)])
+        self.dispatcher = lib.algobase.PrefixDispatcher(algos, ["ignored_"])
+        self.prefixes = lib.algobase.get_sourceprefixes(algos.values())
+
+    def dispatch(self, hdu):
+        table = lib.sourcetable.SourceTable.from_hdu(hdu, self.prefixes)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            subtables = self.dispatcher.dispatch(table)
+        return subtables, [str(w.message) for w in caught]
+
+    def test_unknown_field_is_reported(self):
+        names = ["a_flux", "b_flux", "ignored_x", "new_column"]
+        subtables, messages = self.dispatch(HDU(names, "unknown"))
+
+        self.assertEqual(list(subtables["a"].fields), ["a_flux"])
+        self.assertEqual(list(subtables["b"].fields), ["b_flux"])
+        self.assertEqual(len(messages), 1)
+        self.assertIn("new_column", messages[0])
+        self.assertNotIn("ignored_x", messages[0])
+
+    def test_reported_once_per_fingerprint(self):
+        names = ["a_flux", "new_column"]
+        self.assertEqual(len(self.dispatch(HDU(names, "once1"))[1]), 1)
+        self.assertEqual(len(self.dispatch(HDU(names, "once1"))[1]), 0)
+        self.assertEqual(len(self.dispatch(HDU(names, "once2"))[1]), 1)
+
+    def test_nothing_reported_if_all_taken(self):
+        names = ["a_flux", "b_flux", "ignored_x"]
+        self.assertEqual(self.dispatch(HDU(names, "taken"))[1], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Tests of lib.workqueue against a PostgreSQL server.
+
+The server is given by the environment variable TEST_DB_SERVER
+in the same format as --db-server (e.g. "host=localhost dbname=test").
+The tests are skipped if it is not set. They create and drop a schema.
+
+    TEST_DB_SERVER="dbname=test" python test/test_workqueue.py
+"""
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import lib.common
+import lib.config
+import lib.patchpool
+import lib.workqueue
+
+schemaName = "test:workqueue"
+loaderName = "forced"
+
+
+@unittest.skipUnless(os.environ.get("TEST_DB_SERVER"), "TEST_DB_SERVER is not set")
+class TestWorkQueue(unittest.TestCase):
+    def setUp(self):
+        lib.config.dbServer = dict(keyvalue.split('=', 1) for keyvalue in os.environ["TEST_DB_SERVER"].split())
+        lib.config.queueStaleSeconds = 600
+        lib.config.queueMaxAttempts = 2
+
+        self.db = lib.common.new_db_connection()
+        with self.db.cursor() as cursor:
+            cursor.execute('DROP SCHEMA IF EXISTS "{schemaName}" CASCADE'.format(**globals()))
+            cursor.execute('CREATE SCHEMA "{schemaName}"'.format(**globals()))
+        self.db.commit()
+
+    def tearDown(self):
+        with self.db.cursor() as cursor:
+            cursor.execute('DROP SCHEMA IF EXISTS "{schemaName}" CASCADE'.format(**globals()))
+        self.db.commit()
+        self.db.close()
+
+    def claim(self, owner):
+        with self.db.cursor() as cursor:
+            job = lib.workqueue.claim(cursor, schemaName, loaderName, owner)
+        self.db.commit()
+        return job
+
+    def kill(self, tract, patch):
+        """
+        Make the heartbeat of a job stale, as if its worker had died.
+        """
+        with self.db.cursor() as cursor:
+            cursor.execute("""
+            UPDATE "{schemaName}"."_temp:{loaderName}_job"
+            SET heartbeat = now() - interval '1 hour'
+            WHERE tract = %s AND patch = %s
+            """.format(**globals()), (tract, patch)
+            )
+        self.db.commit()
+
+    def status(self, tract, patch):
+        with self.db.cursor() as cursor:
+            cursor.execute("""
+            SELECT status, attempts FROM "{schemaName}"."_temp:{loaderName}_job"
+            WHERE tract = %s AND patch = %s
+            """.format(**globals()), (tract, patch)
+            )
+            ret = cursor.fetchone()
+        self.db.commit()
+        return ret
+
+    def test_stale_job_is_claimed_again(self):
+        lib.workqueue.enqueue(schemaName, loaderName, [(0, 101)])
+        self.assertEqual(self.claim("a"), (0, 101))
+        self.assertIsNone(self.claim("b"))
+
+        self.kill(0, 101)
+        self.assertEqual(self.claim("b"), (0, 101))
+        self.assertEqual(self.status(0, 101), ("running", 2))
+
+    def test_stale_job_at_last_attempt_fails(self):
+        lib.workqueue.enqueue(schemaName, loaderName, [(0, 101)])
+        for owner in ["a", "b"]:
+            self.assertEqual(self.claim(owner), (0, 101))
+            self.kill(0, 101)
+
+        self.assertIsNone(self.claim("c"))
+        self.assertEqual(self.status(0, 101), ("failed", 2))
+        self.assertTrue(lib.workqueue.is_drained(schemaName, loaderName))
+
+        with self.db.cursor() as cursor:
+            self.assertEqual(lib.workqueue.retry_failed(cursor, schemaName, loaderName), 1)
+        self.db.commit()
+        self.assertEqual(self.claim("c"), (0, 101))
+
+    def test_live_job_at_last_attempt_is_kept(self):
+        lib.workqueue.enqueue(schemaName, loaderName, [(0, 101)])
+        self.claim("a")
+        self.kill(0, 101)
+        self.claim("b")
+
+        self.assertIsNone(self.claim("c"))
+        self.assertEqual(self.status(0, 101), ("running", 2))
+        self.assertFalse(lib.workqueue.is_drained(schemaName, loaderName))
+
+    def test_reclaimed_job_is_given_up(self):
+        lib.config.queueHeartbeatSeconds = 0.1
+        lib.workqueue.enqueue(schemaName, loaderName, [(0, 101)])
+
+        def insert_patch(tract, patch):
+            # Another worker takes the job over while this one is inserting the patch.
+            self.kill(tract, patch)
+            self.assertEqual(self.claim("b"), (tract, patch))
+            with lib.patchpool.get_db_connection().cursor() as cursor:
+                cursor.execute("SELECT pg_sleep(60)")
+
+        lib.patchpool.init_worker()
+        try:
+            start = time.time()
+            self.assertEqual(lib.workqueue._work(insert_patch, schemaName, loaderName), 0)
+            self.assertLess(time.time() - start, 30)
+        finally:
+            lib.patchpool.get_db_connection().close()
+
+        self.assertEqual(self.status(0, 101), ("running", 2))
+
+
+if __name__ == "__main__":
+    unittest.main()